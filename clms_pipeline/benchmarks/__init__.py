@@ -0,0 +1 @@
+# clms_pipeline.benchmarks package init
@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+
+# Local stand-in for CLMS_downloader.py: serves the zips written by
+# clms_pipeline.benchmarks.synthetic instead of querying the CLMS API. It takes the same
+# arguments and writes the same output (zips plus result_file.txt) into the output directory.
+# Set clms_downloader_script to this file and CLMS_SYNTHETIC_DIR to the product directory.
+PRODUCTS_ENV = "CLMS_SYNTHETIC_DIR"
+DEFAULT_PRODUCTS_DIR = "data/benchmark/products"
+MANIFEST_NAME = "synthetic_products.json"
+
+
+def normalize_tile(tile):
+    tile = tile.strip().upper()
+    return tile[1:] if len(tile) == 6 and tile.startswith("T") else tile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve synthetic HRSI products like CLMS_downloader.py.")
+    parser.add_argument("-query", action="store_true")
+    parser.add_argument("-download", action="store_true")
+    parser.add_argument("-query_and_download", action="store_true")
+    parser.add_argument("-productIdentifier", required=True)
+    parser.add_argument("-productType", required=True)
+    parser.add_argument("-obsDateMin", required=True)
+    parser.add_argument("-obsDateMax", required=True)
+    parser.add_argument("-hrsi_credentials")
+    parser.add_argument("output_dir")
+    args = parser.parse_args(argv)
+
+    products_dir = os.environ.get(PRODUCTS_ENV, DEFAULT_PRODUCTS_DIR)
+    manifest_path = os.path.join(products_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        print(f"No synthetic products found in {products_dir}")
+        return 1
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+
+    tile = normalize_tile(args.productIdentifier)
+    start, end = args.obsDateMin[:10], args.obsDateMax[:10]
+    matches = [p for p in manifest["products"]
+               if normalize_tile(p["tile"]) == tile and p["product_type"] == args.productType
+               and start <= p["date"] <= end]
+    os.makedirs(args.output_dir, exist_ok=True)
+    if not args.query:
+        for product in matches:
+            shutil.copy(os.path.join(products_dir, f"{product['id']}.zip"), args.output_dir)
+    with open(os.path.join(args.output_dir, "result_file.txt"), "w") as f:
+        for product in matches:
+            f.write(product["id"] + "\n")
+    print(f"{len(matches)} products found for {tile} {args.productType} {start}..{end}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import threading
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from clms_pipeline.benchmarks.fake_downloader import DEFAULT_PRODUCTS_DIR, MANIFEST_NAME, normalize_tile
+from clms_pipeline.hrsi_client import AUTH_PATH, SEARCH_PATH
+
+# Local stand-in for the CLMS catalogue and download API, serving the zips of
+# clms_pipeline.benchmarks.synthetic to the in-process client (download_client="native").
+# Supports token auth, paged search, Range requests, and can cut transfers short to test resuming.
+TOKEN = "mock-token"
+DOWNLOAD_PATH = "/download/"
+
+
+def file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # Set by make_server
+    products_dir = None
+    products = []
+    fail_after = None
+    failed = set()
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == AUTH_PATH:
+            if self.headers.get("Authorization", "").startswith("Basic "):
+                return self.send_json({"token": TOKEN})
+            return self.send_json({"error": "credentials required"}, 401)
+        if url.path == SEARCH_PATH:
+            return self.search(parse_qs(url.query))
+        if url.path.startswith(DOWNLOAD_PATH):
+            if self.headers.get("Authorization") != f"Bearer {TOKEN}":
+                return self.send_json({"error": "invalid token"}, 401)
+            return self.send_product(os.path.basename(url.path))
+        self.send_json({"error": "not found"}, 404)
+
+    def search(self, query):
+        tile = normalize_tile(query.get("productIdentifier", [""])[0].strip("%"))
+        product_type = query.get("productType", [""])[0]
+        start, end = query.get("obsDateMin", [""])[0][:10], query.get("obsDateMax", ["9999"])[0][:10]
+        page_size = int(query.get("maxRecords", ["500"])[0])
+        page = int(query.get("page", ["1"])[0])
+        matches = [p for p in self.products if normalize_tile(p["tile"]) == tile
+                   and p["product_type"] == product_type and start <= p["date"] <= end]
+        features = []
+        for product in matches[(page - 1) * page_size:page * page_size]:
+            path = os.path.join(self.products_dir, f"{product['id']}.zip")
+            features.append({"id": product["id"], "properties": {
+                "productIdentifier": product["id"],
+                "services": {"download": {
+                    "url": f"http://{self.headers.get('Host')}{DOWNLOAD_PATH}{product['id']}.zip",
+                    "size": os.path.getsize(path),
+                    "checksum": f"md5:{file_md5(path)}",
+                }},
+            }})
+        self.send_json({"type": "FeatureCollection", "features": features})
+
+    def send_product(self, name):
+        path = os.path.join(self.products_dir, name)
+        if not os.path.isfile(path):
+            return self.send_json({"error": "not found"}, 404)
+        size = os.path.getsize(path)
+        start = 0
+        range_header = self.headers.get("Range", "")
+        if range_header.startswith("bytes="):
+            start = int(range_header[6:].split("-")[0])
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        remaining = size - start
+        # The first transfer of each file stops after fail_after bytes
+        with self.lock:
+            cut = self.fail_after is not None and name not in self.failed
+            if cut:
+                self.failed.add(name)
+        if cut:
+            remaining = min(remaining, self.fail_after)
+        with open(path, "rb") as f:
+            f.seek(start)
+            while remaining > 0:
+                chunk = f.read(min(1 << 16, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+        if cut:
+            self.close_connection = True
+
+
+def make_server(products_dir, host="127.0.0.1", port=0, fail_after=None):
+    with open(os.path.join(products_dir, MANIFEST_NAME), "r") as f:
+        products = json.load(f)["products"]
+    handler = type("Handler", (MockHandler,), {"products_dir": products_dir, "products": products,
+                                               "fail_after": fail_after, "failed": set(),
+                                               "lock": threading.Lock()})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_server(products_dir, fail_after=None):
+    # Serves in a daemon thread; returns the server and its base URL (for clms_api_url)
+    server = make_server(products_dir, fail_after=fail_after)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve synthetic HRSI products through a mock CLMS API.")
+    parser.add_argument("products_dir", nargs="?", default=DEFAULT_PRODUCTS_DIR)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail-after", type=int, help="Cut the first transfer of each file after this many bytes.")
+    args = parser.parse_args(argv)
+    server = make_server(args.products_dir, args.host, args.port, args.fail_after)
+    print(f"Serving {args.products_dir} on http://{args.host}:{args.port} (set clms_api_url to this URL)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
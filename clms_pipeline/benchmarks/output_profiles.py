@@ -0,0 +1,103 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import rasterio
+from rasterio.windows import Window
+
+from clms_pipeline.writer import OUTPUT_PROFILES, RasterWriter
+
+# Layers that represent the bulk of the archive: FSC snow fractions and GFSC gap-filled cover
+DEFAULT_LAYERS = {"FSC": ["FSCOG", "FSCTOC"], "GFSC": ["GF"]}
+
+
+def find_sample_layers(data_dir, max_files):
+    samples = []
+    for product_type, layers in DEFAULT_LAYERS.items():
+        for layer in layers:
+            pattern = os.path.join(data_dir, "**", product_type, "*", f"*_{layer}.tif")
+            samples.extend(sorted(glob.glob(pattern, recursive=True))[:max_files])
+    return samples
+
+
+def get_file_size(path):
+    return sum(os.path.getsize(p) for p in glob.glob(f"{path}*"))
+
+
+def benchmark_profile(profile_name, profile, sample_paths, work_dir, repeats):
+    writer = RasterWriter(profile)
+    stats = {"profile": profile_name, "files": 0, "write_s": 0.0, "read_s": 0.0, "window_read_s": 0.0,
+             "bytes": 0, "source_bytes": 0}
+    for sample_path in sample_paths:
+        with rasterio.open(sample_path) as src:
+            data = src.read()
+            meta = src.meta.copy()
+        out_path = os.path.join(work_dir, f"{profile_name}_{os.path.basename(sample_path)}")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            writer.write(out_path, data, meta)
+            stats["write_s"] += (time.perf_counter() - start) / repeats
+            start = time.perf_counter()
+            with rasterio.open(out_path) as src:
+                src.read()
+            stats["read_s"] += (time.perf_counter() - start) / repeats
+            # A 512 x 512 read from the centre, as an AOI-windowed step does
+            start = time.perf_counter()
+            with rasterio.open(out_path) as src:
+                width, height = min(512, src.width), min(512, src.height)
+                src.read(window=Window((src.width - width) // 2, (src.height - height) // 2, width, height))
+            stats["window_read_s"] += (time.perf_counter() - start) / repeats
+        stats["files"] += 1
+        stats["bytes"] += get_file_size(out_path)
+        stats["source_bytes"] += os.path.getsize(sample_path)
+    return stats
+
+
+def print_table(results):
+    print(f"{'profile':<10} {'files':>5} {'write s':>9} {'read s':>9} {'window s':>9} {'MB':>9} {'ratio':>7}")
+    for r in results:
+        ratio = r["bytes"] / r["source_bytes"] if r["source_bytes"] else 0
+        print(f"{r['profile']:<10} {r['files']:>5} {r['write_s']:>9.3f} {r['read_s']:>9.3f} "
+              f"{r['window_read_s']:>9.3f} {r['bytes'] / 1e6:>9.2f} {ratio:>7.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare write time, read time and size of the output profiles.")
+    parser.add_argument("paths", nargs="*", help="Layers to benchmark. Defaults to FSC and GFSC layers found under --data-dir.")
+    parser.add_argument("--data-dir", default="data/clms_data/original")
+    parser.add_argument("--max-files", type=int, default=5, help="Maximum sample files per layer type.")
+    parser.add_argument("--profiles", nargs="*", default=sorted(OUTPUT_PROFILES))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    sample_paths = args.paths or find_sample_layers(args.data_dir, args.max_files)
+    if not sample_paths:
+        print(f"No FSC/GFSC layers found under {args.data_dir}.")
+        return 1
+    print(f"Benchmarking {len(args.profiles)} profiles on {len(sample_paths)} layers...")
+    work_dir = tempfile.mkdtemp(prefix="clms_profiles_")
+    results = []
+    try:
+        for profile_name in args.profiles:
+            try:
+                results.append(benchmark_profile(profile_name, OUTPUT_PROFILES[profile_name], sample_paths,
+                                                 work_dir, args.repeats))
+            except Exception as e:
+                # e.g. LERC or ZSTD missing from the local GDAL build
+                print(f"Profile {profile_name} failed: {e}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+from config import CLMSConfig
+from clms_pipeline.benchmarks import fake_downloader
+from clms_pipeline.benchmarks.synthetic import generate_products, get_intersecting_tiles, write_reference_rasters
+from clms_pipeline.cli import parse_option
+from clms_pipeline.pipeline import CLMSPipeline
+from clms_pipeline.run_report import RunReport
+
+DEFAULT_TILES = ["32TPS", "32TQS", "32TPR", "32TQR"]
+# Options of the benchmarked run; --set overrides them, e.g. --set fused_processing=true
+BENCH_OPTIONS = {
+    "clms_query_type": "query_and_download",
+    "mosaic_output": True,
+    "reclassify": True,
+    "crop_resample": True,
+    "filter_cc": True,
+    "cc_threshold": 0.5,
+    "step_cache": False,
+    "incremental": False,
+}
+_mock_servers = {}
+
+
+def parse_scale(text):
+    # "DAYSxTILESxAOIS", e.g. "5x2x3"
+    days, tiles, aois = (int(part) for part in text.lower().split("x"))
+    return {"days": days, "tiles": tiles, "aois": aois}
+
+
+def get_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_mock_server_url(products_dir):
+    # The in-process client (download_client="native") downloads from a local mock API instead
+    from clms_pipeline.benchmarks.mock_server import start_server
+    if products_dir not in _mock_servers:
+        _mock_servers[products_dir] = start_server(products_dir)[1]
+    return _mock_servers[products_dir]
+
+
+def prepare_run(run_dir, tiles, aois, start_date, days, products_dir, products, options):
+    # Fresh workspace with reference rasters and tile lists, so the tile determination (which
+    # needs the Sentinel-2 KML) is skipped
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)
+    raster_dir = os.path.join(run_dir, "data", "reference_raster")
+    entries = write_reference_rasters(raster_dir, tiles, aois)
+    tile_dir = os.path.join(run_dir, "data", "tile_system")
+    os.makedirs(tile_dir, exist_ok=True)
+    for entry in entries:
+        with open(os.path.join(tile_dir, f"relevant_tiles_{os.path.splitext(entry['name'])[0]}.txt"), "w") as f:
+            f.write("\n".join(get_intersecting_tiles(entry, tiles)) + "\n")
+    end_date = datetime.strptime(start_date, "%Y-%m-%d") + timedelta(days=days - 1)
+    settings = dict(BENCH_OPTIONS)
+    settings.update(options)
+    os.environ[fake_downloader.PRODUCTS_ENV] = os.path.abspath(products_dir)
+    if settings.get("download_client") == "native" and "clms_api_url" not in options:
+        settings["clms_api_url"] = get_mock_server_url(products_dir)
+    return CLMSConfig(
+        reference_rasters=[{"name": e["name"], "crs": e["crs"]} for e in entries],
+        clms_username="benchmark",
+        clms_password="benchmark",
+        reference_raster_dir="data/reference_raster/",
+        start_date=f"{start_date}T00:00:00Z",
+        end_date=end_date.strftime("%Y-%m-%dT23:59:59Z"),
+        output_path_original="data/clms_data/original/",
+        output_path_processed="data/clms_data/processed/",
+        clms_product=list(products),
+        clms_downloader_script=os.path.abspath(fake_downloader.__file__),
+        **settings,
+    )
+
+
+def run_pipeline(config, run_dir):
+    # Every step but the tile determination, timed by the run report of the pipeline
+    cwd = os.getcwd()
+    os.chdir(run_dir)
+    try:
+        pipeline = CLMSPipeline(config)
+        report = RunReport(config)
+        for step in pipeline.get_steps():
+            if step.name == "tiles":
+                continue
+            report.start_step(step)
+            step.run()
+            report.end_step("ran")
+        return report.to_dict()
+    finally:
+        os.chdir(cwd)
+
+
+def summarize(runs):
+    # Fastest repeat per scale and step
+    summary = {}
+    for run in runs:
+        key = run["scale_name"]
+        entry = summary.setdefault(key, {"wall_s": run["wall_s"], "steps": {}})
+        entry["wall_s"] = min(entry["wall_s"], run["wall_s"])
+        for step in run["steps"]:
+            steps = entry["steps"]
+            steps[step["step"]] = min(steps.get(step["step"], step["wall_s"]), step["wall_s"])
+    return summary
+
+
+def print_table(summary, previous=None):
+    print(f"{'scale':<10} {'step':<14} {'wall s':>9} {'previous':>9} {'change':>8}")
+    for scale, entry in summary.items():
+        rows = list(entry["steps"].items()) + [("end-to-end", entry["wall_s"])]
+        for step, seconds in rows:
+            before = None
+            if previous and scale in previous:
+                before = previous[scale]["wall_s"] if step == "end-to-end" else previous[scale]["steps"].get(step)
+            if before:
+                print(f"{scale:<10} {step:<14} {seconds:>9.2f} {before:>9.2f} {(seconds / before - 1) * 100:>+7.1f}%")
+            else:
+                print(f"{scale:<10} {step:<14} {seconds:>9.2f} {'':>9} {'':>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the pipeline steps on synthetic HRSI products, offline.")
+    parser.add_argument("--scales", nargs="*", default=["2x2x1"],
+                        help="Scales as DAYSxTILESxAOIS; tiles are taken from --tiles in order.")
+    parser.add_argument("--tiles", nargs="*", default=DEFAULT_TILES)
+    parser.add_argument("--products", nargs="*", default=["FSC", "GFSC"])
+    parser.add_argument("--start-date", default="2023-07-01")
+    parser.add_argument("--size", type=int, default=549, help="Pixels per side of a synthetic tile (5490 = 20 m).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", dest="options",
+                        help="Config option of the benchmarked run, value parsed as JSON when possible.")
+    parser.add_argument("--work-dir", default="data/benchmark")
+    parser.add_argument("--json", help="Results file (default: <work-dir>/results/bench_<timestamp>.json).")
+    parser.add_argument("--compare", help="Earlier results file to compare against.")
+    args = parser.parse_args(argv)
+
+    options = dict(parse_option(o) for o in args.options)
+    work_dir = os.path.abspath(args.work_dir)
+    logging.basicConfig(level=getattr(logging, str(options.get("log_level", "WARNING")).upper()), format="%(message)s")
+    started = datetime.now(timezone.utc)
+    runs = []
+    for scale in (parse_scale(s) for s in args.scales):
+        if scale["tiles"] > len(args.tiles):
+            print(f"Scale needs {scale['tiles']} tiles but only {len(args.tiles)} are given, skipping.")
+            continue
+        tiles = args.tiles[:scale["tiles"]]
+        scale_name = f"{scale['days']}x{scale['tiles']}x{scale['aois']}"
+        products_dir = os.path.join(work_dir, "products", f"{scale['days']}d_{'_'.join(tiles)}_{args.size}")
+        print(f"=== Scale {scale_name}: generating products ===")
+        manifest = generate_products(products_dir, tiles, args.products, args.start_date, scale["days"],
+                                     size=args.size, seed=args.seed)
+        for repeat in range(args.repeats):
+            run_dir = os.path.join(work_dir, "runs", scale_name)
+            config = prepare_run(run_dir, tiles, scale["aois"], args.start_date, scale["days"], products_dir,
+                                 args.products, options)
+            print(f"=== Scale {scale_name}: run {repeat + 1}/{args.repeats} ===")
+            report = run_pipeline(config, run_dir)
+            runs.append({"scale_name": scale_name, "scale": scale, "repeat": repeat,
+                         "products": len(manifest["products"]), **report})
+
+    results = {
+        "created": started.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "revision": get_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "products": args.products,
+        "size": args.size,
+        "seed": args.seed,
+        "options": options,
+        "runs": runs,
+        "summary": summarize(runs),
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f).get("summary")
+    print_table(results["summary"], previous)
+    json_path = args.json or os.path.join(work_dir, "results", f"bench_{started.strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(json_path)), exist_ok=True)
+    with open(json_path, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f"Results written to {json_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
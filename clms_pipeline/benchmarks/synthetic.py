@@ -0,0 +1,169 @@
+import os
+import json
+import zipfile
+from datetime import datetime, timedelta
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+# Layers written per product, and which of them carry snow values (0-100 with 205/255 codes)
+PRODUCT_LAYERS = {
+    "FSC": ["FSCTOC", "FSCOG", "NDSI", "CLD", "QCFLAGS", "QCOG", "QCTOC"],
+    "PSA": ["PSA", "QC"],
+    "GFSC": ["GF", "QC", "AT"],
+    "WDS": ["SSC", "QCSSC"],
+    "SWS": ["WSM", "QCWSM"],
+}
+VALUE_LAYERS = {"FSCTOC", "FSCOG", "NDSI", "GF", "PSA", "SSC", "WSM"}
+S2_TILE_SIZE = 109800  # metres, 100 km plus the 9.8 km overlap
+MANIFEST_NAME = "synthetic_products.json"
+
+MGRS_COLUMNS = ["ABCDEFGH", "JKLMNPQR", "STUVWXYZ"]
+MGRS_ROWS = "ABCDEFGHJKLMNPQRSTUV"
+LATITUDE_BANDS = "CDEFGHJKLMNPQRSTUVWX"
+
+
+def get_tile_grid(tile):
+    # UTM CRS and upper-left corner of a Sentinel-2 (MGRS) tile, e.g. "32TPS"
+    tile = tile.upper().lstrip("T") if len(tile) == 6 else tile.upper()
+    zone, band, column, row = int(tile[:2]), tile[2], tile[3], tile[4]
+    easting = (MGRS_COLUMNS[(zone - 1) % 3].index(column) + 1) * 100000
+    row_index = MGRS_ROWS.index(row)
+    if zone % 2 == 0:
+        row_index = (row_index - 5) % 20
+    north = band >= "N"
+    # The row letters repeat every 2000 km; the latitude band picks the cycle
+    band_min_lat = -80 + 8 * LATITUDE_BANDS.index(band)
+    band_min_northing = band_min_lat * 110574 + (0 if north else 10000000)
+    northing = row_index * 100000
+    while northing + 100000 < band_min_northing:
+        northing += 2000000
+    crs = CRS.from_epsg((32600 if north else 32700) + zone)
+    # Tiles start at the upper-left corner of their 100 km square and overlap the squares
+    # to the east and south
+    return crs, easting, northing + 100000
+
+
+def get_product_id(product_type, tile, day, platform="S2A"):
+    stamp = day.strftime("%Y%m%d")
+    if product_type == "GFSC":
+        return f"GFSC_{stamp}-007_S2_T{tile}_V101_1"
+    return f"{product_type}_{stamp}T102559_{platform}_T{tile}_V102_1"
+
+
+def smooth_field(rng, size, cells=8):
+    # Blocky low-frequency noise in [0, 1], upsampled from a coarse random grid
+    coarse = rng.random((cells, cells))
+    reps = int(np.ceil(size / cells))
+    return np.kron(coarse, np.ones((reps, reps)))[:size, :size]
+
+
+def make_layers(rng, product_type, size, cloud_fraction, swath_fraction):
+    snow = smooth_field(rng, size)
+    values = np.clip((snow - 0.3) * 160, 0, 100).astype(np.uint8)
+    clouds = smooth_field(rng, size, cells=16) < cloud_fraction
+    # Part of the tile outside the swath, cut along a diagonal
+    rows, cols = np.indices((size, size))
+    outside = (rows + cols) < 2 * size * swath_fraction
+    layers = {}
+    for layer in PRODUCT_LAYERS[product_type]:
+        if layer in VALUE_LAYERS:
+            arr = values.copy()
+            arr[clouds] = 205
+        elif layer == "CLD":
+            arr = clouds.astype(np.uint8)
+        else:
+            arr = rng.integers(0, 4, (size, size), dtype=np.uint8)
+        arr[outside] = 255
+        layers[layer] = arr
+    return layers
+
+
+def write_product(zip_path, product_id, crs, transform, layers):
+    tmp_dir = zip_path + ".tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for layer, arr in layers.items():
+                name = f"{product_id}_{layer}.tif"
+                tif_path = os.path.join(tmp_dir, name)
+                with rasterio.open(tif_path, "w", driver="GTiff", width=arr.shape[1], height=arr.shape[0], count=1,
+                                   dtype="uint8", crs=crs, transform=transform, nodata=255, compress="lzw") as dst:
+                    dst.write(arr, 1)
+                zf.write(tif_path, f"{product_id}/{name}")
+                os.remove(tif_path)
+    finally:
+        os.rmdir(tmp_dir)
+
+
+def generate_products(out_dir, tiles, product_types, start_date, days, size=549, seed=0,
+                      cloud_range=(0.0, 0.8), swath_range=(0.0, 0.3)):
+    # Writes one zipped product per tile, product and day, plus a JSON manifest the fake
+    # downloader serves them from. Existing products with the same parameters are kept.
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    params = {"tiles": sorted(tiles), "product_types": sorted(product_types), "start_date": start_date,
+              "days": days, "size": size, "seed": seed, "cloud_range": list(cloud_range), "swath_range": list(swath_range)}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("params") == params:
+            return manifest
+    rng = np.random.default_rng(seed)
+    first_day = datetime.strptime(start_date[:10], "%Y-%m-%d")
+    products = []
+    for tile in tiles:
+        crs, left, top = get_tile_grid(tile)
+        transform = from_origin(left, top, S2_TILE_SIZE / size, S2_TILE_SIZE / size)
+        for offset in range(days):
+            day = first_day + timedelta(days=offset)
+            for product_type in product_types:
+                product_id = get_product_id(product_type, tile, day)
+                cloud_fraction = float(rng.uniform(*cloud_range))
+                layers = make_layers(rng, product_type, size, cloud_fraction, float(rng.uniform(*swath_range)))
+                write_product(os.path.join(out_dir, f"{product_id}.zip"), product_id, crs, transform, layers)
+                products.append({"id": product_id, "tile": tile, "product_type": product_type,
+                                 "date": day.strftime("%Y-%m-%d"), "cloud_fraction": cloud_fraction})
+    manifest = {"params": params, "products": products}
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def write_reference_rasters(out_dir, tiles, count, extent=20000, resolution=100):
+    # ESRI ASCII AOIs in the UTM zone of the first tile, centred on the union of the tiles in
+    # that zone (so AOIs on neighbouring tiles need mosaicking) and shifted 5 km apart
+    os.makedirs(out_dir, exist_ok=True)
+    crs, _, _ = get_tile_grid(tiles[0])
+    grids = [get_tile_grid(t) for t in tiles]
+    same_zone = [(left, top) for c, left, top in grids if c == crs]
+    center_x = (min(l for l, _ in same_zone) + max(l for l, _ in same_zone) + S2_TILE_SIZE) / 2
+    center_y = (min(t for _, t in same_zone) - S2_TILE_SIZE + max(t for _, t in same_zone)) / 2
+    cells = int(extent / resolution)
+    entries = []
+    for i in range(count):
+        name = f"aoi_{i:03d}.asc"
+        x0 = center_x - extent / 2 + (i % 4) * 5000
+        y0 = center_y - extent / 2 + (i // 4) * 5000
+        with open(os.path.join(out_dir, name), "w") as f:
+            f.write(f"ncols {cells}\nnrows {cells}\nxllcorner {x0}\nyllcorner {y0}\ncellsize {resolution}\nNODATA_value -9999\n")
+            row = " ".join(["1000"] * cells)
+            for _ in range(cells):
+                f.write(row + "\n")
+        entries.append({"name": name, "crs": crs.to_string(),
+                        "bounds": (x0, y0, x0 + extent, y0 + extent)})
+    return entries
+
+
+def get_intersecting_tiles(entry, tiles):
+    # Tiles (in the AOI's CRS) whose footprint overlaps the AOI bounds
+    left, bottom, right, top = entry["bounds"]
+    result = []
+    for tile in tiles:
+        crs, tile_left, tile_top = get_tile_grid(tile)
+        if crs.to_string() != entry["crs"]:
+            continue
+        if tile_left < right and tile_left + S2_TILE_SIZE > left and tile_top - S2_TILE_SIZE < top and tile_top > bottom:
+            result.append(tile)
+    return result
@@ -0,0 +1,112 @@
+import sys
+import json
+import argparse
+import importlib
+import importlib.util
+
+# Subcommand per pipeline step. Which of them a run has depends on the config (fused_processing,
+# streaming), so they are listed here and checked against the config's steps when run.
+STEP_COMMANDS = {
+    "tiles": "Determine the Sentinel-2 tiles of each reference raster.",
+    "download": "Query and download the CLMS products.",
+    "unzip": "Unzip the downloaded products.",
+    "mosaic": "Mosaic the tiles of each date.",
+    "cloud_scores": "Score the cloud coverage of the downloaded scenes.",
+    "reclassify": "Reclassify the product layers.",
+    "resample": "Crop and resample the layers to the reference rasters.",
+    "cloud_filter": "Filter out cloudy scenes.",
+    "fused": "Reclassify, resample and cloud filter in one pass (fused_processing).",
+    "stream": "Download and process in overlapping windows (streaming).",
+    "datacube": "Export the filtered layers as a datacube.",
+}
+OPTIONS_WITH_VALUE = ("--config", "--set", "--force")
+
+
+def parse_option(text):
+    key, _, value = text.partition("=")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def load_config(path=None, options=()):
+    # config of a python file (the project's config.py by default), with KEY=VALUE overrides
+    if path is None:
+        config = importlib.import_module("config").config
+    else:
+        spec = importlib.util.spec_from_file_location("clms_user_config", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        config = module.config
+    for key, value in (parse_option(o) for o in options):
+        setattr(config, key, value)
+    return config
+
+
+def add_config_options(parser, prefix=""):
+    # Accepted before and after the command; values given after it are kept apart, so they add
+    # to those given before instead of replacing them
+    parser.add_argument("--config", metavar="PATH", dest=f"{prefix}config",
+                        help="Python file defining the pipeline config as 'config' (default: config.py).")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", dest=f"{prefix}options",
+                        help="Override a config option, VALUE is parsed as JSON if possible (repeatable).")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="clms_pipeline", description="Run the CLMS HRSI processing pipeline.")
+    add_config_options(parser)
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    run = commands.add_parser("run", help="Run all steps (the default).")
+    add_config_options(run, "command_")
+    run.add_argument("--force", action="append", default=[], metavar="STEP",
+                     help="Run STEP even if its outputs are up to date (repeatable, 'all' for every step).")
+    add_config_options(commands.add_parser("steps", help="List the steps of the configured pipeline."), "command_")
+    for name, description in STEP_COMMANDS.items():
+        step = commands.add_parser(name, help=description)
+        add_config_options(step, "command_")
+        step.add_argument("--force", action="store_true", help="Run the step even if its outputs are up to date.")
+    return parser
+
+
+def add_default_command(argv):
+    # Without a command the whole pipeline runs. "run" goes first, so its --force can be mixed
+    # with --config and --set in any order.
+    i = 0
+    while i < len(argv):
+        if argv[i] in ("-h", "--help"):
+            return argv
+        if not argv[i].startswith("-"):
+            # A command
+            return argv
+        i += 2 if argv[i] in OPTIONS_WITH_VALUE else 1
+    return ["run"] + argv
+
+
+def main(argv=None):
+    args = get_parser().parse_args(add_default_command(sys.argv[1:] if argv is None else argv))
+    config = load_config(args.command_config or args.config, args.options + args.command_options)
+    # Imported here so --help and argument errors do not pay for it
+    from clms_pipeline.pipeline import CLMSPipeline
+    pipeline = CLMSPipeline(config)
+    steps = [step.name for step in pipeline.get_steps()]
+    if args.command == "steps":
+        for name in steps:
+            print(name)
+    elif args.command == "run":
+        unknown = sorted(set(args.force) - set(steps) - {"all"})
+        if unknown:
+            print(f"Unknown steps: {', '.join(unknown)} (steps: {', '.join(steps)})")
+            return 1
+        pipeline.run(force=args.force)
+    elif args.command not in steps:
+        # e.g. "fused" without fused_processing
+        print(f"Step {args.command} is not part of the configured pipeline (steps: {', '.join(steps)})")
+        return 1
+    else:
+        pipeline.run(force=[args.command] if args.force else (), only=[args.command])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
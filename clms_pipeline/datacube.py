@@ -0,0 +1,200 @@
+import os
+import json
+import shutil
+from datetime import date
+import numpy as np
+
+DATACUBE_FORMATS = ["memmap", "zarr", "netcdf"]
+EXTENSIONS = {"memmap": ".dat", "zarr": ".zarr", "netcdf": ".nc"}
+
+
+def days_since_epoch(yyyymmdd):
+    return (date(int(yyyymmdd[:4]), int(yyyymmdd[4:6]), int(yyyymmdd[6:8])) - date(1970, 1, 1)).days
+
+
+class MemmapStore:
+    # Raw C-ordered (time, y, x) array; new dates are appended to the end of the file
+    def __init__(self, path, shape, dtype, nodata, chunks=None, grid=None):
+        self.path = path
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+
+    def create(self):
+        open(self.path, "wb").close()
+
+    def append(self, arr, yyyymmdd):
+        with open(self.path, "ab") as f:
+            f.write(np.ascontiguousarray(arr, dtype=self.dtype).tobytes())
+
+    def write(self, index, arr):
+        cube = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(index + 1,) + tuple(self.shape))
+        cube[index] = arr
+        cube.flush()
+
+    def open(self, count):
+        return np.memmap(self.path, dtype=self.dtype, mode="r", shape=(count,) + tuple(self.shape))
+
+
+class ZarrStore:
+    def __init__(self, path, shape, dtype, nodata, chunks=None, grid=None):
+        self.path = path
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.nodata = nodata
+        self.chunks = chunks
+
+    def create(self):
+        import zarr
+        array = zarr.open_array(self.path, mode="w", shape=(0,) + tuple(self.shape), chunks=tuple(self.chunks),
+                                dtype=self.dtype, fill_value=self.nodata)
+        array.attrs["_ARRAY_DIMENSIONS"] = ["time", "y", "x"]
+
+    def append(self, arr, yyyymmdd):
+        import zarr
+        zarr.open_array(self.path, mode="r+").append(arr[np.newaxis].astype(self.dtype), axis=0)
+
+    def write(self, index, arr):
+        import zarr
+        zarr.open_array(self.path, mode="r+")[index] = arr
+
+    def open(self, count):
+        import zarr
+        return zarr.open_array(self.path, mode="r")
+
+
+class NetCDFStore:
+    def __init__(self, path, shape, dtype, nodata, chunks=None, grid=None):
+        self.path = path
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.nodata = nodata
+        self.chunks = chunks
+        self.grid = grid
+
+    def create(self):
+        import netCDF4
+        with netCDF4.Dataset(self.path, "w") as ds:
+            ds.createDimension("time", None)
+            ds.createDimension("y", self.shape[0])
+            ds.createDimension("x", self.shape[1])
+            time = ds.createVariable("time", "i4", ("time",))
+            time.units = "days since 1970-01-01"
+            time.calendar = "standard"
+            data = ds.createVariable("data", self.dtype, ("time", "y", "x"), zlib=True,
+                                     chunksizes=(self.chunks[0], min(self.chunks[1], self.shape[0]), min(self.chunks[2], self.shape[1])),
+                                     fill_value=self.nodata)
+            if self.grid is not None:
+                data.grid_mapping = "spatial_ref"
+                spatial_ref = ds.createVariable("spatial_ref", "i4")
+                spatial_ref.crs_wkt = self.grid.crs.to_wkt() if self.grid.crs is not None else ""
+                spatial_ref.GeoTransform = " ".join(str(v) for v in self.grid.transform.to_gdal())
+
+    def append(self, arr, yyyymmdd):
+        import netCDF4
+        with netCDF4.Dataset(self.path, "a") as ds:
+            index = len(ds.dimensions["time"])
+            ds.variables["time"][index] = days_since_epoch(yyyymmdd)
+            ds.variables["data"][index] = arr
+
+    def write(self, index, arr):
+        import netCDF4
+        with netCDF4.Dataset(self.path, "a") as ds:
+            ds.variables["data"][index] = arr
+
+    def open(self, count):
+        import netCDF4
+        ds = netCDF4.Dataset(self.path, "r")
+        return ds.variables["data"]
+
+
+STORES = {"memmap": MemmapStore, "zarr": ZarrStore, "netcdf": NetCDFStore}
+
+
+class Datacube:
+    # One layer of one AOI/product as a time x y x stack on the reference grid. The JSON index
+    # next to the store lists the dates in storage order and the files each date came from.
+    def __init__(self, path, fmt="memmap", chunks=(64, 64, 64)):
+        if fmt not in STORES:
+            raise ValueError(f"Unknown datacube format '{fmt}', expected one of {DATACUBE_FORMATS}")
+        self.path = path
+        self.format = fmt
+        self.chunks = chunks
+        self.index_path = os.path.splitext(path)[0] + ".json"
+        self.grid = None
+        self.index = None
+        if os.path.exists(self.index_path) and os.path.exists(path):
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+            if self.index.get("format") != fmt:
+                self.index = None
+            elif fmt == "memmap":
+                # An interrupted append leaves the data file out of step with the index
+                height, width = self.index["shape"]
+                expected = len(self.index["dates"]) * height * width * np.dtype(self.index["dtype"]).itemsize
+                if os.path.getsize(path) != expected:
+                    self.index = None
+
+    @property
+    def dates(self):
+        return self.index["dates"] if self.index else []
+
+    def get_store(self):
+        return STORES[self.format](self.path, self.index["shape"], self.index["dtype"], self.index["nodata"],
+                                   chunks=self.index["chunks"], grid=self.grid)
+
+    def create(self, grid, dtype, nodata):
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        self.grid = grid
+        self.index = {
+            "format": self.format,
+            "shape": [grid.height, grid.width],
+            "dtype": np.dtype(dtype).name,
+            "nodata": nodata,
+            "chunks": list(self.chunks),
+            "crs": grid.crs.to_wkt() if grid.crs is not None else None,
+            "transform": list(grid.transform)[:6],
+            "dates": [],
+            "sources": {},
+            # Dates without any file on the reference grid, so they are not read again
+            "empty": {},
+        }
+        self.get_store().create()
+
+    def append(self, yyyymmdd, arr, sources):
+        self.get_store().append(arr, yyyymmdd)
+        self.index["dates"].append(yyyymmdd)
+        self.index["sources"][yyyymmdd] = sources
+
+    def write(self, yyyymmdd, arr, sources):
+        self.get_store().write(self.index["dates"].index(yyyymmdd), arr)
+        self.index["sources"][yyyymmdd] = sources
+
+    @property
+    def empty(self):
+        # Indexes written before empty dates were recorded have none
+        return self.index.setdefault("empty", {}) if self.index else {}
+
+    def mark_empty(self, yyyymmdd, sources):
+        self.empty[yyyymmdd] = sources
+
+    def save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+
+def open_datacube(path):
+    # Returns (array, dates) with the array indexed as [time, y, x]
+    with open(os.path.splitext(path)[0] + ".json", "r") as f:
+        index = json.load(f)
+    store = STORES[index["format"]](path, index["shape"], index["dtype"], index["nodata"], chunks=index["chunks"])
+    return store.open(len(index["dates"])), index["dates"]
+
+
+def read_pixel_series(path, row, col):
+    cube, dates = open_datacube(path)
+    return dates, np.asarray(cube[:, row, col])
@@ -0,0 +1,112 @@
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DownloadJob:
+    def __init__(self, name, cmd, output_dir, tile=None, product_type=None, raster_folder=None,
+                 start_date=None, end_date=None, func=None):
+        self.name = name
+        self.cmd = cmd
+        # In-process jobs call func instead of running cmd
+        self.func = func
+        self.output_dir = output_dir
+        self.tile = tile
+        self.product_type = product_type
+        self.raster_folder = raster_folder
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def __repr__(self):
+        return f"DownloadJob({self.name})"
+
+
+class DownloadResult:
+    def __init__(self, job, success, attempts, returncode=None, error=None, duration=0.0, stdout="", stderr=""):
+        self.job = job
+        self.success = success
+        self.attempts = attempts
+        self.returncode = returncode
+        self.error = error
+        self.duration = duration
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def to_dict(self):
+        return {
+            "job": self.job.name,
+            "success": self.success,
+            "attempts": self.attempts,
+            "returncode": self.returncode,
+            "error": self.error,
+            "duration": round(self.duration, 3),
+        }
+
+
+class DownloadScheduler:
+    def __init__(self, max_workers=4, retries=2, backoff=10.0, timeout=None):
+        self.max_workers = max(1, int(max_workers))
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_workers=getattr(config, "download_workers", 4),
+            retries=getattr(config, "download_retries", 2),
+            backoff=getattr(config, "download_retry_backoff", 10.0),
+            timeout=getattr(config, "download_timeout", None),
+        )
+
+    def run_job(self, job):
+        start = time.perf_counter()
+        attempts = 0
+        returncode = None
+        error = None
+        stdout = stderr = ""
+        while attempts <= self.retries:
+            attempts += 1
+            try:
+                if job.func is not None:
+                    job.func()
+                    returncode = 0
+                else:
+                    proc = subprocess.run(job.cmd, capture_output=True, text=True, timeout=self.timeout)
+                    returncode = proc.returncode
+                    stdout, stderr = proc.stdout, proc.stderr
+                if returncode == 0:
+                    print(f"Finished download job {job.name} ({time.perf_counter() - start:.1f}s)")
+                    return DownloadResult(job, True, attempts, returncode, None, time.perf_counter() - start, stdout, stderr)
+                error = f"exit code {returncode}"
+            except subprocess.TimeoutExpired:
+                returncode = None
+                error = f"timed out after {self.timeout}s"
+            except OSError as e:
+                returncode = None
+                error = str(e)
+            except Exception as e:
+                # e.g. HTTP and checksum errors of in-process jobs; recorded like any other failure,
+                # so one job cannot take down the results of the others
+                returncode = None
+                error = f"{type(e).__name__}: {e}"
+            if attempts <= self.retries:
+                delay = self.backoff * (2 ** (attempts - 1))
+                print(f"Job {job.name} failed ({error}), retrying in {delay:.1f}s (attempt {attempts}/{self.retries + 1})")
+                time.sleep(delay)
+        return DownloadResult(job, False, attempts, returncode, error, time.perf_counter() - start, stdout, stderr)
+
+    def run(self, jobs):
+        jobs = list(jobs)
+        if not jobs:
+            return []
+        print(f"Scheduling {len(jobs)} download jobs on {min(self.max_workers, len(jobs))} workers...")
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(jobs))) as pool:
+            results = list(pool.map(self.run_job, jobs))
+        failed = [r for r in results if not r.success]
+        print(f"Download jobs finished: {len(results) - len(failed)} succeeded, {len(failed)} failed.")
+        for r in failed:
+            print(f"  FAILED {r.job.name} after {r.attempts} attempt(s): {r.error}")
+            if r.stderr:
+                print(f"    {r.stderr.strip().splitlines()[-1]}")
+        return results
@@ -0,0 +1,134 @@
+import os
+import time
+import logging
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from clms_pipeline import run_report
+
+logger = logging.getLogger(__name__)
+
+
+class TaskResult:
+    def __init__(self, item, value=None, error=None, seconds=0.0, counters=None, pid=None, peak_rss_kb=0):
+        self.item = item
+        self.value = value
+        self.error = error
+        # Instrumentation for the run report
+        self.seconds = seconds
+        self.counters = counters or {}
+        self.pid = pid
+        self.peak_rss_kb = peak_rss_kb
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def run_task(func, item):
+    before = run_report.snapshot()
+    start = time.perf_counter()
+    try:
+        result = TaskResult(item, value=func(item))
+    except Exception as e:
+        result = TaskResult(item, error=f"{type(e).__name__}: {e}\n{traceback.format_exc()}")
+    result.seconds = time.perf_counter() - start
+    result.counters = run_report.diff(before)
+    result.pid = os.getpid()
+    result.peak_rss_kb = run_report.get_peak_rss_kb()
+    return result
+
+
+def run_chunk(func, items):
+    return [run_task(func, item) for item in items]
+
+
+def describe_item(item):
+    # Short name of a task item for the error log (task dicts carry rasters and grids)
+    if isinstance(item, dict):
+        return item.get("name") or item.get("key") or item.get("path") or type(item).__name__
+    if isinstance(item, (tuple, list)) and item:
+        return describe_item(item[0])
+    return str(item)
+
+
+class ParallelExecutor:
+    # Runs independent per-file work on a process pool. Results come back in input order
+    # and an error in one file is collected instead of aborting the whole step.
+    def __init__(self, workers=None, chunksize=1, serial=False):
+        self.workers = max(1, int(workers or os.cpu_count() or 1))
+        self.chunksize = max(1, int(chunksize))
+        self.serial = serial
+        self.pool = None
+        self.mp_context = None
+
+    def __getstate__(self):
+        # Steps holding an executor are pickled into the tasks; the pool stays in this process
+        state = self.__dict__.copy()
+        state["pool"] = None
+        return state
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            workers=getattr(config, "parallel_workers", None),
+            chunksize=getattr(config, "parallel_chunksize", 1),
+            serial=getattr(config, "parallel_serial", False),
+        )
+
+    def start(self, mp_context=None):
+        # Keep one pool for all map() calls until shutdown(), instead of one pool per call
+        if not self.serial and self.workers > 1:
+            self.mp_context = mp_context
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def map(self, func, items, label="tasks"):
+        items = list(items)
+        if not items:
+            return []
+        if self.serial or self.workers == 1 or len(items) == 1:
+            results = [run_task(func, item) for item in items]
+        elif self.pool is not None:
+            results = self.run_pool(self.pool, func, items)
+        else:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(items))) as pool:
+                results = self.run_pool(pool, func, items)
+        run_report.record_tasks(label, results)
+        errors = [r for r in results if not r.ok]
+        if errors:
+            logger.error(f"{len(errors)} of {len(items)} {label} failed:")
+            for r in errors:
+                logger.error(f"  {describe_item(r.item)}: {r.error.splitlines()[0]}")
+                logger.debug(r.error)
+        for r in results:
+            if r.ok and isinstance(r.value, str):
+                # Per-file messages
+                logger.debug(r.value)
+        return results
+
+    def run_pool(self, pool, func, items):
+        # Chunks are submitted separately, so a worker that dies (e.g. killed when out of
+        # memory) breaks the pool without losing the results of the chunks already done;
+        # the items of the chunks that did not finish are reported as failed.
+        results = [None] * len(items)
+        starts = range(0, len(items), self.chunksize)
+        futures = {pool.submit(run_chunk, func, items[i:i + self.chunksize]): i for i in starts}
+        for future in as_completed(futures):
+            start = futures[future]
+            try:
+                chunk_results = future.result()
+            except BrokenProcessPool as e:
+                chunk = items[start:start + self.chunksize]
+                chunk_results = [TaskResult(item, error=f"{type(e).__name__}: {e}") for item in chunk]
+                if pool is self.pool:
+                    # Later map() calls get a working pool again
+                    self.shutdown()
+                    self.start(self.mp_context)
+            results[start:start + len(chunk_results)] = chunk_results
+        return results
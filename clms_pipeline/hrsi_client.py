@@ -0,0 +1,198 @@
+import os
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+CLMS_API_URL = "https://cryo.land.copernicus.eu"
+SEARCH_PATH = "/resto/api/collections/HR-S&I/search.json"
+AUTH_PATH = "/resto/api/authidentity"
+PARTIAL_DIR = "data/cache/partial_downloads"
+PAGE_SIZE = 500
+CHUNK_SIZE = 1 << 16  # at most this much of a broken-off transfer is lost (not written to the .part)
+TOKEN_LIFETIME = 3000  # seconds a token is reused before a new one is requested
+
+_part_locks = {}
+_part_locks_lock = threading.Lock()
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def parse_checksum(value):
+    # "md5:<hex>", "SHA256=<hex>" or a bare hex digest (MD5 assumed); None if not usable
+    if not value:
+        return None
+    for sep in (":", "="):
+        if sep in value:
+            algo, digest = value.split(sep, 1)
+            algo = algo.strip().lower().replace("-", "")
+            if algo in hashlib.algorithms_available:
+                return algo, digest.strip().lower()
+            return None
+    return "md5", value.strip().lower()
+
+
+def get_download_info(feature):
+    # Product name, download URL, size and checksum of one catalogue search result
+    properties = feature.get("properties", {})
+    download = properties.get("services", {}).get("download", {})
+    name = properties.get("productIdentifier") or properties.get("title") or feature.get("id")
+    name = os.path.basename(str(name).rstrip("/"))
+    if name.endswith(".zip"):
+        name = name[:-4]
+    return name, download.get("url"), download.get("size"), parse_checksum(download.get("checksum"))
+
+
+def get_part_lock(part_path):
+    # Jobs of AOIs sharing a tile fetch the same product; only one of them may write its .part
+    with _part_locks_lock:
+        return _part_locks.setdefault(os.path.abspath(part_path), threading.Lock())
+
+
+class HRSIClient:
+    # In-process catalogue search and download: one pooled session and one token shared by all
+    # download jobs, partial zips resumed with HTTP Range requests and verified against the
+    # catalogue checksum. Writes the same staging dir layout as CLMS_downloader.py.
+    def __init__(self, username, password, api_url=CLMS_API_URL, pool_size=4, timeout=60,
+                 partial_dir=PARTIAL_DIR):
+        self.username = username
+        self.password = password
+        self.api_url = api_url.rstrip("/")
+        self.timeout = timeout
+        self.partial_dir = partial_dir
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.token = None
+        self.token_time = 0.0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config.clms_username,
+            config.clms_password,
+            api_url=getattr(config, "clms_api_url", CLMS_API_URL),
+            pool_size=max(1, getattr(config, "download_workers", 4)),
+            timeout=getattr(config, "download_http_timeout", 60),
+            partial_dir=getattr(config, "download_partial_dir", PARTIAL_DIR),
+        )
+
+    def get_token(self, refresh=False):
+        with self.lock:
+            if refresh or self.token is None or time.time() - self.token_time > TOKEN_LIFETIME:
+                response = self.session.get(self.api_url + AUTH_PATH, auth=(self.username, self.password),
+                                            timeout=self.timeout)
+                response.raise_for_status()
+                try:
+                    self.token = response.json()["token"]
+                except ValueError:
+                    self.token = response.text.strip()
+                self.token_time = time.time()
+            return self.token
+
+    def search(self, tile, product_type, start_date, end_date):
+        features = []
+        page = 1
+        while True:
+            params = {
+                "productIdentifier": f"%{tile}%",
+                "productType": product_type,
+                "obsDateMin": start_date,
+                "obsDateMax": end_date,
+                "maxRecords": PAGE_SIZE,
+                "page": page,
+            }
+            response = self.session.get(self.api_url + SEARCH_PATH, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            batch = response.json().get("features", [])
+            features.extend(batch)
+            if len(batch) < PAGE_SIZE:
+                return features
+            page += 1
+
+    def download(self, url, dst_path, size=None, checksum=None):
+        # Streams into <partial_dir>/<name>.part, continuing an earlier partial transfer
+        os.makedirs(self.partial_dir, exist_ok=True)
+        part_path = os.path.join(self.partial_dir, os.path.basename(dst_path) + ".part")
+        with get_part_lock(part_path):
+            return self.download_part(url, part_path, dst_path, size, checksum)
+
+    def download_part(self, url, part_path, dst_path, size=None, checksum=None):
+        hasher = hashlib.new(checksum[0]) if checksum else None
+        for attempt in range(2):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if size is not None and offset > int(size):
+                # Not a prefix of this product, start over
+                os.remove(part_path)
+                offset = 0
+            # An expired token gets one refresh
+            headers = {"Authorization": f"Bearer {self.get_token(refresh=attempt > 0)}"}
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+            with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                if response.status_code in (401, 403) and attempt == 0:
+                    continue
+                if response.status_code == 416 and offset:
+                    # Nothing left to fetch, the partial file is complete
+                    if size is not None and offset != int(size):
+                        os.remove(part_path)
+                        raise IOError(f"Partial download of {url} does not match the product size, restarting")
+                    if hasher:
+                        self.hash_file(hasher, part_path)
+                    break
+                response.raise_for_status()
+                resumed = response.status_code == 206
+                if resumed:
+                    logger.debug(f"Resuming {os.path.basename(dst_path)} at {offset} bytes")
+                    if hasher:
+                        self.hash_file(hasher, part_path)
+                with open(part_path, "ab" if resumed else "wb") as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        if hasher:
+                            hasher.update(chunk)
+            break
+        received = os.path.getsize(part_path)
+        if size is not None and received != int(size):
+            # A short file is left in place for the next attempt to resume, a longer one is useless
+            if received > int(size):
+                os.remove(part_path)
+            raise IOError(f"Incomplete download of {url}: {received} of {size} bytes")
+        if hasher and hasher.hexdigest() != checksum[1]:
+            os.remove(part_path)
+            raise ChecksumError(f"{checksum[0]} mismatch for {url}")
+        shutil.move(part_path, dst_path)
+        return dst_path
+
+    @staticmethod
+    def hash_file(hasher, path):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                hasher.update(chunk)
+
+    def fetch(self, tile, product_type, start_date, end_date, output_dir, query_type="query_and_download", skip=()):
+        # One download job: zips and result_file.txt in output_dir, as CLMS_downloader.py writes them.
+        # Products in skip (e.g. already in the product store) are listed but not downloaded.
+        features = self.search(tile, product_type, start_date, end_date)
+        names = []
+        for feature in features:
+            name, url, size, checksum = get_download_info(feature)
+            if query_type != "query" and name not in skip:
+                if not url:
+                    raise IOError(f"No download URL for {name}")
+                self.download(url, os.path.join(output_dir, f"{name}.zip"), size, checksum)
+            names.append(name)
+        with open(os.path.join(output_dir, "result_file.txt"), "w") as f:
+            for name in names:
+                f.write(name + "\n")
+        logger.debug(f"{len(names)} products for {tile} {product_type} {start_date[:10]}..{end_date[:10]}")
+        return names
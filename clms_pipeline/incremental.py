@@ -0,0 +1,127 @@
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+from clms_pipeline.scenes import get_file_path
+
+MANIFEST_NAME = "manifest.json"
+# FSC/WDS/SWS/PSA/ARLIE ids carry the sensing time (YYYYMMDDTHHMMSS), GFSC ids the day and
+# the mosaic span (YYYYMMDD-NNN)
+SCENE_ID_PATTERN = re.compile(r"([A-Za-z0-9]+_(\d{8})(?:T\d{6}|-\d{3})_[A-Za-z0-9_\-.]+)")
+ISO_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def is_incremental(config):
+    return getattr(config, "incremental", False)
+
+
+def is_reuse_enabled(config):
+    # The step cache sets step_reuse_outputs while a step runs; otherwise outputs are only
+    # reused on incremental runs
+    reuse = getattr(config, "step_reuse_outputs", None)
+    return is_incremental(config) if reuse is None else reuse
+
+
+def is_up_to_date(config, output_path, input_paths):
+    # An output is current if it is newer than every input it was built from
+    if not is_reuse_enabled(config) or not os.path.exists(output_path):
+        return False
+    out_mtime = os.path.getmtime(output_path)
+    for path in map(get_file_path, input_paths):
+        if os.path.exists(path) and os.path.getmtime(path) > out_mtime:
+            return False
+    return True
+
+
+def parse_scene_ids(lines):
+    scenes = {}
+    for line in lines:
+        match = SCENE_ID_PATTERN.search(line)
+        if match:
+            scene_id = match.group(1)
+            if scene_id.endswith(".zip"):
+                scene_id = scene_id[:-4]
+            scenes.setdefault(match.group(2), []).append(scene_id)
+    return scenes
+
+
+class ProductManifest:
+    # Keeps track of which (tile, date) pairs of one raster/product folder have been
+    # queried and downloaded.
+    def __init__(self, product_dir, settle_days=2):
+        self.product_dir = product_dir
+        self.path = os.path.join(product_dir, MANIFEST_NAME)
+        self.settle_days = settle_days
+        self.tiles = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.tiles = json.load(f).get("tiles", {})
+        else:
+            self.seed_from_result_files()
+
+    def seed_from_result_files(self):
+        # Without a manifest, fall back to the renamed result_file_{tile}_{product}.txt files of
+        # earlier runs; only dates that returned products are known to be covered there.
+        if not os.path.isdir(self.product_dir):
+            return
+        for fname in os.listdir(self.product_dir):
+            match = re.match(r"result_file_(.+)_([A-Z]+)\.txt$", fname)
+            if not match:
+                continue
+            with open(os.path.join(self.product_dir, fname), "r") as f:
+                scenes = parse_scene_ids(f)
+            tile_entry = self.tiles.setdefault(match.group(1), {})
+            for key, scene_ids in scenes.items():
+                entry = tile_entry.setdefault(key, {"scenes": []})
+                entry["scenes"].extend(s for s in scene_ids if s not in entry["scenes"])
+
+    def save(self):
+        os.makedirs(self.product_dir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"tiles": self.tiles}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def iter_days(start_date, end_date):
+        day = datetime.strptime(start_date, ISO_FORMAT).date()
+        last = datetime.strptime(end_date, ISO_FORMAT).date()
+        while day <= last:
+            yield day
+            day += timedelta(days=1)
+
+    def missing_ranges(self, tile, start_date, end_date):
+        # Contiguous runs of days in [start_date, end_date] that still need a query
+        known = self.tiles.get(tile, {})
+        ranges = []
+        run = []
+        for day in self.iter_days(start_date, end_date):
+            if day.strftime("%Y%m%d") in known:
+                if run:
+                    ranges.append(run)
+                    run = []
+            else:
+                run.append(day)
+        if run:
+            ranges.append(run)
+        result = []
+        for run in ranges:
+            range_start = max(start_date, run[0].strftime("%Y-%m-%dT00:00:00Z"))
+            range_end = min(end_date, run[-1].strftime("%Y-%m-%dT23:59:59Z"))
+            result.append((range_start, range_end))
+        return result
+
+    def record_query(self, tile, start_date, end_date, result_lines):
+        # Dates close to today may still receive new products, so they are not marked as covered
+        settled = (datetime.now(timezone.utc) - timedelta(days=self.settle_days)).date()
+        scenes = parse_scene_ids(result_lines)
+        tile_entry = self.tiles.setdefault(tile, {})
+        for day in self.iter_days(start_date, end_date):
+            key = day.strftime("%Y%m%d")
+            if day > settled and key not in scenes:
+                continue
+            entry = tile_entry.setdefault(key, {"scenes": []})
+            for scene_id in scenes.get(key, []):
+                if scene_id not in entry["scenes"]:
+                    entry["scenes"].append(scene_id)
@@ -1,27 +1,152 @@
-from clms_pipeline.steps.downloader import Downloader
-from clms_pipeline.steps.tile_determiner import TileDeterminer
-from clms_pipeline.steps.mosaic import MosaicBuilder
-from clms_pipeline.steps.reclassify import Reclassifier
-from clms_pipeline.steps.resample import Resampler
-from clms_pipeline.steps.cloud_filter import CloudFilter
-from clms_pipeline.steps.unzipper import Unzipper
+import os
+import importlib
+from clms_pipeline.product_store import get_store_dir, is_store_enabled
+from clms_pipeline.run_report import RunReport, configure_logging
+from clms_pipeline.scene_inventory import get_inventory
+from clms_pipeline.step_cache import StepCache, StepSpec
+
+# Step objects by attribute name. Their modules (and rasterio, geopandas, GDAL, ...) are only
+# imported when a step actually runs, so skipped steps and light commands start fast.
+STEP_CLASSES = {
+    "downloader": ("clms_pipeline.steps.downloader", "Downloader"),
+    "tile_determiner": ("clms_pipeline.steps.tile_determiner", "TileDeterminer"),
+    "mosaic_builder": ("clms_pipeline.steps.mosaic", "MosaicBuilder"),
+    "reclassifier": ("clms_pipeline.steps.reclassify", "Reclassifier"),
+    "resampler": ("clms_pipeline.steps.resample", "Resampler"),
+    "cloud_filter": ("clms_pipeline.steps.cloud_filter", "CloudFilter"),
+    "unzipper": ("clms_pipeline.steps.unzipper", "Unzipper"),
+    "scene_processor": ("clms_pipeline.steps.scene_processor", "FusedSceneProcessor"),
+    "datacube_exporter": ("clms_pipeline.steps.datacube", "DatacubeExporter"),
+    "streaming_runner": ("clms_pipeline.streaming", "StreamingRunner"),
+}
 
 class CLMSPipeline:
-    def __init__(self, config):
+    def __init__(self, config, hooks=()):
         self.config = config
-        self.downloader = Downloader(config)
-        self.tile_determiner = TileDeterminer(config)
-        self.mosaic_builder = MosaicBuilder(config)
-        self.reclassifier = Reclassifier(config)
-        self.resampler = Resampler(config)
-        self.cloud_filter = CloudFilter(config)
-        self.unzipper = Unzipper(config)
+        # Run report hooks given as callables, kept off the config that parallel tasks pickle
+        self.hooks = list(hooks)
+
+    def __getattr__(self, name):
+        if name not in STEP_CLASSES:
+            raise AttributeError(name)
+        module, cls = STEP_CLASSES[name]
+        step = getattr(importlib.import_module(module), cls)(self.config)
+        setattr(self, name, step)
+        return step
+
+    def get_runner(self, name, method):
+        return lambda: getattr(getattr(self, name), method)()
+
+    def get_steps(self):
+        # Inputs, outputs and config keys of each step, for the step cache
+        config = self.config
+        original = os.path.join(config.output_path_original, "*", "*")
+        processed = os.path.join(config.output_path_processed, "*", "*")
+        references = [os.path.join(config.reference_raster_dir, r["name"]) for r in config.reference_rasters]
+        common = ["reference_rasters", "reference_raster_dir", "reference_grid_*", "output_path_*", "clms_product",
+                  "product_store*"]
+        # Scene folders in output_path_original are symlinks into the product store, which
+        # fingerprinting does not follow
+        stored = [os.path.join(get_store_dir(config), p) for p in config.clms_product] if is_store_enabled(config) else []
+        writer = ["output_profile", "parallel_*"]
+        reclass_input = [os.path.join(processed, "reclassified")] if getattr(config, "reclassify", False) else [original] + stored
+        final_stage = "cc_filtered" if getattr(config, "filter_cc", False) else "resampled"
+        # Cloud scores only decide which scenes are reclassified and resampled, when pushdown is on
+        pushdown = ["cc_pushdown"]
+        if getattr(config, "cc_pushdown", False) and getattr(config, "filter_cc", False):
+            pushdown += ["filter_cc", "cc_threshold"]
+        datacube = StepSpec("datacube", self.get_runner("datacube_exporter", "export"), common + ["datacube_*", "filter_cc"],
+                            inputs=[os.path.join(processed, final_stage)], outputs=[os.path.join(processed, "datacube")])
+        # Downloads depend on the remote catalogue, which local fingerprints cannot see, so they
+        # always run; later steps are skipped if nothing new arrived
+        steps = [
+            StepSpec("tiles", self.get_runner("tile_determiner", "determine_tiles"), common + ["tile_index_*"],
+                     inputs=references, outputs=["data/tile_system/relevant_tiles_*.txt"]),
+        ]
+        if getattr(config, "streaming", False):
+            # Download, unzip, mosaic and fused processing overlap in one step
+            steps.append(StepSpec("stream", self.get_runner("streaming_runner", "run"),
+                                  common + writer + ["clms_*", "start_date", "end_date", "download_*", "incremental*",
+                                                     "unzip_*", "mosaic_*", "reclass*", "crop_resample", "filter_cc",
+                                                     "cc_*", "warp_cache*", "fused_*", "aoi_window*", "stream*",
+                                                     "scene_catalog*"],
+                                  inputs=["data/tile_system/relevant_tiles_*.txt"] + references,
+                                  outputs=[original, os.path.join(processed, "resampled"), os.path.join(processed, "cc_filtered"),
+                                           os.path.join(processed, "scene_catalog.*")],
+                                  exclude=["mosaic"], volatile=True))
+            return steps + [datacube]
+        steps += [
+            StepSpec("download", self.get_runner("downloader", "download"),
+                     common + ["clms_*", "start_date", "end_date", "download_*", "incremental*"],
+                     inputs=["data/tile_system/relevant_tiles_*.txt"],
+                     outputs=[os.path.join(original, "result_file_*.txt")] + [os.path.join(p, "result_file_*.txt") for p in stored],
+                     volatile=True),
+            StepSpec("unzip", self.get_runner("unzipper", "unzip_and_cleanup"), common + ["unzip_*"],
+                     inputs=[original] + stored, exclude=["mosaic"]),
+            StepSpec("mosaic", self.get_runner("mosaic_builder", "build_mosaic"),
+                     common + writer + ["mosaic_*", "aoi_window*"],
+                     inputs=[original] + stored, outputs=[os.path.join(original, "mosaic")], exclude=["mosaic"]),
+            StepSpec("cloud_scores", self.get_runner("cloud_filter", "score_sources"),
+                     common + ["cc_pushdown", "filter_cc", "parallel_*", "aoi_window*"],
+                     inputs=[original] + stored, outputs=[os.path.join(processed, "cloud_scores.json")]),
+        ]
+        if getattr(config, "fused_processing", False):
+            steps.append(StepSpec("fused", self.get_runner("scene_processor", "process"),
+                                  common + writer + ["reclass*", "crop_resample", "filter_cc", "warp_cache*", "fused_*",
+                                                     "aoi_window*", "scene_catalog*"],
+                                  inputs=[original] + stored + references + [os.path.join(processed, "cloud_scores.json")],
+                                  outputs=[os.path.join(processed, "resampled"), os.path.join(processed, "cc_filtered"),
+                                           os.path.join(processed, "scene_catalog.*")],
+                                  reuse_keys=["cc_threshold", "cc_pushdown"]))
+        else:
+            steps += [
+                StepSpec("reclassify", self.get_runner("reclassifier", "reclassify"),
+                         common + writer + ["reclass*", "aoi_window*"],
+                         inputs=[original] + stored + [os.path.join(processed, "cloud_scores.json")],
+                         outputs=[os.path.join(processed, "reclassified")], reuse_keys=pushdown),
+                StepSpec("resample", self.get_runner("resampler", "resample"),
+                         common + writer + ["reclassify", "crop_resample", "warp_cache*", "resample_*", "aoi_window*"],
+                         inputs=reclass_input + [os.path.join(processed, "cloud_scores.json")] + references,
+                         outputs=[os.path.join(processed, "resampled")], reuse_keys=pushdown),
+                StepSpec("cloud_filter", self.get_runner("cloud_filter", "filter_clouds"),
+                         common + ["reclass*", "crop_resample", "filter_cc", "cc_*", "parallel_*", "aoi_window*",
+                                   "scene_catalog*"],
+                         inputs=[os.path.join(processed, "resampled"), os.path.join(processed, "cloud_scores.json"),
+                                 original] + stored + references,
+                         outputs=[os.path.join(processed, "cc_filtered"), os.path.join(processed, "scene_catalog.*")]),
+            ]
+        steps.append(datacube)
+        return steps
 
-    def run(self):
-        self.tile_determiner.determine_tiles()
-        self.downloader.download()
-        self.unzipper.unzip_and_cleanup()
-        self.mosaic_builder.build_mosaic()
-        self.reclassifier.reclassify()
-        self.resampler.resample()
-        self.cloud_filter.filter_clouds()
+    def run(self, force=(), only=None):
+        # Steps whose config keys, inputs and outputs are unchanged since their last run are
+        # skipped; force lists step names (or "all") to run regardless, only limits the run to
+        # the given steps
+        steps = self.get_steps()
+        unknown = (set(force) | set(only or ())) - {step.name for step in steps} - {"all"}
+        if unknown:
+            # A typo must not turn into a run that does nothing (or everything) and succeeds
+            raise ValueError(f"Unknown steps: {', '.join(sorted(unknown))} (steps: {', '.join(s.name for s in steps)})")
+        if only is not None:
+            steps = [step for step in steps if step.name in only]
+        configure_logging(self.config)
+        report = RunReport(self.config, self.hooks)
+        cache = StepCache.from_config(self.config, force=force) if getattr(self.config, "step_cache", True) else None
+        inventory = get_inventory(self.config)
+        try:
+            for step in steps:
+                report.start_step(step)
+                try:
+                    if cache is not None:
+                        ran = cache.run(step)
+                    else:
+                        step.run()
+                        ran = True
+                except Exception as e:
+                    report.end_step("failed", error=f"{type(e).__name__}: {e}")
+                    raise
+                report.end_step("ran" if ran else "skipped", counts=cache.counts if cache is not None else None)
+                # Folder listings so far, for a restarted run (with scene_inventory_persist)
+                inventory.save()
+        finally:
+            report.save()
@@ -0,0 +1,133 @@
+import os
+import re
+import shutil
+import hashlib
+import logging
+
+from clms_pipeline.scenes import VSIZIP_INVENTORY, list_scene_rasters
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR = "data/clms_data/store"
+SHARED_DIR = "shared"
+TILE_PATTERN = re.compile(r"_T(\d{2}[A-Z]{3})_")
+DATE_PATTERN = re.compile(r"_(\d{8})(?:T|-)")
+
+
+def is_store_enabled(config):
+    return getattr(config, "product_store", False)
+
+
+def get_store_dir(config):
+    return getattr(config, "product_store_dir", STORE_DIR)
+
+
+def get_scene_tile(scene):
+    match = TILE_PATTERN.search(scene)
+    return match.group(1) if match else None
+
+
+def read_relevant_tiles(raster_folder):
+    tile_file = os.path.join(os.getcwd(), "data/tile_system", f"relevant_tiles_{raster_folder}.txt")
+    if not os.path.exists(tile_file):
+        return []
+    with open(tile_file, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def get_source_key(path):
+    # Same key for a file and its symlinks or hard links (e.g. a shared mosaic linked into
+    # several reference raster folders); /vsizip/ paths are used as they are
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path
+    return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}"
+
+
+class ProductStore:
+    # One copy of every downloaded product, keyed by product identifier:
+    # <store>/<product>/<product id>.zip or <product id>/ once unzipped. Each reference raster
+    # gets a view of the scenes of its tiles in output_path_original (symlinks, or scene
+    # inventories where symlinks are not available).
+    def __init__(self, root):
+        self.root = root
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(get_store_dir(config))
+
+    def get_product_dir(self, product_type):
+        return os.path.join(self.root, product_type)
+
+    def list_scenes(self, product_type):
+        product_dir = self.get_product_dir(product_type)
+        if not os.path.isdir(product_dir):
+            return []
+        return sorted(f for f in os.listdir(product_dir)
+                      if os.path.isdir(os.path.join(product_dir, f)) and not f.startswith(".") and f != "mosaic")
+
+    def list_products(self, product_type):
+        # Identifiers of all stored products, zipped or unzipped
+        product_dir = self.get_product_dir(product_type)
+        if not os.path.isdir(product_dir):
+            return []
+        return sorted({os.path.splitext(f)[0] for f in os.listdir(product_dir) if f.endswith(".zip")}
+                      | set(self.list_scenes(product_type)))
+
+    def link_scene(self, scene_dir, view_dir):
+        if os.path.islink(view_dir):
+            if os.path.realpath(view_dir) == os.path.realpath(scene_dir):
+                return
+            os.remove(view_dir)
+        elif os.path.isdir(view_dir):
+            shutil.rmtree(view_dir)
+        try:
+            os.symlink(os.path.abspath(scene_dir), view_dir, target_is_directory=True)
+        except OSError:
+            # No symlinks (e.g. Windows without developer mode): list the store rasters instead
+            os.makedirs(view_dir, exist_ok=True)
+            with open(os.path.join(view_dir, VSIZIP_INVENTORY), "w") as f:
+                for raster in sorted(list_scene_rasters(scene_dir)):
+                    f.write((raster if raster.startswith("/vsizip/") else os.path.abspath(raster)) + "\n")
+
+    def build_views(self, config):
+        # Links the scenes of each reference raster's tiles within start_date..end_date
+        start = config.start_date[:10].replace("-", "")
+        end = config.end_date[:10].replace("-", "")
+        for raster_entry in config.reference_rasters:
+            raster_folder = os.path.splitext(raster_entry["name"])[0]
+            tiles = {t[1:] if len(t) == 6 and t.startswith("T") else t for t in read_relevant_tiles(raster_folder)}
+            for product_type in config.clms_product:
+                view_root = os.path.join(config.output_path_original, raster_folder, product_type)
+                os.makedirs(view_root, exist_ok=True)
+                linked = 0
+                for scene in self.list_scenes(product_type):
+                    date = DATE_PATTERN.search(scene)
+                    if get_scene_tile(scene) not in tiles or not date or not start <= date.group(1) <= end:
+                        continue
+                    self.link_scene(os.path.join(self.get_product_dir(product_type), scene),
+                                    os.path.join(view_root, scene))
+                    linked += 1
+                logger.debug(f"Linked {linked} stored scenes into {view_root}")
+
+
+class SharedOutputs:
+    # Outputs that only depend on their input files (not on the reference raster) are computed
+    # once under <store>/shared/<step>/ and then linked into every reference raster's folder
+    def __init__(self, config, step):
+        self.root = os.path.join(get_store_dir(config), SHARED_DIR, step)
+        self.links = []
+        self.paths = set()
+
+    def get_path(self, sources, out_path):
+        # Shared path for out_path and whether it is the first request for it in this run
+        key = "\n".join(sorted(get_source_key(s) for s in sources))
+        shared_path = os.path.join(self.root, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16],
+                                   os.path.basename(out_path))
+        self.links.append((shared_path, out_path))
+        first = shared_path not in self.paths
+        self.paths.add(shared_path)
+        if first:
+            os.makedirs(os.path.dirname(shared_path), exist_ok=True)
+        return shared_path, first
@@ -0,0 +1,109 @@
+import numpy as np
+
+# Codes of the raw HRSI layers
+RAW_CLOUD = 205
+RAW_NODATA = 255
+RAW_ENCODING = {"dtype": "uint8", "nodata": RAW_NODATA, "cloud": RAW_CLOUD}
+
+# Output encodings of reclassified layers. With reclass_cloud_as_nodata (the default) clouds
+# get the nodata value, otherwise they keep a code of their own.
+RECLASS_ENCODINGS = {
+    "float32": {"dtype": "float32", "nodata": -9999, "cloud": -9998},
+    "int16": {"dtype": "int16", "nodata": -9999, "cloud": -9998},
+    "uint8": {"dtype": "uint8", "nodata": 255, "cloud": 205},
+}
+LEGACY_ENCODING = {"dtype": "float32", "nodata": -9999, "cloud": -9999}
+
+# GeoTIFF tags that record the encoding, so later steps can tell clouds from no data
+CLOUD_TAG = "CLMS_RECLASS_CLOUD"
+NODATA_TAG = "CLMS_RECLASS_NODATA"
+
+
+def get_encoding(config):
+    name = getattr(config, "reclass_dtype", "float32")
+    if name not in RECLASS_ENCODINGS:
+        raise ValueError(f"Unknown reclass_dtype '{name}', expected one of {sorted(RECLASS_ENCODINGS)}")
+    encoding = dict(RECLASS_ENCODINGS[name])
+    if getattr(config, "reclass_cloud_as_nodata", True):
+        encoding["cloud"] = encoding["nodata"]
+    return encoding
+
+
+def get_default_encoding(reclassified):
+    # Encoding of files written without tags: the original float32 output, or raw codes
+    return dict(LEGACY_ENCODING) if reclassified else dict(RAW_ENCODING)
+
+
+def get_encoding_tags(encoding):
+    return {CLOUD_TAG: str(encoding["cloud"]), NODATA_TAG: str(encoding["nodata"])}
+
+
+def read_encoding(src):
+    # Encoding recorded on a reclassified raster, or None for untagged files
+    tags = src.tags()
+    if CLOUD_TAG not in tags or NODATA_TAG not in tags:
+        return None
+    cast = float if np.issubdtype(np.dtype(src.dtypes[0]), np.floating) else int
+    return {"dtype": src.dtypes[0], "nodata": cast(float(tags[NODATA_TAG])), "cloud": cast(float(tags[CLOUD_TAG]))}
+
+
+def has_cloud_code(encoding):
+    return encoding["cloud"] != encoding["nodata"]
+
+
+def apply_rule(lut, values, rule):
+    # values are the valid raw codes; lut entries for them are replaced according to the rule
+    kind = rule.get("type")
+    if kind == "threshold":
+        # e.g. binary snow / no snow: {"type": "threshold", "threshold": 50, "below": 0, "above": 1}
+        lut[values] = np.where(values >= rule["threshold"], rule.get("above", 1), rule.get("below", 0))
+    elif kind == "ranges":
+        # {"type": "ranges", "ranges": [[0, 20, 1], [21, 100, 2]]}, bounds inclusive
+        for low, high, value in rule["ranges"]:
+            lut[values[(values >= low) & (values <= high)]] = value
+    elif kind == "map":
+        # {"type": "map", "values": {"0": 0, "100": 1}}
+        for raw, value in rule["values"].items():
+            lut[int(raw)] = value
+    else:
+        raise ValueError(f"Unknown reclassification rule type '{kind}'")
+
+
+def build_lut(encoding, rule=None):
+    # 256-entry table from raw uint8 code to output value: valid codes are kept (or remapped by
+    # the rule), clouds and no data get the encoding's codes
+    lut = np.arange(256).astype(encoding["dtype"])
+    values = np.array([v for v in range(256) if v not in (RAW_CLOUD, RAW_NODATA)])
+    if rule:
+        remapped = np.arange(256, dtype=np.float64)
+        apply_rule(remapped, values, rule)
+        lut = remapped.astype(encoding["dtype"])
+    lut[RAW_CLOUD] = encoding["cloud"]
+    lut[RAW_NODATA] = encoding["nodata"]
+    return lut
+
+
+class ReclassTable:
+    # Lookup tables per (product, layer); reclassifying a layer is a single gather
+    def __init__(self, encoding, rules=None):
+        self.encoding = encoding
+        self.rules = rules or {}
+        self.luts = {}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(get_encoding(config), getattr(config, "reclass_rules", None))
+
+    def get_lut(self, product_type, layer):
+        key = (product_type, layer)
+        if key not in self.luts:
+            rule = self.rules.get(product_type, {}).get(layer) if product_type else None
+            self.luts[key] = build_lut(self.encoding, rule)
+        return self.luts[key]
+
+    def apply(self, arr, product_type=None, layer=None):
+        if arr.dtype != np.uint8:
+            if arr.size and (arr.min() < 0 or arr.max() > 255):
+                raise ValueError(f"Cannot reclassify {arr.dtype} values outside 0-255 with a lookup table")
+            arr = arr.astype(np.uint8)
+        return self.get_lut(product_type, layer)[arr]
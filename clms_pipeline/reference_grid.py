@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+
+from clms_pipeline.windows import grid_bounds
+
+NODATA_VALUE = -9999
+
+# Grids already loaded in this process, keyed by (path, mtime, size)
+_loaded_grids = {}
+
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class ReferenceGrid:
+    # Target grid of one reference raster: CRS, transform, shape, nodata and dtype. The raster
+    # is parsed once and cached in binary form (.npy + JSON sidecar), so ESRI ASCII grids are
+    # not re-parsed by every step and every file.
+    def __init__(self, path, crs, transform, width, height, nodata, dtype, data_path=None):
+        self.path = path
+        self.crs = crs
+        self.transform = transform
+        self.width = width
+        self.height = height
+        self.nodata = nodata
+        self.dtype = dtype
+        self.data_path = data_path
+
+    @property
+    def bounds(self):
+        return grid_bounds(self.transform, self.width, self.height)
+
+    @property
+    def shape(self):
+        return (self.height, self.width)
+
+    @classmethod
+    def from_raster(cls, path, crs_str=None):
+        with rasterio.open(path) as ref:
+            crs = ref.crs if ref.crs is not None else (CRS.from_string(crs_str) if crs_str else None)
+            nodata = ref.nodata if ref.nodata is not None else NODATA_VALUE
+            return cls(path, crs, ref.transform, ref.width, ref.height, nodata, ref.dtypes[0])
+
+    def read(self):
+        if self.data_path and os.path.exists(self.data_path):
+            return np.load(self.data_path, mmap_mode="r")
+        with rasterio.open(self.path) as ref:
+            return ref.read(1)
+
+    def to_metadata(self):
+        return {
+            "path": os.path.abspath(self.path),
+            "crs": self.crs.to_wkt() if self.crs is not None else None,
+            "transform": list(self.transform)[:6],
+            "width": self.width,
+            "height": self.height,
+            "nodata": self.nodata,
+            "dtype": self.dtype,
+        }
+
+    @classmethod
+    def from_metadata(cls, path, metadata, data_path=None):
+        crs = CRS.from_wkt(metadata["crs"]) if metadata["crs"] else None
+        return cls(path, crs, Affine(*metadata["transform"]), metadata["width"], metadata["height"],
+                   metadata["nodata"], metadata["dtype"], data_path=data_path)
+
+
+def load_reference_grid(path, crs_str=None, cache_dir=None, use_hash=False):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime, stat.st_size, crs_str)
+    if key in _loaded_grids:
+        return _loaded_grids[key]
+    grid = None
+    if cache_dir:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        cache_name = f"{stem}_{hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:8]}"
+        meta_path = os.path.join(cache_dir, f"{cache_name}.json")
+        data_path = os.path.join(cache_dir, f"{cache_name}.npy")
+        source = {"mtime": stat.st_mtime, "size": stat.st_size, "crs_str": crs_str}
+        if use_hash:
+            source["sha1"] = file_sha1(path)
+        if os.path.exists(meta_path) and os.path.exists(data_path):
+            with open(meta_path, "r") as f:
+                metadata = json.load(f)
+            if metadata.get("source") == source:
+                grid = ReferenceGrid.from_metadata(path, metadata, data_path=data_path)
+        if grid is None:
+            grid = ReferenceGrid.from_raster(path, crs_str)
+            os.makedirs(cache_dir, exist_ok=True)
+            np.save(data_path, grid.read())
+            metadata = grid.to_metadata()
+            metadata["source"] = source
+            with open(meta_path, "w") as f:
+                json.dump(metadata, f, indent=1)
+            grid.data_path = data_path
+            print(f"Cached reference grid {path} -> {meta_path}")
+    else:
+        grid = ReferenceGrid.from_raster(path, crs_str)
+    _loaded_grids[key] = grid
+    return grid
+
+
+def get_reference_grid(config, raster_entry):
+    path = os.path.join(config.reference_raster_dir, raster_entry["name"])
+    cache_dir = None
+    if getattr(config, "reference_grid_cache", True):
+        cache_dir = getattr(config, "reference_grid_cache_dir", "data/cache/reference_grids")
+    return load_reference_grid(path, raster_entry.get("crs"), cache_dir=cache_dir,
+                               use_hash=getattr(config, "reference_grid_cache_hash", False))
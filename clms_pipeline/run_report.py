@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import heapq
+import logging
+import importlib
+from datetime import datetime, timezone
+
+from clms_pipeline.scene_inventory import get_inventory
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Counters of the current process (pixels, bytes_written, files_written). Worker processes
+# send their deltas back with each TaskResult.
+_counters = {}
+# Per-file task timings and the largest worker RSS of the running step, collected by
+# ParallelExecutor in the main process
+_task_timings = []
+_worker_peak = {"kb": 0}
+
+
+def add(name, value):
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def snapshot():
+    return dict(_counters)
+
+
+def diff(before, after=None):
+    after = _counters if after is None else after
+    return {k: v - before.get(k, 0) for k, v in after.items() if v - before.get(k, 0)}
+
+
+def get_peak_rss_kb():
+    # Peak resident set size of this process; on Linux the peak since the last reset_peak_rss
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def get_children_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def describe_item(item):
+    # Short name of a task item for the slowest-files table
+    if isinstance(item, dict):
+        return str(item.get("name", item))
+    if isinstance(item, (tuple, list)):
+        for part in item:
+            if isinstance(part, str):
+                return part
+    return str(item)
+
+
+def record_tasks(label, results):
+    # Called by ParallelExecutor with the results of one map() call
+    pid = os.getpid()
+    for result in results:
+        _task_timings.append((result.seconds, label, describe_item(result.item)))
+        if result.pid != pid:
+            for name, value in result.counters.items():
+                add(name, value)
+            _worker_peak["kb"] = max(_worker_peak["kb"], result.peak_rss_kb)
+
+
+def load_hook(hook):
+    # "package.module:function". The config is pickled into every parallel task, so it may
+    # only hold names; callables are passed to CLMSPipeline(config, hooks=...) instead.
+    if not isinstance(hook, str) or ":" not in hook:
+        raise ValueError(f"run_report_hooks takes 'module:function' strings, got {hook!r}; "
+                         f"pass callables to CLMSPipeline(config, hooks=[...])")
+    module_name, _, func_name = hook.partition(":")
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def count_files(inventory, patterns, since=None):
+    from clms_pipeline.step_cache import iter_files
+    files = 0
+    size = 0
+    for path in iter_files(inventory, patterns):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if since is not None and stat.st_mtime < since:
+            continue
+        files += 1
+        size += stat.st_size
+    return files, size
+
+
+class RunReport:
+    # Wall/CPU time, file and byte counts, pixels, peak RSS and the slowest files per step,
+    # written as JSON at the end of the run and passed to the configured hooks
+    def __init__(self, config, hooks=()):
+        self.config = config
+        self.report_dir = getattr(config, "run_report_dir", "data/reports")
+        self.top_n = getattr(config, "run_report_top_files", 10)
+        self.hooks = [load_hook(h) for h in (getattr(config, "run_report_hooks", None) or [])] + list(hooks)
+        self.started = datetime.now(timezone.utc)
+        self.start_wall = time.perf_counter()
+        self.steps = []
+        self.current = None
+
+    def start_step(self, step):
+        reset_peak_rss()
+        del _task_timings[:]
+        _worker_peak["kb"] = 0
+        children_cpu = get_children_cpu()
+        self.current = {
+            "step": step,
+            "start": time.time(),
+            "wall": time.perf_counter(),
+            "cpu": time.process_time(),
+            "children_cpu": children_cpu,
+            "counters": snapshot(),
+        }
+
+    def end_step(self, status, error=None, counts=None):
+        # counts: files_in/bytes_in/files_out/bytes_out already collected by the step cache,
+        # so the input and output trees are not walked once more
+        step = self.current["step"]
+        children_cpu = get_children_cpu()
+        counters = diff(self.current["counters"])
+        if counts is None:
+            inventory = get_inventory(self.config)
+            files_in, bytes_in = count_files(inventory, step.inputs)
+            files_out, bytes_out = count_files(inventory, step.outputs, since=self.current["start"])
+        else:
+            files_in, bytes_in = counts["files_in"], counts["bytes_in"]
+            files_out, bytes_out = counts["files_out"], counts["bytes_out"]
+        slowest = heapq.nlargest(self.top_n, _task_timings)
+        entry = {
+            "step": step.name,
+            "status": status,
+            "wall_s": round(time.perf_counter() - self.current["wall"], 3),
+            "cpu_s": round(time.process_time() - self.current["cpu"], 3),
+            "children_cpu_s": round(children_cpu - self.current["children_cpu"], 3),
+            "files_in": files_in,
+            "bytes_in": bytes_in,
+            "files_out": files_out,
+            "bytes_out": bytes_out,
+            "files_written": int(counters.get("files_written", 0)),
+            "bytes_written": int(counters.get("bytes_written", 0)),
+            "pixels": int(counters.get("pixels", 0)),
+            "tasks": len(_task_timings),
+            "peak_rss_mb": round(get_peak_rss_kb() / 1024, 1),
+            "worker_peak_rss_mb": round(_worker_peak["kb"] / 1024, 1),
+            "slowest_files": [{"file": name, "label": label, "seconds": round(seconds, 3)}
+                              for seconds, label, name in slowest],
+        }
+        if error is not None:
+            entry["error"] = error
+        self.steps.append(entry)
+        self.current = None
+        logger.info(f"Step '{entry['step']}' {status} in {entry['wall_s']:.1f} s "
+                    f"({entry['files_out']} files out, peak RSS {entry['peak_rss_mb']} MB)")
+        self.call_hooks("step", entry)
+        return entry
+
+    def to_dict(self):
+        return {
+            "started": self.started.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "wall_s": round(time.perf_counter() - self.start_wall, 3),
+            "steps": self.steps,
+        }
+
+    def call_hooks(self, event, payload):
+        for hook in self.hooks:
+            try:
+                hook(event, payload)
+            except Exception as e:
+                # Monitoring must never break a run
+                logger.warning(f"Run report hook {hook} failed: {e}")
+
+    def save(self):
+        report = self.to_dict()
+        os.makedirs(self.report_dir, exist_ok=True)
+        path = os.path.join(self.report_dir, f"run_{self.started.strftime('%Y%m%dT%H%M%S')}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"Run report written to {path}")
+        self.call_hooks("run", report)
+        return path
+
+
+def configure_logging(config):
+    # Per-file messages are logged at DEBUG; log_level="DEBUG" shows them again
+    level = getattr(config, "log_level", "INFO")
+    logging.basicConfig(level=getattr(logging, str(level).upper(), logging.INFO), format="%(message)s")
@@ -0,0 +1,185 @@
+import os
+import csv
+import logging
+import numpy as np
+
+from clms_pipeline.product_store import DATE_PATTERN, get_scene_tile
+from clms_pipeline.scenes import get_file_path
+
+logger = logging.getLogger(__name__)
+
+CATALOG_NAME = "scene_catalog"
+CATALOG_FORMATS = ["csv", "parquet"]
+COLUMNS = ["key", "date", "tiles", "cloud_fraction", "valid_fraction", "snow_fraction", "mean_fsc",
+           "mask_path", "mask_mtime", "files"]
+FLOAT_COLUMNS = ["cloud_fraction", "valid_fraction", "snow_fraction", "mean_fsc"]
+LIST_COLUMNS = ["tiles", "files"]
+LIST_SEP = ";"
+SNOW_PRODUCTS = ["FSC", "GFSC", "PSA"]  # mask layers where a value > 0 means snow
+FSC_PRODUCTS = ["FSC", "GFSC"]
+
+
+def is_catalog_enabled(config):
+    return getattr(config, "scene_catalog", True)
+
+
+def get_catalog_format(config):
+    fmt = getattr(config, "scene_catalog_format", "csv")
+    if fmt not in CATALOG_FORMATS:
+        raise ValueError(f"Unknown scene_catalog_format '{fmt}', expected one of {CATALOG_FORMATS}")
+    return fmt
+
+
+def get_catalog_path(processed_product_dir, fmt="csv"):
+    return os.path.join(processed_product_dir, f"{CATALOG_NAME}.{fmt}")
+
+
+def get_mtime(path):
+    # Of the zip for /vsizip/ layers
+    path = get_file_path(path) if path else path
+    return os.stat(path).st_mtime_ns if path and os.path.exists(path) else None
+
+
+def get_unit_date(key):
+    # Scene folder names carry the acquisition date, mosaic units are keyed by it
+    match = DATE_PATTERN.search(key)
+    if match:
+        return match.group(1)
+    return key if len(key) == 8 and key.isdigit() else None
+
+
+def get_date_tiles(scenes):
+    # Tiles of the scene folders of each date, for units (mosaics) whose name has no tile
+    date_tiles = {}
+    for scene in scenes:
+        date, tile = get_unit_date(scene), get_scene_tile(scene)
+        if date and tile:
+            date_tiles.setdefault(date, set()).add(tile)
+    return {date: sorted(tiles) for date, tiles in date_tiles.items()}
+
+
+def compute_scene_stats(arr, encoding, product_type=None):
+    # All statistics of a mask layer from one set of boolean masks over the array read for cloud
+    # filtering. Fractions: cloud of valid pixels, valid of all pixels, snow of clear pixels.
+    valid = arr != encoding["nodata"]
+    cloud = valid & (arr == encoding["cloud"])
+    clear = valid & ~cloud
+    n_valid = int(np.count_nonzero(valid))
+    n_cloud = int(np.count_nonzero(cloud))
+    values = arr[clear]
+    stats = {
+        "cloud_fraction": n_cloud / n_valid if n_valid else 0.0,
+        "valid_fraction": n_valid / arr.size if arr.size else 0.0,
+        "snow_fraction": None,
+        "mean_fsc": None,
+    }
+    if values.size and product_type in SNOW_PRODUCTS:
+        stats["snow_fraction"] = int(np.count_nonzero(values > 0)) / values.size
+    if values.size and product_type in FSC_PRODUCTS:
+        stats["mean_fsc"] = float(values.mean())
+    return stats
+
+
+def parse_row(row):
+    for column in FLOAT_COLUMNS:
+        value = row.get(column)
+        row[column] = None if value in (None, "") or value != value else float(value)
+    for column in LIST_COLUMNS:
+        value = row.get(column) or ""
+        row[column] = value.split(LIST_SEP) if isinstance(value, str) and value else list(value)
+    mtime = row.get("mask_mtime")
+    row["mask_mtime"] = None if mtime in (None, "") or mtime != mtime else int(mtime)
+    row["date"] = str(row["date"]) if row.get("date") not in (None, "") else None
+    return row
+
+
+def format_row(row):
+    out = dict(row)
+    for column in LIST_COLUMNS:
+        out[column] = LIST_SEP.join(row.get(column) or [])
+    return {column: out.get(column) for column in COLUMNS}
+
+
+class SceneCatalog:
+    # One row per scene folder / mosaic date of an AOI and product, filled by the cloud filter
+    # from the mask it reads anyway. Rows stay valid while the mask file is unchanged, so later
+    # runs (e.g. with another cc_threshold) select scenes from the catalog without reading rasters.
+    def __init__(self, path, fmt="csv"):
+        self.path = path
+        self.fmt = fmt
+        self.rows = {}
+
+    @classmethod
+    def from_config(cls, config, processed_product_dir):
+        fmt = get_catalog_format(config)
+        return cls(get_catalog_path(processed_product_dir, fmt), fmt).load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return self
+        if self.fmt == "parquet":
+            import pandas as pd
+            records = pd.read_parquet(self.path).to_dict("records")
+        else:
+            with open(self.path, "r", newline="") as f:
+                records = list(csv.DictReader(f))
+        self.rows = {str(r["key"]): parse_row(dict(r)) for r in records}
+        return self
+
+    def save(self):
+        rows = [format_row(self.rows[key]) for key in sorted(self.rows)]
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        if self.fmt == "parquet":
+            import pandas as pd
+            pd.DataFrame(rows, columns=COLUMNS).to_parquet(tmp_path, index=False)
+        else:
+            with open(tmp_path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=COLUMNS)
+                writer.writeheader()
+                writer.writerows(rows)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key, mask_path):
+        # The row of key if it was computed from the current version of mask_path
+        row = self.rows.get(key)
+        if row is None or row["mask_mtime"] is None or row["mask_mtime"] != get_mtime(mask_path):
+            return None
+        return row
+
+    def update(self, key, stats, mask_path, files, tiles=()):
+        row = dict(stats)
+        row.update(key=key, date=get_unit_date(key), tiles=list(tiles), mask_path=mask_path,
+                   mask_mtime=get_mtime(mask_path), files=list(files))
+        self.rows[key] = row
+        return row
+
+    def prune(self, keys):
+        # Drops rows of scenes that are no longer on disk
+        for key in set(self.rows) - set(keys):
+            del self.rows[key]
+
+    def select(self, max_cloud=None, min_valid=None, min_snow=None, start=None, end=None, tiles=None):
+        # Rows matching all given bounds, by date; start/end are YYYYMMDD or YYYY-MM-DD
+        start = start.replace("-", "")[:8] if start else None
+        end = end.replace("-", "")[:8] if end else None
+        selected = []
+        for row in self.rows.values():
+            if max_cloud is not None and row["cloud_fraction"] > max_cloud:
+                continue
+            if min_valid is not None and row["valid_fraction"] < min_valid:
+                continue
+            if min_snow is not None and (row["snow_fraction"] or 0.0) < min_snow:
+                continue
+            if (start or end) and not row["date"]:
+                continue
+            if (start and row["date"] < start) or (end and row["date"] > end):
+                continue
+            if tiles is not None and not set(tiles) & set(row["tiles"]):
+                continue
+            selected.append(row)
+        return sorted(selected, key=lambda r: (r["date"] or "", r["key"]))
+
+
+def load_catalog(processed_product_dir, fmt="csv"):
+    return SceneCatalog(get_catalog_path(processed_product_dir, fmt), fmt).load()
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import fnmatch
+import threading
+
+from clms_pipeline.product_store import DATE_PATTERN, TILE_PATTERN
+from clms_pipeline.scenes import VSIZIP_INVENTORY
+
+INVENTORY_FILE = "data/cache/scene_inventory.json"
+RASTER_EXTENSIONS = (".tif", ".vrt")
+SETTLE_NS = 2 * 10 ** 9  # listings of directories modified this recently are not trusted (coarse mtimes)
+
+_inventories = {}
+
+
+class SceneFile:
+    # One layer file of a scene folder or of the mosaic folder, parsed from its name once
+    __slots__ = ("path", "product", "stage", "scene", "tile", "date", "layer", "reclassified")
+
+    def __init__(self, path, product, stage, scene, tile, date, layer, reclassified):
+        self.path = path
+        self.product = product
+        self.stage = stage
+        self.scene = scene  # scene folder name, None for mosaics
+        self.tile = tile
+        self.date = date
+        self.layer = layer
+        self.reclassified = reclassified
+
+    @property
+    def is_mosaic(self):
+        return self.scene is None
+
+    def __repr__(self):
+        return f"SceneFile({self.stage}/{self.product}/{self.scene or 'mosaic'}/{os.path.basename(self.path)})"
+
+
+def parse_layer_name(name):
+    # <scene>_<LAYER>[_reclass][_resampled].tif or mosaic_<product>_<LAYER>_<date>[_reclass][_resampled].tif|vrt
+    base = os.path.splitext(os.path.basename(name))[0]
+    if base.endswith("_resampled"):
+        base = base[:-len("_resampled")]
+    reclassified = base.endswith("_reclass")
+    if reclassified:
+        base = base[:-len("_reclass")]
+    return base.split("_"), reclassified
+
+
+def parse_scene_file(path, product, stage, scene):
+    parts, reclassified = parse_layer_name(path)
+    if scene is None:
+        if len(parts) < 4:
+            return None
+        return SceneFile(path, product, stage, None, None, parts[3], parts[2].upper(), reclassified)
+    tile = TILE_PATTERN.search(scene)
+    date = DATE_PATTERN.search(scene)
+    return SceneFile(path, product, stage, scene, tile.group(1) if tile else None, date.group(1) if date else None,
+                     parts[-1].upper(), reclassified)
+
+
+class SceneInventory:
+    # Parsed layer files of every product folder a step looked at, shared by all steps of a run.
+    # A folder is listed again only when its mtime changed (a file or scene folder was added or
+    # removed), so each step costs one stat per folder instead of a listdir and a glob. It can be
+    # saved between runs, so a restarted run does not list unchanged folders again either.
+    def __init__(self, path=None):
+        self.path = path
+        self.dirs = {}  # folder -> [mtime_ns, stable, [subdirs, rasters, files, linked subdirs]]
+        self.parsed = {}  # (folder, stage) -> (entries, SceneFiles)
+        self.lock = threading.RLock()
+        self.changed = False
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.dirs = json.load(f)
+            except ValueError:
+                self.dirs = {}
+
+    def save(self):
+        if not self.path or not self.changed:
+            return
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.dirs, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self.changed = False
+
+    def list_dir(self, path):
+        # (scene folder names, raster file paths, file names, symlinked folder names) of a
+        # folder; vsizip inventories count as rasters
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return [], [], [], []
+        key = os.path.abspath(path)
+        with self.lock:
+            cached = self.dirs.get(key)
+            # Listings saved before file names were kept are listed again
+            if cached is not None and cached[0] == mtime and cached[1] and len(cached[2]) == 4:
+                return cached[2]
+        subdirs, rasters, files, links = [], [], [], []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                    if entry.is_symlink():
+                        links.append(entry.name)
+                    continue
+                files.append(entry.name)
+                if entry.name.lower().endswith(RASTER_EXTENSIONS):
+                    rasters.append(entry.path)
+                elif entry.name == VSIZIP_INVENTORY:
+                    with open(entry.path, "r") as f:
+                        rasters.extend(line.strip() for line in f if line.strip())
+        entries = [sorted(subdirs), sorted(rasters), sorted(files), sorted(links)]
+        with self.lock:
+            self.dirs[key] = [mtime, time.time_ns() - mtime > SETTLE_NS, entries]
+            self.changed = True
+        return entries
+
+    def glob(self, pattern):
+        # Like glob.glob (hidden names excluded), with every folder on the way taken from its listing
+        if not has_magic(pattern):
+            return [pattern] if os.path.lexists(pattern) else []
+        head, tail = os.path.split(pattern)
+        parents = self.glob(head) if has_magic(head) else [head]
+        paths = []
+        for parent in parents:
+            if not os.path.isdir(parent or "."):
+                continue
+            entries = self.list_dir(parent or ".")
+            paths.extend(os.path.join(parent, name) for name in fnmatch.filter(entries[0] + entries[2], tail))
+        return sorted(paths)
+
+    def walk_files(self, path, exclude=()):
+        # Files below a folder, top-down like os.walk (symlinked folders are not followed)
+        subdirs, _, files, links = self.list_dir(path)
+        for name in files:
+            yield os.path.join(path, name)
+        for name in subdirs:
+            if name not in exclude and name not in links:
+                yield from self.walk_files(os.path.join(path, name), exclude)
+
+    def list_scenes(self, product_dir):
+        return [s for s in self.list_dir(product_dir)[0] if s != "mosaic"]
+
+    def get_dir_files(self, path, product, stage, scene):
+        # Parsed once per listing of the folder
+        entries = self.list_dir(path)
+        key = (os.path.abspath(path), stage)
+        with self.lock:
+            cached = self.parsed.get(key)
+            if cached is not None and cached[0] is entries:
+                return cached[1]
+        rasters = entries[1] if scene is None else [p for p in entries[1] if p.lower().endswith(".tif")]
+        files = [f for f in (parse_scene_file(p, product, stage, scene) for p in rasters) if f is not None]
+        with self.lock:
+            self.parsed[key] = (entries, files)
+        return files
+
+    def list_files(self, product_dir, product, stage="original", mosaic=None, scenes=None):
+        # SceneFiles of a product folder: scene folders (mosaic=False), mosaics (mosaic=True) or both
+        files = []
+        if mosaic is not True:
+            for scene in self.list_scenes(product_dir):
+                if scenes is None or scene in scenes:
+                    files.extend(self.get_dir_files(os.path.join(product_dir, scene), product, stage, scene))
+        if mosaic is not False:
+            files.extend(self.get_dir_files(os.path.join(product_dir, "mosaic"), product, stage, None))
+        return files
+
+
+def has_magic(pattern):
+    return any(c in pattern for c in "*?[")
+
+
+def get_inventory(config):
+    # One inventory per run (per inventory file), handed from step to step
+    if not getattr(config, "scene_inventory", True):
+        return SceneInventory()
+    path = getattr(config, "scene_inventory_file", INVENTORY_FILE) if getattr(config, "scene_inventory_persist", False) else None
+    if path not in _inventories:
+        _inventories[path] = SceneInventory(path)
+    return _inventories[path]
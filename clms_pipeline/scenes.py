@@ -0,0 +1,36 @@
+import glob
+import os
+
+LAYERS = ["CLD", "FSCOG", "FSCTOC", "NDSI", "QCFLAGS", "QCOG", "QCTOC", "PSA", "QC", "SSC", "QCSSC", "WSM", "QCWSM", "AT", "GF"]
+VSIZIP_INVENTORY = "vsizip_inventory.txt"
+
+
+def get_layer_from_filename(filename):
+    for layer in LAYERS:
+        if filename.lower().endswith(f"_{layer.lower()}.tif"):
+            return layer
+    return None
+
+
+def vsizip_path(zip_path, member):
+    return f"/vsizip/{os.path.abspath(zip_path)}/{member}"
+
+
+def get_file_path(path):
+    # File on disk behind a raster path: the zip of a /vsizip/ path
+    if path.startswith("/vsizip/"):
+        end = path.lower().find(".zip/")
+        if end != -1:
+            return path[len("/vsizip/"):end + len(".zip")]
+    return path
+
+
+def list_scene_rasters(scene_dir):
+    # GeoTIFFs extracted into a scene folder, plus layers that are read in place from
+    # their zip (written by Unzipper in "vsizip" mode)
+    rasters = glob.glob(os.path.join(scene_dir, "*.tif"))
+    inventory = os.path.join(scene_dir, VSIZIP_INVENTORY)
+    if os.path.exists(inventory):
+        with open(inventory, "r") as f:
+            rasters.extend(line.strip() for line in f if line.strip())
+    return rasters
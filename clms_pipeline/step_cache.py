@@ -0,0 +1,144 @@
+import os
+import time
+import json
+import hashlib
+import fnmatch
+
+from clms_pipeline.scene_inventory import get_inventory
+
+STEP_STATE_FILE = "data/cache/step_state.json"
+
+
+class StepSpec:
+    # One pipeline step: what it reads, what it writes and which config keys (fnmatch
+    # patterns) change its result. reuse_keys only select which files the step keeps (e.g.
+    # cc_threshold): a change runs the step again but keeps its up-to-date outputs. Volatile
+    # steps always run, e.g. downloads.
+    def __init__(self, name, run, config_keys, inputs=(), outputs=(), exclude=(), volatile=False, reuse_keys=()):
+        self.name = name
+        self.run = run
+        self.config_keys = config_keys
+        self.reuse_keys = list(reuse_keys)
+        self.inputs = inputs
+        self.outputs = outputs
+        self.exclude = set(exclude)
+        self.volatile = volatile
+
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def iter_files(inventory, patterns, exclude=()):
+    # Folders come from the run's inventory, so a folder whose mtime did not change since
+    # another step looked at it is not listed again
+    for pattern in patterns:
+        for path in inventory.glob(pattern):
+            if os.path.isdir(path):
+                yield from inventory.walk_files(path, exclude)
+            elif os.path.isfile(path):
+                yield path
+
+
+class StepCache:
+    def __init__(self, config, state_path=STEP_STATE_FILE, use_hash=False, force=()):
+        self.config = config
+        self.state_path = state_path
+        self.use_hash = use_hash
+        self.force = set(force)
+        self.inventory = get_inventory(config)
+        # File counts of the last step, from the same walk as its fingerprints, for the run report
+        self.counts = None
+        self.state = {}
+        if os.path.exists(state_path):
+            with open(state_path, "r") as f:
+                self.state = json.load(f)
+
+    @classmethod
+    def from_config(cls, config, force=()):
+        return cls(config, getattr(config, "step_cache_file", STEP_STATE_FILE),
+                   use_hash=getattr(config, "step_cache_hash", False), force=force)
+
+    def get_config_fingerprint(self, patterns):
+        values = {}
+        for key, value in sorted(vars(self.config).items()):
+            if any(fnmatch.fnmatch(key, pattern) for pattern in patterns):
+                values[key] = value
+        return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def scan_files(self, patterns, exclude=(), since=None):
+        # Fingerprint (mtime + size per file, or a content hash with step_cache_hash) and file
+        # counts from one walk; "new" counts files modified since `since`
+        sha1 = hashlib.sha1()
+        scan = {"files": 0, "bytes": 0, "new_files": 0, "new_bytes": 0}
+        for path in iter_files(self.inventory, patterns, exclude):
+            stat = os.stat(path)
+            state = file_sha1(path) if self.use_hash else f"{stat.st_mtime_ns}:{stat.st_size}"
+            sha1.update(f"{path}\0{state}\n".encode("utf-8"))
+            scan["files"] += 1
+            scan["bytes"] += stat.st_size
+            if since is not None and stat.st_mtime >= since:
+                scan["new_files"] += 1
+                scan["new_bytes"] += stat.st_size
+        scan["fingerprint"] = sha1.hexdigest()
+        return scan
+
+    def get_files_fingerprint(self, patterns, exclude=()):
+        return self.scan_files(patterns, exclude)["fingerprint"]
+
+    def set_counts(self, inputs, outputs):
+        self.counts = {"files_in": inputs["files"], "bytes_in": inputs["bytes"],
+                       "files_out": outputs["new_files"], "bytes_out": outputs["new_bytes"]}
+
+    def is_forced(self, step):
+        return "all" in self.force or step.name in self.force
+
+    def run(self, step):
+        config_fp = self.get_config_fingerprint(list(step.config_keys) + step.reuse_keys)
+        rebuild_fp = self.get_config_fingerprint(step.config_keys)
+        self.counts = None
+        inputs = self.scan_files(step.inputs, step.exclude)
+        outputs = self.scan_files(step.outputs, step.exclude)
+        inputs_fp, outputs_fp = inputs["fingerprint"], outputs["fingerprint"]
+        previous = self.state.get(step.name, {})
+        # Changed or deleted outputs also make a step run again
+        if (not self.is_forced(step) and not step.volatile and previous.get("config") == config_fp
+                and previous.get("inputs") == inputs_fp and previous.get("outputs") == outputs_fp):
+            print(f"Step '{step.name}' is up to date, skipping.")
+            self.set_counts(inputs, outputs)
+            return False
+        # Files of a step whose config is unchanged may be skipped when their outputs are newer
+        # than their inputs; after a config change, or when forced, every file is redone. Steps
+        # without a record keep the default (incremental runs only).
+        if self.is_forced(step) or (previous and previous.get("rebuild") != rebuild_fp):
+            self.config.step_reuse_outputs = False
+        elif previous:
+            self.config.step_reuse_outputs = True
+        start = time.time()
+        try:
+            step.run()
+        finally:
+            self.config.step_reuse_outputs = None
+        # Inputs are fingerprinted again, as some steps (unzip) change them
+        inputs = self.scan_files(step.inputs, step.exclude)
+        outputs = self.scan_files(step.outputs, step.exclude, since=start)
+        self.set_counts(inputs, outputs)
+        self.state[step.name] = {
+            "config": config_fp,
+            "rebuild": rebuild_fp,
+            "inputs": inputs["fingerprint"],
+            "outputs": outputs["fingerprint"],
+        }
+        self.save()
+        return True
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
@@ -1,7 +1,19 @@
 # clms_pipeline.steps package init
-from .tile_determiner import TileDeterminer
-from .downloader import Downloader
-from .mosaic import MosaicBuilder
-from .reclassify import Reclassifier
-from .resample import Resampler
-from .cloud_filter import CloudFilter
+# The step classes are imported on first access, so importing one step module does not
+# pull in the dependencies (rasterio, geopandas, ...) of all the others
+import importlib
+
+_STEP_MODULES = {
+    "TileDeterminer": "tile_determiner",
+    "Downloader": "downloader",
+    "MosaicBuilder": "mosaic",
+    "Reclassifier": "reclassify",
+    "Resampler": "resample",
+    "CloudFilter": "cloud_filter",
+}
+
+
+def __getattr__(name):
+    if name not in _STEP_MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f".{_STEP_MODULES[name]}", __name__), name)
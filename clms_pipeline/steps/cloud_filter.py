@@ -1,62 +1,232 @@
 import os
-import glob
+import logging
+import json
+import shutil
+from collections import defaultdict
 import rasterio
 import numpy as np
 
+from clms_pipeline.executor import ParallelExecutor
+from clms_pipeline.incremental import is_incremental, is_up_to_date
+from clms_pipeline.product_store import get_scene_tile
+from clms_pipeline.reclass_lut import RAW_ENCODING, get_default_encoding, read_encoding
+from clms_pipeline.reference_grid import get_reference_grid
+from clms_pipeline.scene_catalog import SceneCatalog, compute_scene_stats, get_date_tiles, is_catalog_enabled
+from clms_pipeline.scene_inventory import get_inventory, parse_layer_name
+from clms_pipeline.windows import get_aoi_window, is_empty, is_windowed
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_MASK_LAYERS = {
+    "FSC": "FSCOG",
+    "PSA": "PSA",
+    "WDS": "SSC",
+    "SWS": "WSM",
+    "GFSC": "GF"
+}
+CLOUD_SCORES_FILE = "cloud_scores.json"
+
+
+def is_pushdown_enabled(config):
+    return getattr(config, "cc_pushdown", False) and getattr(config, "filter_cc", False)
+
+
+def load_cloud_scores(processed_product_dir):
+    path = os.path.join(processed_product_dir, CLOUD_SCORES_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def get_rejected_scenes(config, processed_product_dir):
+    # Scene folder names / mosaic dates whose source cloud fraction is above the threshold
+    if not is_pushdown_enabled(config):
+        return set()
+    cc_threshold = config.cc_threshold
+    return {key for key, cc in load_cloud_scores(processed_product_dir).items() if cc > cc_threshold}
+
+
+def link_or_copy(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
 class CloudFilter:
     def __init__(self, config):
         self.config = config
+        self.executor = ParallelExecutor.from_config(config)
+
+    def get_cloud_mask(self, arr, encoding):
+        # encoding gives the cloud and nodata codes (raw, or written by the Reclassifier)
+        return arr == encoding["cloud"]
+
+    def get_cloud_fraction(self, mask_arr, encoding):
+        cloud_mask = self.get_cloud_mask(mask_arr, encoding)
+        valid_mask = mask_arr != encoding["nodata"]
+        total_pixels = np.sum(valid_mask)
+        cloud_pixels = np.sum(cloud_mask & valid_mask)
+        return cloud_pixels / total_pixels if total_pixels > 0 else 0
+
+    def get_layer_from_filename(self, filename):
+        # <scene>_<LAYER>[_reclass][_resampled].tif or mosaic_<product>_<LAYER>_<date>[_reclass][_resampled].tif
+        parts = parse_layer_name(filename)[0]
+        return (parts[2] if parts[0] == "mosaic" and len(parts) >= 4 else parts[-1]).upper()
 
-    def get_cloud_mask(self, arr, use_reclassify):
-        if use_reclassify:
-            return arr == -9999
-        else:
-            return arr == 205
+    def get_units(self, input_dir, use_mosaic, product_type=None):
+        # Groups the files that are kept or dropped together: one scene folder, or one mosaic date
+        groups = defaultdict(list)
+        for scene_file in get_inventory(self.config).list_files(input_dir, product_type, "resampled", mosaic=use_mosaic):
+            if scene_file.path.lower().endswith(".tif"):
+                groups[scene_file.date if use_mosaic else scene_file.scene].append(scene_file.path)
+        return [(key, "mosaic" if use_mosaic else key, files) for key, files in sorted(groups.items())]
 
-    def filter_by_cloud_coverage(self, input_dir, output_dir, cc_threshold, use_reclassify, product_type):
+    def get_scene_stats(self, mask_path, ref_area, use_reclassify, product_type):
+        # Statistics of the source mask over the reference raster (ref_area = (bounds, crs)) when
+        # there is one, as reclassified masks map clouds to no data by default; otherwise of the
+        # processed mask with the encoding it was written with
+        with rasterio.open(mask_path) as src:
+            if ref_area is None:
+                encoding = read_encoding(src) or get_default_encoding(use_reclassify)
+                arr = src.read(1)
+            else:
+                encoding = RAW_ENCODING
+                window = get_aoi_window(src, *ref_area)
+                arr = src.read(1, window=window) if window is not None else np.empty(0, dtype=np.uint8)
+        return compute_scene_stats(arr, encoding, product_type)
+
+    def filter_by_cloud_coverage(self, input_dir, output_dir, cc_threshold, use_reclassify, product_type,
+                                 use_mosaic=False, scores=None, catalog=None, date_tiles=None,
+                                 source_masks=None, ref_area=None):
         os.makedirs(output_dir, exist_ok=True)
-        product_layer_map = {
-            "FSC": "FSCOG",
-            "PSA": "PSA",
-            "WDS": "SSC",
-            "SWS": "WSM",
-            "GFSC": "GF"
-        }
-        layer_suffix = product_layer_map.get(product_type.upper(), None)
+        layer_suffix = PRODUCT_MASK_LAYERS.get(product_type.upper(), None)
         if layer_suffix is None:
             print(f"Unknown product type: {product_type}. Skipping cloud filtering.")
             return
-        for subfolder in os.listdir(input_dir):
-            subfolder_path = os.path.join(input_dir, subfolder)
-            if not os.path.isdir(subfolder_path) or subfolder == "mosaic":
+        scores = scores or {}
+        date_tiles = date_tiles or {}
+        source_masks = source_masks or {}
+        units = self.get_units(input_dir, use_mosaic, product_type)
+        tasks = []
+        selected = 0
+        for key, out_rel, files in units:
+            mask_paths = [p for p in files if self.get_layer_from_filename(os.path.basename(p)) == layer_suffix]
+            if key not in scores and not mask_paths:
+                logger.debug(f"Cloud mask layer ({layer_suffix}) not found for {key}, skipping cloud filtering.")
                 continue
-            out_subfolder = os.path.join(output_dir, subfolder)
-            os.makedirs(out_subfolder, exist_ok=True)
-            tif_files = glob.glob(os.path.join(subfolder_path, "*.tif"))
-            for tif_path in tif_files:
-                base_parts = os.path.basename(tif_path).split("_")
-                base_parts[-1] = f"{layer_suffix}.tif"
-                layer_filename = "_".join(base_parts)
-                layer_path = os.path.join(subfolder_path, layer_filename)
-                if not os.path.exists(layer_path):
-                    print(f"Cloud mask layer file not found for {tif_path} (expected: {layer_filename}), skipping cloud filtering.")
-                    continue
-                with rasterio.open(layer_path) as mask_src:
-                    mask_arr = mask_src.read(1)
-                    cloud_mask = self.get_cloud_mask(mask_arr, use_reclassify)
-                    valid_mask = (mask_arr != -9999) if use_reclassify else (mask_arr != 255)
-                    total_pixels = np.sum(valid_mask)
-                    cloud_pixels = np.sum(cloud_mask & valid_mask)
-                    cc_fraction = cloud_pixels / total_pixels if total_pixels > 0 else 0
-                with rasterio.open(tif_path) as src:
-                    arr = src.read(1)
-                    if cc_fraction <= cc_threshold:
-                        out_path = os.path.join(out_subfolder, os.path.basename(tif_path))
-                        with rasterio.open(out_path, "w", **src.meta) as dst:
-                            dst.write(arr, 1)
-                        print(f"Kept {tif_path} (cloud fraction: {cc_fraction:.2%})")
-                    else:
-                        print(f"Filtered out {tif_path} (cloud fraction: {cc_fraction:.2%})")
+            out_subfolder = os.path.join(output_dir, out_rel)
+            source_mask = source_masks.get(key) if ref_area is not None else None
+            mask_path = source_mask or (mask_paths[0] if mask_paths else None)
+            row = catalog.get(key, mask_path) if catalog is not None else None
+            if row is not None:
+                # Already in the catalog: selecting against cc_threshold is a lookup, no raster is read
+                cc_fraction = scores.get(key, row["cloud_fraction"])
+                self.apply_selection(key, files, out_subfolder, cc_threshold, cc_fraction, row["valid_fraction"])
+                selected += 1
+                continue
+            out_paths = [os.path.join(out_subfolder, os.path.basename(p)) for p in files]
+            if catalog is None and all(is_up_to_date(self.config, o, [p] + mask_paths) for o, p in zip(out_paths, files)):
+                continue
+            tiles = [get_scene_tile(key)] if get_scene_tile(key) else date_tiles.get(key, [])
+            tasks.append((key, files, mask_path, ref_area if source_mask else None, out_subfolder, cc_threshold,
+                          use_reclassify, scores.get(key), catalog is not None, product_type.upper(), tiles))
+        if selected:
+            logger.debug(f"Selected {selected} units of {input_dir} from the scene catalog")
+        results = self.executor.map(self.filter_unit, tasks, label="cloud filtering tasks")
+        if catalog is None:
+            return
+        for task, result in zip(tasks, results):
+            if result.ok and result.value is not None:
+                key, files, mask_path = task[:3]
+                catalog.update(key, result.value, mask_path, files, tiles=task[-1])
+        catalog.prune(key for key, _, _ in units)
+        catalog.save()
+
+    def apply_selection(self, key, files, out_subfolder, cc_threshold, cc_fraction, valid_fraction=None):
+        out_paths = [os.path.join(out_subfolder, os.path.basename(p)) for p in files]
+        empty = valid_fraction == 0 and is_windowed(self.config)
+        if empty or cc_fraction > cc_threshold:
+            # Outputs kept by an earlier run with a higher threshold are removed
+            for out_path in out_paths:
+                if os.path.exists(out_path):
+                    os.remove(out_path)
+            return f"Filtered out {key} (no valid pixels)" if empty else f"Filtered out {key} (cloud fraction: {cc_fraction:.2%})"
+        # Kept files are identical to their input, so link or copy them instead of re-encoding
+        os.makedirs(out_subfolder, exist_ok=True)
+        for tif_path, out_path in zip(files, out_paths):
+            if not is_up_to_date(self.config, out_path, [tif_path]):
+                link_or_copy(tif_path, out_path)
+        return f"Kept {key} ({len(files)} files, cloud fraction: {cc_fraction:.2%})"
+
+    def filter_unit(self, task):
+        # Returns the unit's scene statistics when they are collected for the catalog
+        (key, files, mask_path, ref_area, out_subfolder, cc_threshold, use_reclassify, cc_fraction, with_stats,
+         product_type, tiles) = task
+        stats = None
+        if mask_path is not None and (cc_fraction is None or with_stats):
+            stats = self.get_scene_stats(mask_path, ref_area, use_reclassify, product_type)
+            if cc_fraction is None:
+                cc_fraction = stats["cloud_fraction"]
+        valid_fraction = stats["valid_fraction"] if stats is not None else None
+        logger.debug(self.apply_selection(key, files, out_subfolder, cc_threshold, cc_fraction, valid_fraction))
+        return stats
+
+    def score_source(self, task):
+        mask_path, ref_bounds, ref_crs = task
+        skip_empty = is_windowed(self.config)
+        with rasterio.open(mask_path) as src:
+            window = get_aoi_window(src, ref_bounds, ref_crs)
+            if window is None:
+                return 1.0 if skip_empty else 0.0
+            arr = src.read(1, window=window)
+        if skip_empty and is_empty(arr, RAW_ENCODING["nodata"]):
+            # Nothing to see over the reference raster: scored as fully clouded so it is dropped
+            return 1.0
+        # Source layers still carry the original codes (205 = cloud, 255 = no data)
+        return float(self.get_cloud_fraction(arr, RAW_ENCODING))
+
+    def get_source_units(self, in_dir, product_type):
+        mask_layer = PRODUCT_MASK_LAYERS.get(product_type.upper())
+        units = {}
+        if mask_layer is None or not os.path.isdir(in_dir):
+            return units
+        for scene_file in get_inventory(self.config).list_files(in_dir, product_type):
+            if scene_file.layer == mask_layer and not scene_file.reclassified:
+                units[scene_file.date if scene_file.is_mosaic else scene_file.scene] = scene_file.path
+        return units
+
+    def score_sources(self):
+        # Pushdown: score the cloud fraction over the AOI footprint on the source layers, so
+        # scenes above the threshold are never reclassified or resampled
+        if not is_pushdown_enabled(self.config):
+            return
+        print("Scoring cloud coverage on source layers...")
+        project_root = os.getcwd()
+        for raster_entry in self.config.reference_rasters:
+            raster_folder = os.path.splitext(raster_entry["name"])[0]
+            grid = get_reference_grid(self.config, raster_entry)
+            ref_bounds, ref_crs = grid.bounds, grid.crs
+            for product_type in self.config.clms_product:
+                in_dir = os.path.join(project_root, self.config.output_path_original, raster_folder, product_type)
+                out_dir = os.path.join(project_root, self.config.output_path_processed, raster_folder, product_type)
+                scores = load_cloud_scores(out_dir) if is_incremental(self.config) else {}
+                units = {k: v for k, v in self.get_source_units(in_dir, product_type).items() if k not in scores}
+                keys = sorted(units)
+                results = self.executor.map(self.score_source, [(units[k], ref_bounds, ref_crs) for k in keys],
+                                            label="cloud scoring tasks")
+                for key, result in zip(keys, results):
+                    if result.ok:
+                        scores[key] = result.value
+                rejected = sum(1 for cc in scores.values() if cc > self.config.cc_threshold)
+                print(f"{raster_folder} / {product_type}: {len(scores) - rejected} of {len(scores)} scenes below the cloud threshold.")
+                os.makedirs(out_dir, exist_ok=True)
+                with open(os.path.join(out_dir, CLOUD_SCORES_FILE), "w") as f:
+                    json.dump(scores, f, indent=1, sort_keys=True)
+        print("Cloud scoring finished.")
 
     def filter_clouds(self):
         if not (getattr(self.config, "crop_resample", False) and getattr(self.config, "filter_cc", False)):
@@ -65,25 +235,31 @@ class CloudFilter:
         print("Starting cloud coverage filtering...")
         use_reclassify = getattr(self.config, "reclassify", False)
         cc_threshold = self.config.cc_threshold
-        base_in_dir = os.path.join(os.getcwd(), "data/clms_data/processed", "resampled")
-        base_out_dir = os.path.join(os.getcwd(), "data/clms_data/processed", "cc_filtered")
+        project_root = os.getcwd()
 
         for raster_entry in self.config.reference_rasters:
             raster_folder = os.path.splitext(raster_entry["name"])[0]
             for product_type in self.config.clms_product:
-                # Ensure output subfolders exist
-                os.makedirs(os.path.join(base_out_dir, raster_folder, product_type), exist_ok=True)
-                os.makedirs(os.path.join(base_out_dir, raster_folder, product_type, "mosaic"), exist_ok=True)
-
-                mosaic_dir = os.path.join(base_in_dir, raster_folder, product_type, "mosaic")
-                if os.path.exists(mosaic_dir) and any(glob.glob(os.path.join(mosaic_dir, "*.tif"))):
-                    in_dir = mosaic_dir
-                    out_dir = os.path.join(base_out_dir, raster_folder, product_type, "mosaic")
+                base_dir = os.path.join(project_root, self.config.output_path_processed, raster_folder, product_type)
+                in_dir = os.path.join(base_dir, "resampled")
+                out_dir = os.path.join(base_dir, "cc_filtered")
+                if not os.path.isdir(in_dir):
+                    print(f"Resampled directory not found: {in_dir}")
+                    continue
+                scores = load_cloud_scores(base_dir) if is_pushdown_enabled(self.config) else None
+                catalog = SceneCatalog.from_config(self.config, base_dir) if is_catalog_enabled(self.config) else None
+                original_dir = os.path.join(project_root, self.config.output_path_original, raster_folder, product_type)
+                grid = get_reference_grid(self.config, raster_entry)
+                inventory = get_inventory(self.config)
+                use_mosaic = any(f.path.lower().endswith(".tif")
+                                 for f in inventory.list_files(in_dir, product_type, "resampled", mosaic=True))
+                if use_mosaic:
                     print(f"Filtering cloud coverage in mosaiced resampled images for {raster_folder} / {product_type}...")
-                    self.filter_by_cloud_coverage(in_dir, out_dir, cc_threshold, use_reclassify, product_type)
                 else:
-                    in_dir = os.path.join(base_in_dir, raster_folder, product_type)
-                    out_dir = os.path.join(base_out_dir, raster_folder, product_type)
                     print(f"No mosaics found, filtering resampled images for {raster_folder} / {product_type}...")
-                    self.filter_by_cloud_coverage(in_dir, out_dir, cc_threshold, use_reclassify, product_type)
+                self.filter_by_cloud_coverage(in_dir, out_dir, cc_threshold, use_reclassify, product_type,
+                                              use_mosaic=use_mosaic, scores=scores, catalog=catalog,
+                                              date_tiles=get_date_tiles(inventory.list_scenes(original_dir)),
+                                              source_masks=self.get_source_units(original_dir, product_type),
+                                              ref_area=(grid.bounds, grid.crs))
         print("Cloud coverage filtering finished.")
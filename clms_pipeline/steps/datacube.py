@@ -0,0 +1,138 @@
+import os
+import logging
+import re
+import glob
+from collections import defaultdict
+import numpy as np
+import rasterio
+
+from clms_pipeline.datacube import EXTENSIONS, Datacube
+from clms_pipeline.reference_grid import get_reference_grid
+
+logger = logging.getLogger(__name__)
+
+DATE_PATTERN = re.compile(r"_(\d{8})(?:T|-|_|\.)")
+
+
+class DatacubeExporter:
+    # Stacks the final per-date layers of each AOI/product into one time x y x cube per layer,
+    # so a pixel time series is a single read instead of one file per date
+    def __init__(self, config):
+        self.config = config
+
+    def get_date(self, filename):
+        match = DATE_PATTERN.search(filename)
+        return match.group(1) if match else None
+
+    def get_layer(self, filename):
+        # <scene>_<LAYER>[_reclass]_resampled.tif or mosaic_<product>_<LAYER>_<date>[_reclass]_resampled.tif
+        base = filename[:-4]
+        for suffix in ("_resampled", "_reclass"):
+            if base.endswith(suffix):
+                base = base[:-len(suffix)]
+        parts = base.split("_")
+        if filename.startswith("mosaic_") and len(parts) >= 4:
+            return parts[2].upper()
+        return parts[-1].upper()
+
+    def collect_layers(self, in_dir):
+        # {layer: {date: [files]}}; several tiles of one date are combined into one slice
+        layers = defaultdict(lambda: defaultdict(list))
+        # Mosaics are used if there are any, single scenes otherwise (same rule as CloudFilter)
+        tif_files = sorted(glob.glob(os.path.join(in_dir, "mosaic", "*.tif")))
+        if not tif_files:
+            tif_files = sorted(glob.glob(os.path.join(in_dir, "*", "*.tif")))
+        for tif_path in tif_files:
+            filename = os.path.basename(tif_path)
+            yyyymmdd = self.get_date(filename)
+            if yyyymmdd is None:
+                logger.debug(f"Skipping file (no date found): {tif_path}")
+                continue
+            layers[self.get_layer(filename)][yyyymmdd].append(tif_path)
+        return layers
+
+    def get_sources(self, paths):
+        return [[path, os.path.getmtime(path)] for path in paths]
+
+    def read_date(self, paths, grid, nodata):
+        # The first valid pixel wins, as in MosaicBuilder
+        arr = None
+        for path in paths:
+            with rasterio.open(path) as src:
+                if (src.height, src.width) != (grid.height, grid.width):
+                    logger.warning(f"Skipping {path} (not on the reference grid)")
+                    continue
+                data = src.read(1)
+            if arr is None:
+                arr = data.copy()
+            else:
+                fill = arr == nodata
+                arr[fill] = data[fill]
+        return arr
+
+    def export_layer(self, cube_path, layer, by_date, grid):
+        fmt = getattr(self.config, "datacube_format", "memmap")
+        cube = Datacube(cube_path, fmt, chunks=tuple(getattr(self.config, "datacube_chunks", (64, 64, 64))))
+        sources = {d: self.get_sources(paths) for d, paths in by_date.items()}
+        new_dates = sorted(d for d in by_date if d not in cube.dates and cube.empty.get(d) != sources[d])
+        removed = [d for d in cube.dates if d not in by_date]
+        if removed:
+            # e.g. scenes no longer below the cloud threshold; their slices must not stay in the cube
+            print(f"    {layer}: {len(removed)} dates no longer in the input, rebuilding")
+            cube.index = None
+        elif cube.dates and new_dates and new_dates[0] < cube.dates[-1]:
+            # Dates are kept in order, so a date older than the cube's last one means a rebuild
+            print(f"    {layer}: new date {new_dates[0]} is older than the cube, rebuilding")
+            cube.index = None
+        if cube.index is None:
+            with rasterio.open(by_date[min(by_date)][0]) as src:
+                dtype, nodata = src.dtypes[0], src.nodata
+            cube.create(grid, dtype, nodata if nodata is not None else grid.nodata)
+            new_dates = sorted(by_date)
+        cube.grid = grid
+        nodata = cube.index["nodata"]
+        for yyyymmdd in [d for d in cube.empty if d not in by_date]:
+            del cube.empty[yyyymmdd]
+        updated = 0
+        for yyyymmdd in cube.dates:
+            if sources[yyyymmdd] != cube.index["sources"].get(yyyymmdd):
+                arr = self.read_date(by_date[yyyymmdd], grid, nodata)
+                if arr is None:
+                    arr = np.full((grid.height, grid.width), nodata, dtype=cube.index["dtype"])
+                cube.write(yyyymmdd, arr, sources[yyyymmdd])
+                updated += 1
+        appended = 0
+        for yyyymmdd in new_dates:
+            arr = self.read_date(by_date[yyyymmdd], grid, nodata)
+            if arr is None:
+                cube.mark_empty(yyyymmdd, sources[yyyymmdd])
+                continue
+            cube.empty.pop(yyyymmdd, None)
+            cube.append(yyyymmdd, arr, sources[yyyymmdd])
+            appended += 1
+        cube.save_index()
+        print(f"    {layer}: {appended} dates appended, {updated} updated, {len(cube.dates)} in {cube_path}")
+
+    def export(self):
+        if not getattr(self.config, "datacube_export", False):
+            return
+        fmt = getattr(self.config, "datacube_format", "memmap")
+        print(f"Exporting time-series datacubes ({fmt})...")
+        project_root = os.getcwd()
+        # Same final outputs as the rest of the pipeline: cloud-filtered if enabled, resampled otherwise
+        stage = "cc_filtered" if getattr(self.config, "filter_cc", False) else "resampled"
+        for raster_entry in self.config.reference_rasters:
+            raster_folder = os.path.splitext(raster_entry["name"])[0]
+            grid = get_reference_grid(self.config, raster_entry)
+            for product_type in self.config.clms_product:
+                base_dir = os.path.join(project_root, self.config.output_path_processed, raster_folder, product_type)
+                in_dir = os.path.join(base_dir, stage)
+                if not os.path.isdir(in_dir):
+                    print(f"{stage} directory not found: {in_dir}")
+                    continue
+                out_dir = os.path.join(base_dir, "datacube")
+                os.makedirs(out_dir, exist_ok=True)
+                print(f"  {raster_folder} / {product_type}:")
+                for layer, by_date in sorted(self.collect_layers(in_dir).items()):
+                    self.export_layer(os.path.join(out_dir, f"{layer}{EXTENSIONS[fmt]}"), layer, by_date, grid)
+        print("Datacube export finished.")
@@ -3,12 +3,47 @@ import requests
 import sys
 import re
 import shutil
+from datetime import datetime, timedelta
+from functools import partial
+
+from clms_pipeline.download_scheduler import DownloadJob, DownloadScheduler
+from clms_pipeline.hrsi_client import HRSIClient
+from clms_pipeline.incremental import ProductManifest, is_incremental
+from clms_pipeline.product_store import ProductStore, is_store_enabled
+
+def get_window_index(date, origin, days):
+    # Index of the days-day window that date (YYYY-MM-DD... or YYYYMMDD) falls in, counted from origin
+    date = date.replace("-", "")[:8]
+    return (datetime.strptime(date, "%Y%m%d") - datetime.strptime(origin[:10], "%Y-%m-%d")).days // days
+
+
+def split_date_ranges(date_ranges, days, origin):
+    # Cuts (start, end) ranges at every days-day boundary counted from origin (the run's start date)
+    origin_day = datetime.strptime(origin[:10], "%Y-%m-%d")
+    result = []
+    for range_start, range_end in date_ranges:
+        start = range_start
+        while start <= range_end:
+            offset = get_window_index(start, origin, days)
+            window_end = (origin_day + timedelta(days=(offset + 1) * days - 1)).strftime("%Y-%m-%dT23:59:59Z")
+            result.append((start, min(range_end, window_end)))
+            start = (origin_day + timedelta(days=(offset + 1) * days)).strftime("%Y-%m-%dT00:00:00Z")
+    return result
+
 
 class Downloader:
     def __init__(self, config):
         self.config = config
+        self.manifests = {}
 
     def download_clms_downloader(self):
+        local_script = getattr(self.config, "clms_downloader_script", None)
+        if local_script:
+            if os.path.exists(local_script):
+                print(f"Using configured downloader script: {local_script}")
+                return os.path.abspath(local_script)
+            print(f"Configured downloader script not found: {local_script}")
+            return None
         url = "https://raw.githubusercontent.com/eea/clms-hrsi-api-client-python/refs/heads/main/clms_hrsi_downloader.py"
         script_dir = os.path.dirname(os.path.abspath(__file__))
         local_path = os.path.join(script_dir, "CLMS_downloader.py")
@@ -25,27 +60,7 @@ class Downloader:
             print("Download failed or file is empty!")
             return None
 
-    def delete_clms_data(self):
-        # Delete all contents of data/clms_data/original and data/clms_data/processed before running
-        project_root = os.getcwd()
-        original_dir = os.path.join(project_root, "data/clms_data/original")
-        processed_dir = os.path.join(project_root, "data/clms_data/processed")
-        for folder in [original_dir, processed_dir]:
-            if os.path.exists(folder):
-                print(f"Deleting all contents in: {folder}")
-                shutil.rmtree(folder)
-                os.makedirs(folder, exist_ok=True)
-            else:
-                os.makedirs(folder, exist_ok=True)
-
-    def download(self):
-        print("Starting CLMS data download...")
-        self.delete_clms_data()
-        clms_downloader_path = self.download_clms_downloader()
-        if clms_downloader_path is None:
-            print("Cannot proceed without CLMS_downloader.py.")
-            return
-
+    def write_credentials_file(self):
         # --- Ensure clms_data directory exists ---
         base_dir = os.path.dirname(self.config.__file__) if hasattr(self.config, "__file__") else os.getcwd()
         clms_data_dir = os.path.join(base_dir, "data/clms_data")
@@ -65,6 +80,51 @@ class Downloader:
                 print(f"Credentials file at {credentials_path} is incomplete or malformed. Recreating...")
                 with open(credentials_path, "w") as f:
                     f.write(f"{self.config.clms_username}:{self.config.clms_password}\n")
+        return credentials_path
+
+    def delete_clms_data(self):
+        # Delete all contents of data/clms_data/original and data/clms_data/processed before running
+        project_root = os.getcwd()
+        original_dir = os.path.join(project_root, "data/clms_data/original")
+        processed_dir = os.path.join(project_root, "data/clms_data/processed")
+        for folder in [original_dir, processed_dir]:
+            if os.path.exists(folder):
+                print(f"Deleting all contents in: {folder}")
+                shutil.rmtree(folder)
+                os.makedirs(folder, exist_ok=True)
+            else:
+                os.makedirs(folder, exist_ok=True)
+
+    def download(self):
+        print("Starting CLMS data download...")
+        jobs = self.get_jobs()
+        if jobs is None:
+            return
+        scheduler = DownloadScheduler.from_config(self.config)
+        results = scheduler.run(jobs)
+        for result in results:
+            self.finish_job(result)
+        self.save_manifests()
+        return results
+
+    def get_jobs(self, window_days=None):
+        # Download jobs for every tile x product (x date window of window_days days), or None
+        # if the configuration is invalid
+        incremental = is_incremental(self.config)
+        if incremental:
+            print("Incremental mode: keeping existing data and downloading only missing dates.")
+        else:
+            self.delete_clms_data()
+        client = None
+        if getattr(self.config, "download_client", "script") == "native":
+            client = HRSIClient.from_config(self.config)
+            print(f"Using the in-process download client ({client.api_url}).")
+        else:
+            clms_downloader_path = self.download_clms_downloader()
+            if clms_downloader_path is None:
+                print("Cannot proceed without CLMS_downloader.py.")
+                return None
+            credentials_path = self.write_credentials_file()
 
         ALLOWED_PRODUCTS = ["FSC", "PSA", "SWS", "WDS", "GFSC"]
         ALLOWED_QUERY_TYPES = ["query", "download", "query_and_download"]
@@ -84,24 +144,28 @@ class Downloader:
         if invalid_products:
             print(f"Invalid product types found: {invalid_products}")
             print(f"Allowed products are: {ALLOWED_PRODUCTS}")
-            return
+            return None
 
         if not is_valid_date(start_date):
             print(f"Start date format invalid: {start_date}")
             print("Expected format: YYYY-MM-DDTHH:MM:SSZ")
-            return
+            return None
         if not is_valid_date(end_date):
             print(f"End date format invalid: {end_date}")
             print("Expected format: YYYY-MM-DDTHH:MM:SSZ")
-            return
+            return None
         if query_type not in ALLOWED_QUERY_TYPES:
             print(f"Invalid query type: {query_type}")
             print(f"Allowed query types are: {ALLOWED_QUERY_TYPES}")
-            return
+            return None
 
         def get_raster_folder_name(raster_entry):
             return os.path.splitext(raster_entry["name"])[0]
 
+        store = ProductStore.from_config(self.config) if is_store_enabled(self.config) else None
+        use_manifest = self.uses_manifest()
+        queued = set()
+        jobs = []
         for raster_entry in reference_rasters:
             raster_folder = get_raster_folder_name(raster_entry)
             tile_file = os.path.join(os.getcwd(), "data/tile_system", f"relevant_tiles_{raster_folder}.txt")
@@ -114,29 +178,99 @@ class Downloader:
                 print(f"No tile names found in the txt file for raster {raster_folder}.")
                 continue
 
+            print(f"\n=== Queueing reference raster: {raster_entry['name']} (folder: {raster_folder}) ===")
             for tile in tile_names:
-                print(f"\n=== Processing reference raster: {raster_entry['name']} (folder: {raster_folder}) ===")
-                print(f"--- Working on tile: {tile} ---")
                 for product_type in product_types:
-                    product_output_dir = os.path.join(output_path, raster_folder, product_type)
-                    os.makedirs(product_output_dir, exist_ok=True)
-                    print(f"Creating product output directory: {product_output_dir}")
-                    cmd = (
-                        f"python {clms_downloader_path} "
-                        f"-{query_type} "
-                        f"-productIdentifier {tile} "
-                        f"-productType {product_type} "
-                        f"-obsDateMin {start_date} "
-                        f"-obsDateMax {end_date} "
-                        f"-hrsi_credentials {credentials_path} "
-                        f"{product_output_dir}"
-                    )
-                    print(f"Running: {cmd}")
-                    os.system(cmd)
-                    result_file = os.path.join(product_output_dir, "result_file.txt")
-                    new_result_file = os.path.join(product_output_dir, f"result_file_{tile}_{product_type}.txt")
-                    if os.path.exists(result_file):
-                        os.rename(result_file, new_result_file)
-                        print(f"Renamed {result_file} to {new_result_file}")
+                    if store is not None:
+                        if (tile, product_type) in queued:
+                            continue
+                        queued.add((tile, product_type))
+                        product_output_dir = store.get_product_dir(product_type)
+                    else:
+                        product_output_dir = os.path.join(output_path, raster_folder, product_type)
+                    if use_manifest:
+                        date_ranges = self.get_manifest(product_output_dir).missing_ranges(tile, start_date, end_date)
+                        if not date_ranges:
+                            print(f"All dates already downloaded for {raster_folder}/{tile}/{product_type}, skipping.")
+                            continue
                     else:
-                        print(f"Warning: {result_file} not found after download.")
+                        date_ranges = [(start_date, end_date)]
+                    if window_days:
+                        date_ranges = split_date_ranges(date_ranges, window_days, start_date)
+                    for i, (range_start, range_end) in enumerate(date_ranges):
+                        # Each job gets its own staging dir so concurrent jobs don't clobber result_file.txt
+                        staging_dir = os.path.join(product_output_dir, f".download_{tile}_{i}")
+                        os.makedirs(staging_dir, exist_ok=True)
+                        if client is not None:
+                            cmd = None
+                            stored = set(store.list_products(product_type)) if store is not None else ()
+                            func = partial(client.fetch, tile, product_type, range_start, range_end, staging_dir, query_type,
+                                           skip=stored)
+                        else:
+                            cmd = [
+                                sys.executable, clms_downloader_path,
+                                f"-{query_type}",
+                                "-productIdentifier", tile,
+                                "-productType", product_type,
+                                "-obsDateMin", range_start,
+                                "-obsDateMax", range_end,
+                                "-hrsi_credentials", credentials_path,
+                                staging_dir,
+                            ]
+                            func = None
+                        jobs.append(DownloadJob(f"{raster_folder}/{tile}/{product_type}/{range_start[:10]}..{range_end[:10]}",
+                                                cmd, staging_dir, tile=tile, product_type=product_type,
+                                                raster_folder=raster_folder, start_date=range_start, end_date=range_end,
+                                                func=func))
+        return jobs
+
+    def uses_manifest(self):
+        # With the product store each tile x product is fetched once for all reference rasters, and
+        # the store's manifest keeps it from being fetched again in later runs
+        return is_incremental(self.config) or is_store_enabled(self.config)
+
+    def finish_job(self, result):
+        # Moves a finished job's files into its product dir and records it in the manifest
+        if result.success:
+            result_lines = self.collect_job_output(result.job)
+            if self.uses_manifest() and getattr(self.config, "clms_query_type", None) != "query":
+                manifest = self.get_manifest(os.path.dirname(result.job.output_dir))
+                manifest.record_query(result.job.tile, result.job.start_date, result.job.end_date, result_lines)
+            return result_lines
+        if os.path.isdir(result.job.output_dir):
+            shutil.rmtree(result.job.output_dir)
+        return []
+
+    def save_manifests(self):
+        for manifest in self.manifests.values():
+            manifest.save()
+
+    def get_manifest(self, product_dir):
+        if product_dir not in self.manifests:
+            settle_days = getattr(self.config, "incremental_settle_days", 2)
+            self.manifests[product_dir] = ProductManifest(product_dir, settle_days=settle_days)
+        return self.manifests[product_dir]
+
+    def collect_job_output(self, job):
+        # Move everything a job downloaded from its staging dir into the product dir
+        product_output_dir = os.path.dirname(job.output_dir)
+        result_lines = []
+        for entry in os.listdir(job.output_dir):
+            src = os.path.join(job.output_dir, entry)
+            if entry == "result_file.txt":
+                # Several date ranges of one tile end up in the same result file
+                with open(src, "r") as f:
+                    result_lines = f.readlines()
+                with open(os.path.join(product_output_dir, f"result_file_{job.tile}_{job.product_type}.txt"), "a") as f:
+                    f.writelines(result_lines)
+                os.remove(src)
+                continue
+            else:
+                dst = os.path.join(product_output_dir, entry)
+            if os.path.isdir(dst) and not os.path.islink(dst):
+                shutil.rmtree(dst)
+            shutil.move(src, dst)
+        if not os.path.exists(os.path.join(product_output_dir, f"result_file_{job.tile}_{job.product_type}.txt")):
+            print(f"Warning: result_file.txt not found after download for {job.name}.")
+        os.rmdir(job.output_dir)
+        return result_lines
@@ -1,15 +1,32 @@
 import os
-import glob
+import logging
+import math
 import rasterio
 from rasterio.merge import merge
+from rasterio.transform import Affine
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
 import re
 from collections import defaultdict
 
+from clms_pipeline.executor import ParallelExecutor
+from clms_pipeline.incremental import is_up_to_date
+from clms_pipeline.product_store import SharedOutputs, is_store_enabled
+from clms_pipeline.reference_grid import get_reference_grid
+from clms_pipeline.scene_inventory import get_inventory
+from clms_pipeline.scenes import LAYERS
+from clms_pipeline.steps.cloud_filter import link_or_copy
+from clms_pipeline.writer import RasterWriter
+
+logger = logging.getLogger(__name__)
+
 class MosaicBuilder:
-    LAYERS = ["CLD", "FSCOG", "FSCTOC", "NDSI", "QCFLAGS", "QCOG", "QCTOC","PSA","QC","SSC","QCSSC","WSM","QCWSM","AT","GF"]
+    LAYERS = LAYERS
 
     def __init__(self, config):
         self.config = config
+        self.executor = ParallelExecutor.from_config(config)
+        self.writer = RasterWriter.from_config(config)
 
     def get_date_from_filename(self, filename):
         match = re.search(r'_(\d{8})(?:T|-)', filename)
@@ -31,11 +48,108 @@ class MosaicBuilder:
             "width": mosaic.shape[2],
             "transform": out_trans
         })
-        with rasterio.open(output_path, "w", **out_meta) as dest:
-            dest.write(mosaic)
+        self.writer.write(output_path, mosaic, out_meta)
         for src in src_files_to_mosaic:
             src.close()
 
+    def get_clip_bounds(self, raster_entries):
+        # Bounds (and CRS) of the reference rasters a mosaic has to cover
+        clip_bounds = []
+        for raster_entry in raster_entries:
+            grid = get_reference_grid(self.config, raster_entry)
+            clip_bounds.append((grid.bounds, grid.crs))
+        return clip_bounds
+
+    def get_output_grid(self, srcs, clip_bounds, margin):
+        # Union of the sources, optionally clipped to the reference rasters (plus margin) and
+        # snapped to the pixel grid of the first source
+        first = srcs[0]
+        res_x, res_y = first.res
+        left = min(s.bounds.left for s in srcs)
+        bottom = min(s.bounds.bottom for s in srcs)
+        right = max(s.bounds.right for s in srcs)
+        top = max(s.bounds.top for s in srcs)
+        if clip_bounds:
+            aoi = [transform_bounds(crs, first.crs, *bounds, densify_pts=21) for bounds, crs in clip_bounds]
+            left = max(left, min(b[0] for b in aoi) - margin)
+            bottom = max(bottom, min(b[1] for b in aoi) - margin)
+            right = min(right, max(b[2] for b in aoi) + margin)
+            top = min(top, max(b[3] for b in aoi) + margin)
+            if left >= right or bottom >= top:
+                return None
+        origin_x, origin_y = first.bounds.left, first.bounds.top
+        left = origin_x + math.floor((left - origin_x) / res_x) * res_x
+        top = origin_y - math.floor((origin_y - top) / res_y) * res_y
+        width = int(math.ceil((right - left) / res_x))
+        height = int(math.ceil((top - bottom) / res_y))
+        return Affine(res_x, 0, left, 0, -res_y, top), width, height
+
+    def mosaic_images_windowed(self, image_list, output_path, clip_bounds=None):
+        # Writes the mosaic block by block, so peak memory is bounded by the block size
+        # instead of the size of the merged tiles
+        block_size = getattr(self.config, "mosaic_block_size", 1024)
+        margin = getattr(self.config, "mosaic_clip_margin", 1000)
+        srcs = [rasterio.open(fp) for fp in image_list]
+        try:
+            grid = self.get_output_grid(srcs, clip_bounds, margin)
+            if grid is None:
+                return False
+            transform, width, height = grid
+            out_meta = srcs[0].meta.copy()
+            out_meta.update({
+                "driver": "GTiff",
+                "height": height,
+                "width": width,
+                "transform": transform
+            })
+            with self.writer.open(output_path, out_meta) as dest:
+                for row_off in range(0, height, block_size):
+                    for col_off in range(0, width, block_size):
+                        window = Window(col_off, row_off, min(block_size, width - col_off), min(block_size, height - row_off))
+                        block, _ = merge(srcs, bounds=dest.window_bounds(window), res=srcs[0].res)
+                        dest.write(block[:, :window.height, :window.width], window=window)
+        finally:
+            for src in srcs:
+                src.close()
+        return True
+
+    def build_vrt(self, image_list, output_path, clip_bounds=None):
+        # A VRT only references the tiles, so later steps decode just the pixels they read
+        from osgeo import gdal
+        margin = getattr(self.config, "mosaic_clip_margin", 1000)
+        srcs = [rasterio.open(fp) for fp in image_list]
+        try:
+            grid = self.get_output_grid(srcs, clip_bounds, margin)
+            res_x, res_y = srcs[0].res
+        finally:
+            for src in srcs:
+                src.close()
+        if grid is None:
+            return False
+        transform, width, height = grid
+        output_bounds = (transform.c, transform.f - height * res_y, transform.c + width * res_x, transform.f)
+        # merge() keeps the first valid pixel while a VRT paints its sources in order, so the
+        # sources are listed in reverse to give the same pixel values
+        options = gdal.BuildVRTOptions(outputBounds=output_bounds, xRes=res_x, yRes=res_y)
+        vrt = gdal.BuildVRT(output_path, [os.path.abspath(f) if not f.startswith("/vsi") else f for f in reversed(image_list)], options=options)
+        if vrt is None:
+            raise RuntimeError(f"GDAL could not build VRT {output_path}")
+        vrt.FlushCache()
+        vrt = None
+        return True
+
+    def mosaic_task(self, task):
+        files, output_path, clip_bounds = task
+        if output_path.endswith(".vrt"):
+            if not self.build_vrt(files, output_path, clip_bounds):
+                return f"      Tiles do not overlap the reference rasters, no mosaic written: {output_path}"
+        elif clip_bounds is not None or getattr(self.config, "mosaic_windowed", False):
+            if not self.mosaic_images_windowed(files, output_path, clip_bounds):
+                return f"      Tiles do not overlap the reference rasters, no mosaic written: {output_path}"
+        else:
+            self.mosaic_images(files, output_path)
+        return f"      Mosaic written: {output_path}"
+
     def build_mosaic(self):
         if not getattr(self.config, "mosaic_output", False):
             print("Mosaicking is disabled in the configuration. Skipping mosaic step.")
@@ -44,42 +158,69 @@ class MosaicBuilder:
         project_root = os.getcwd()  # Use main project directory
         input_base = os.path.join(project_root, self.config.output_path_original)
 
+        clip_to_aoi = getattr(self.config, "mosaic_clip_to_aoi", False)
+        extension = "vrt" if getattr(self.config, "mosaic_format", "tif") == "vrt" else "tif"
+        shared = SharedOutputs(self.config, "mosaic") if is_store_enabled(self.config) else None
+        tasks = []
         for raster_entry in self.config.reference_rasters:
             raster_folder = os.path.splitext(raster_entry["name"])[0]
+            clip_bounds = self.get_clip_bounds([raster_entry]) if clip_to_aoi else None
             print(f"\n=== Processing reference raster: {raster_entry['name']} (folder: {raster_folder}) ===")
             for product_type in self.config.clms_product:
                 print(f"  Processing product: {product_type}")
                 product_dir = os.path.join(input_base, raster_folder, product_type)
-                mosaic_dir = os.path.join(product_dir, "mosaic")
-                os.makedirs(mosaic_dir, exist_ok=True)
+                tasks += self.get_product_tasks(product_dir, product_type, clip_bounds, extension, shared)
+        self.run_tasks(tasks, shared)
+        print("\nMosaicking process finished.")
+
+    def run_tasks(self, tasks, shared=None):
+        # Dates and layers are independent, so they are mosaicked in parallel
+        self.executor.map(self.mosaic_task, tasks, label="mosaics")
+        if shared is not None:
+            for shared_path, output_path in shared.links:
+                if os.path.exists(shared_path):
+                    link_or_copy(shared_path, output_path)
+
+    def get_product_tasks(self, product_dir, product_type, clip_bounds, extension, shared=None, dates=None):
+        # Mosaic tasks of one product folder; dates (YYYYMMDD) limits them to those dates
+        mosaic_dir = os.path.join(product_dir, "mosaic")
+        os.makedirs(mosaic_dir, exist_ok=True)
 
-                if not os.path.isdir(product_dir):
-                    print(f"    Product directory not found: {product_dir}")
-                    continue
+        if not os.path.isdir(product_dir):
+            print(f"    Product directory not found: {product_dir}")
+            return []
 
-                subfolders = [f for f in os.listdir(product_dir) if os.path.isdir(os.path.join(product_dir, f)) and f != "mosaic"]
-                date_layer_dict = defaultdict(lambda: defaultdict(list))
+        date_layer_dict = defaultdict(lambda: defaultdict(list))
 
-                for subfolder in subfolders:
-                    date = self.get_date_from_filename(subfolder)
-                    if not date:
-                        print(f"    Skipping folder (no date found): {subfolder}")
+        for scene_file in get_inventory(self.config).list_files(product_dir, product_type, mosaic=False):
+            if not scene_file.date:
+                logger.debug(f"    Skipping folder (no date found): {scene_file.scene}")
+                continue
+            if dates is not None and scene_file.date not in dates:
+                continue
+            if scene_file.layer in self.LAYERS and not scene_file.reclassified:
+                date_layer_dict[scene_file.date][scene_file.layer].append(scene_file.path)
+            else:
+                logger.debug(f"      Skipping file (unknown layer): {scene_file.path}")
+
+        tasks = []
+        for date, layer_dict in sorted(date_layer_dict.items()):
+            for layer, files in sorted(layer_dict.items()):
+                files = sorted(files)
+                if len(files) > 1:
+                    output_path = os.path.join(mosaic_dir, f"mosaic_{product_type}_{layer}_{date}.{extension}")
+                    if is_up_to_date(self.config, output_path, files):
+                        logger.debug(f"    Mosaic up to date, skipping: {output_path}")
                         continue
-                    tif_files = glob.glob(os.path.join(product_dir, subfolder, "*.tif"))
-                    for tif in tif_files:
-                        layer = self.get_layer_from_filename(os.path.basename(tif))
-                        if layer:
-                            date_layer_dict[date][layer].append(tif)
-                        else:
-                            print(f"      Skipping file (unknown layer): {tif}")
-
-                for date, layer_dict in date_layer_dict.items():
-                    for layer, files in layer_dict.items():
-                        if len(files) > 1:
-                            output_path = os.path.join(mosaic_dir, f"mosaic_{product_type}_{layer}_{date}.tif")
-                            print(f"    Mosaicing {len(files)} images for date {date}, layer {layer} into {output_path}")
-                            self.mosaic_images(files, output_path)
-                            print(f"      Mosaic written: {output_path}")
-                        elif len(files) == 1:
-                            print(f"    Only one image for date {date}, layer {layer}, skipping mosaicing.")
-        print("\nMosaicking process finished.")
+                    logger.debug(f"    Mosaicing {len(files)} images for date {date}, layer {layer} into {output_path}")
+                    if shared is not None and clip_bounds is None:
+                        # Same scenes, same mosaic: built once for all reference rasters
+                        shared_path, first = shared.get_path(files, output_path)
+                        if first and not is_up_to_date(self.config, shared_path, files):
+                            sources = [f if f.startswith("/vsi") else os.path.realpath(f) for f in files]
+                            tasks.append((sources, shared_path, None))
+                        continue
+                    tasks.append((files, output_path, clip_bounds))
+                elif len(files) == 1:
+                    logger.debug(f"    Only one image for date {date}, layer {layer}, skipping mosaicing.")
+        return tasks
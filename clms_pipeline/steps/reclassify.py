@@ -1,8 +1,20 @@
 import os
-import glob
-import numpy as np
+import logging
+import shutil
 import rasterio
 
+from clms_pipeline.executor import ParallelExecutor
+from clms_pipeline.incremental import is_up_to_date
+from clms_pipeline.product_store import SharedOutputs, is_store_enabled
+from clms_pipeline.reclass_lut import ReclassTable, get_encoding_tags
+from clms_pipeline.reference_grid import get_reference_grid
+from clms_pipeline.scene_inventory import get_inventory
+from clms_pipeline.steps.cloud_filter import PRODUCT_MASK_LAYERS, get_rejected_scenes, link_or_copy
+from clms_pipeline.windows import flag_empty_scenes, get_aoi_window, get_source_nodata, is_empty, is_windowed
+from clms_pipeline.writer import RasterWriter
+
+logger = logging.getLogger(__name__)
+
 PRODUCT_LAYERS_TO_RECLASSIFY = {
     "FSC": ["FSCTOC", "FSCOG", "NDSI"],
     "PSA": ["PSA"],
@@ -16,85 +28,101 @@ RECLASS_SUFFIX = "_reclass"
 class Reclassifier:
     def __init__(self, config):
         self.config = config
+        self.executor = ParallelExecutor.from_config(config)
+        self.writer = RasterWriter.from_config(config)
+        self.table = ReclassTable.from_config(config)
+        # Set while reclassify() runs with the product store enabled
+        self.shared = None
+
+    def reclassify_array(self, arr, product_type=None, layer=None):
+        # One gather through the layer's 256-entry lookup table
+        return self.table.apply(arr, product_type, layer)
 
-    def reclassify_array(self, arr):
-        arr = arr.astype(np.float32)
-        arr[arr == 205] = NODATA_VALUE
-        arr[arr == 255] = NODATA_VALUE
-        return arr
+    def reclassify_file(self, task):
+        tif_path, out_path, do_reclassify, aoi, product_type, layer, skip_empty = task
+        is_vrt = tif_path.lower().endswith(".vrt")
+        if is_vrt and not do_reclassify:
+            # Virtual mosaics only reference their tiles, so they are copied as they are
+            shutil.copy2(tif_path, out_path)
+            return f"Copied virtual mosaic (no reclass): {tif_path} -> {out_path}"
+        with rasterio.open(tif_path) as src:
+            meta = src.meta.copy()
+            window = None
+            if aoi is not None and (is_vrt or is_windowed(self.config)):
+                # Only decode the part of the layer that covers the reference raster
+                window = get_aoi_window(src, aoi[0], aoi[1], margin=getattr(self.config, "aoi_window_margin", 16))
+                if window is None:
+                    return f"Skipped {tif_path} (does not overlap the reference raster)"
+                meta.update(driver="GTiff", width=window.width, height=window.height,
+                            transform=src.window_transform(window))
+            data = src.read(1 if do_reclassify else None, window=window)
+            if skip_empty and is_empty(data, get_source_nodata(src)):
+                return f"Skipped {tif_path} (no valid pixels over the reference raster)"
+        if do_reclassify:
+            arr_reclass = self.reclassify_array(data, product_type, layer)
+            encoding = self.table.encoding
+            meta.update(dtype=encoding["dtype"], nodata=encoding["nodata"])
+            self.writer.write(out_path, arr_reclass, meta, tags=get_encoding_tags(encoding))
+            return f"Reclassified {tif_path} -> {out_path}"
+        self.writer.write(out_path, data, meta)
+        return f"Copied (no reclass): {tif_path} -> {out_path}"
+
+    def get_task(self, product_type, tif_path, layer, out_dir, aoi=None):
+        base_name = os.path.basename(tif_path)
+        do_reclassify = layer in PRODUCT_LAYERS_TO_RECLASSIFY.get(product_type, [])
+        if do_reclassify:
+            if base_name.lower().endswith(('.tif', '.vrt')):
+                out_name = base_name[:-4] + f'{RECLASS_SUFFIX}.tif'
+            else:
+                out_name = base_name + f'{RECLASS_SUFFIX}'
+        else:
+            out_name = base_name
+        out_path = os.path.join(out_dir, out_name)
+        if is_up_to_date(self.config, out_path, [tif_path]):
+            return None
+        aoi_specific = aoi is not None and ((do_reclassify and tif_path.lower().endswith(".vrt")) or is_windowed(self.config))
+        if self.shared is not None and not aoi_specific:
+            # Reclassified once in the store, linked into each reference raster's folder
+            shared_path, first = self.shared.get_path([tif_path], out_path)
+            if not first or is_up_to_date(self.config, shared_path, [tif_path]):
+                return None
+            out_path = shared_path
+        return (tif_path, out_path, do_reclassify, aoi, product_type, layer)
 
-    def process_folder(self, product_type, in_dir, out_dir):
-        for subfolder in os.listdir(in_dir):
-            subfolder_path = os.path.join(in_dir, subfolder)
-            if not os.path.isdir(subfolder_path) or subfolder == "mosaic":
+    def run_tasks(self, product_type, tasks, files, key, aoi):
+        # tasks are (scene key, task) pairs
+        tasks = flag_empty_scenes(self.config, self.executor, tasks, files, PRODUCT_MASK_LAYERS.get(product_type), key, aoi)
+        self.executor.map(self.reclassify_file, tasks, label="reclassification tasks")
+
+    def process_folder(self, product_type, in_dir, out_dir, skip=None, aoi=None):
+        tasks = []
+        files = get_inventory(self.config).list_files(in_dir, product_type, "original", mosaic=False)
+        for scene_file in files:
+            if skip and scene_file.scene in skip:
                 continue
-            out_subfolder = os.path.join(out_dir, "reclassified", subfolder)
+            out_subfolder = os.path.join(out_dir, "reclassified", scene_file.scene)
             os.makedirs(out_subfolder, exist_ok=True)
-            tif_files = glob.glob(os.path.join(subfolder_path, "*.tif"))
-            for tif_path in tif_files:
-                layer = os.path.basename(tif_path).split("_")[-1].replace(".tif", "").upper()
-                base_name = os.path.basename(tif_path)
-                if layer in PRODUCT_LAYERS_TO_RECLASSIFY.get(product_type, []):
-                    if base_name.lower().endswith('.tif'):
-                        out_name = base_name[:-4] + f'{RECLASS_SUFFIX}.tif'
-                    else:
-                        out_name = base_name + f'{RECLASS_SUFFIX}'
-                else:
-                    out_name = base_name
-                out_path = os.path.join(out_subfolder, out_name)
-                if layer in PRODUCT_LAYERS_TO_RECLASSIFY.get(product_type, []):
-                    with rasterio.open(tif_path) as src:
-                        arr = src.read(1)
-                        arr_reclass = self.reclassify_array(arr)
-                        meta = src.meta.copy()
-                        meta.update(dtype='float32', nodata=NODATA_VALUE)
-                        with rasterio.open(out_path, "w", **meta) as dst:
-                            dst.write(arr_reclass, 1)
-                    print(f"Reclassified {tif_path} -> {out_path}")
-                else:
-                    with rasterio.open(tif_path) as src:
-                        meta = src.meta.copy()
-                        data = src.read()
-                        with rasterio.open(out_path, "w", **meta) as dst:
-                            dst.write(data)
-                    print(f"Copied (no reclass): {tif_path} -> {out_path}")
+            task = self.get_task(product_type, scene_file.path, scene_file.layer, out_subfolder, aoi=aoi)
+            if task:
+                tasks.append((scene_file.scene, task))
+        self.run_tasks(product_type, tasks, files, lambda f: f.scene, aoi)
 
-    def process_mosaic(self, product_type, in_dir, out_dir):
-        mosaic_in_dir = os.path.join(in_dir, "mosaic")
+    def process_mosaic(self, product_type, in_dir, out_dir, skip=None, aoi=None):
         mosaic_out_dir = os.path.join(out_dir, "reclassified", "mosaic")
         os.makedirs(mosaic_out_dir, exist_ok=True)
-        tif_files = glob.glob(os.path.join(mosaic_in_dir, "*.tif"))
-        for tif_path in tif_files:
-            parts = os.path.basename(tif_path).split("_")
-            if len(parts) < 4:
-                print(f"Warning: Unexpected mosaic filename format: {tif_path}")
+        tasks = []
+        files = get_inventory(self.config).list_files(in_dir, product_type, "original", mosaic=True)
+        for scene_file in files:
+            if skip and scene_file.date in skip:
                 continue
-            layer = parts[2].upper()
-            base_name = os.path.basename(tif_path)
-            if layer in PRODUCT_LAYERS_TO_RECLASSIFY.get(product_type, []):
-                if base_name.lower().endswith('.tif'):
-                    out_name = base_name[:-4] + f'{RECLASS_SUFFIX}.tif'
-                else:
-                    out_name = base_name + f'{RECLASS_SUFFIX}'
-            else:
-                out_name = base_name
-            out_path = os.path.join(mosaic_out_dir, out_name)
-            if layer in PRODUCT_LAYERS_TO_RECLASSIFY.get(product_type, []):
-                with rasterio.open(tif_path) as src:
-                    arr = src.read(1)
-                    arr_reclass = self.reclassify_array(arr)
-                    meta = src.meta.copy()
-                    meta.update(dtype='float32', nodata=NODATA_VALUE)
-                    with rasterio.open(out_path, "w", **meta) as dst:
-                        dst.write(arr_reclass, 1)
-                print(f"Reclassified mosaic {tif_path} -> {out_path}")
-            else:
-                with rasterio.open(tif_path) as src:
-                    meta = src.meta.copy()
-                    data = src.read()
-                    with rasterio.open(out_path, "w", **meta) as dst:
-                        dst.write(data)
-                print(f"Copied mosaic (no reclass): {tif_path} -> {out_path}")
+            task = self.get_task(product_type, scene_file.path, scene_file.layer, mosaic_out_dir, aoi=aoi)
+            if task:
+                tasks.append((scene_file.date, task))
+        self.run_tasks(product_type, tasks, files, lambda f: f.date, aoi)
+
+    def get_aoi(self, raster_entry):
+        grid = get_reference_grid(self.config, raster_entry)
+        return grid.bounds, grid.crs
 
     def reclassify(self):
         if not getattr(self.config, "reclassify", False):
@@ -102,13 +130,21 @@ class Reclassifier:
             return
         print("Starting reclassification process...")
         project_root = os.getcwd()  # Use main project directory
+        self.shared = SharedOutputs(self.config, "reclassify") if is_store_enabled(self.config) else None
         for raster_entry in self.config.reference_rasters:
             raster_folder = os.path.splitext(raster_entry["name"])[0]
+            aoi = self.get_aoi(raster_entry)
             for product_type in self.config.clms_product:
                 out_dir = os.path.join(project_root, self.config.output_path_processed, raster_folder, product_type)
                 # Ensure subfolders exist
                 os.makedirs(os.path.join(out_dir, "reclassified"), exist_ok=True)
                 in_dir = os.path.join(project_root, self.config.output_path_original, raster_folder, product_type)
-                self.process_folder(product_type, in_dir, out_dir)
-                self.process_mosaic(product_type, in_dir, out_dir)
+                skip = get_rejected_scenes(self.config, out_dir)
+                self.process_folder(product_type, in_dir, out_dir, skip=skip, aoi=aoi)
+                self.process_mosaic(product_type, in_dir, out_dir, skip=skip, aoi=aoi)
+        if self.shared is not None:
+            for shared_path, out_path in self.shared.links:
+                if os.path.exists(shared_path):
+                    link_or_copy(shared_path, out_path)
+            self.shared = None
         print("Reclassification process finished.")
@@ -1,50 +1,183 @@
 import os
-import glob
+import logging
 import rasterio
 from rasterio.warp import calculate_default_transform, reproject, Resampling
+from rasterio.windows import union
 import numpy as np
+from collections import OrderedDict
+
+from clms_pipeline.executor import ParallelExecutor
+from clms_pipeline.incremental import is_up_to_date
+from clms_pipeline.product_store import get_source_key
+from clms_pipeline.reclass_lut import get_encoding_tags, has_cloud_code, read_encoding
+from clms_pipeline.scene_inventory import get_inventory
+from clms_pipeline.reference_grid import ReferenceGrid, get_reference_grid
+from clms_pipeline.steps.cloud_filter import PRODUCT_MASK_LAYERS, get_rejected_scenes
+from clms_pipeline.warp_cache import WarpPlanCache
+from clms_pipeline.windows import flag_empty_scenes, get_aoi_window, get_source_nodata, is_empty, is_windowed
+from clms_pipeline.writer import RasterWriter
+
+logger = logging.getLogger(__name__)
 
 NODATA_VALUE = -9999
+# Shared reads of several reference grids fall back to one read per grid when the window
+# covering all of them is this many times larger than their windows together
+MAX_UNION_READ_RATIO = 2
 
 class Resampler:
     def __init__(self, config):
         self.config = config
+        self.executor = ParallelExecutor.from_config(config)
+        self.warp_cache = WarpPlanCache.from_config(config)
+        self.writer = RasterWriter.from_config(config)
+        # Collects tasks while resample() runs with resample_multi_target
+        self.pending = None
+
+    def get_output_meta(self, src, grid, crs_str, resampling_method):
+        ref_nodata = grid.nodata
+        ref_dtype = grid.dtype
+        tags = None
+        encoding = read_encoding(src)
+        if encoding is not None:
+            # Reclassified layers keep their compact dtype and codes instead of the reference's
+            ref_nodata, ref_dtype = encoding["nodata"], encoding["dtype"]
+            tags = get_encoding_tags(encoding)
+            if has_cloud_code(encoding):
+                # A cloud code must not be blended with snow values
+                resampling_method = Resampling.nearest
+        kwargs = src.meta.copy()
+        kwargs.update({
+            'crs': crs_str if crs_str else grid.crs,
+            'transform': grid.transform,
+            'width': grid.width,
+            'height': grid.height,
+            'nodata': ref_nodata,
+            'dtype': ref_dtype
+        })
+        return kwargs, tags, resampling_method
+
+    def get_warp_plan(self, src, grid, resampling_method):
+        if self.warp_cache is None or src.crs is None:
+            return None
+        # All dates of a tile share the same source grid, so the pixel mapping is computed once
+        return self.warp_cache.get_plan(src.crs, src.transform, src.width, src.height,
+                                        grid.crs, grid.transform, grid.width, grid.height, resampling_method)
+
+    def warp_array(self, src, data, window, grid, kwargs, resampling_method, plan=None):
+        # data holds the bands of src read over window; returns them on the reference grid
+        out = np.full((src.count, grid.height, grid.width), kwargs["nodata"], dtype=kwargs["dtype"])
+        for i in range(src.count):
+            if plan is not None:
+                out[i] = plan.apply(data[i], src.nodata, kwargs["nodata"], kwargs["dtype"])
+                continue
+            reproject(
+                source=data[i],
+                destination=out[i],
+                src_transform=src.window_transform(window),
+                src_crs=src.crs,
+                src_nodata=src.nodata,
+                dst_transform=grid.transform,
+                dst_crs=grid.crs,
+                dst_nodata=kwargs["nodata"],
+                resampling=resampling_method
+            )
+        return out
+
+    def get_source_window(self, src, grid, plan):
+        if plan is not None:
+            return plan.window if plan.window.width else None
+        return get_aoi_window(src, grid.bounds, grid.crs, margin=getattr(self.config, "aoi_window_margin", 16))
 
-    def resample_raster(self, input_path, reference_path, output_path, resampling_method=Resampling.nearest, crs_str=None):
-        with rasterio.open(reference_path) as ref:
-            ref_crs = ref.crs
-            ref_transform = ref.transform
-            ref_width = ref.width
-            ref_height = ref.height
-            ref_nodata = ref.nodata if ref.nodata is not None else NODATA_VALUE
-            ref_dtype = ref.dtypes[0]
+    def resample_raster(self, input_path, reference, output_path, resampling_method=Resampling.nearest, crs_str=None,
+                        skip_empty=True):
+        # reference is a ReferenceGrid, or the path of a reference raster. With windowed reads and
+        # skip_empty, returns False if the source has no valid pixels over the reference grid and
+        # nothing was written.
+        grid = reference if isinstance(reference, ReferenceGrid) else ReferenceGrid.from_raster(reference, crs_str)
         with rasterio.open(input_path) as src:
-            base = os.path.basename(input_path).replace(".tif", "")
-            parts = base.split("_")
-            if hasattr(self.config, "reclassify") and self.config.reclassify and base.endswith("_reclass") and len(parts) > 1:
-                layer_name = parts[-2].upper()
-            else:
-                layer_name = parts[-1].upper()
-            kwargs = src.meta.copy()
-            kwargs.update({
-                'crs': crs_str if crs_str else ref_crs,
-                'transform': ref_transform,
-                'width': ref_width,
-                'height': ref_height,
-                'nodata': ref_nodata,
-                'dtype': ref_dtype
-            })
-            with rasterio.open(output_path, 'w', **kwargs) as dst:
+            kwargs, tags, resampling_method = self.get_output_meta(src, grid, crs_str, resampling_method)
+            plan = self.get_warp_plan(src, grid, resampling_method)
+            if is_windowed(self.config):
+                window = self.get_source_window(src, grid, plan)
+                data = src.read(window=window) if window is not None else None
+                if skip_empty and is_empty(data, get_source_nodata(src)):
+                    return False
+                if window is None:
+                    out = np.full((src.count, grid.height, grid.width), kwargs["nodata"], dtype=kwargs["dtype"])
+                else:
+                    out = self.warp_array(src, data, window, grid, kwargs, resampling_method, plan)
+                self.writer.write(output_path, out, kwargs, tags)
+                return True
+            with self.writer.open(output_path, kwargs, tags) as dst:
                 for i in range(1, src.count + 1):
+                    if plan is not None:
+                        arr = src.read(i, window=plan.window) if plan.window.width else None
+                        dst.write(plan.apply(arr, src.nodata, kwargs["nodata"], kwargs["dtype"]), i)
+                        continue
                     reproject(
                         source=rasterio.band(src, i),
                         destination=rasterio.band(dst, i),
                         src_transform=src.transform,
                         src_crs=src.crs,
-                        dst_transform=ref_transform,
-                        dst_crs=ref_crs,
+                        dst_transform=grid.transform,
+                        dst_crs=grid.crs,
                         resampling=resampling_method
                     )
+        return True
+
+    def resample_group(self, task):
+        # One source file into several reference grids: the part of the source covering all of
+        # them is read and decoded once, then reprojected into each grid from memory. Grids far
+        # apart on the tile are read one by one instead, as most of that part would be unused.
+        tif_path, targets = task
+        written = 0
+        with rasterio.open(tif_path) as src:
+            nodata = get_source_nodata(src)
+            jobs = []
+            for reference, out_path, resampling_method, crs_str, skip_empty in targets:
+                grid = reference if isinstance(reference, ReferenceGrid) else ReferenceGrid.from_raster(reference, crs_str)
+                kwargs, tags, method = self.get_output_meta(src, grid, crs_str, resampling_method)
+                plan = self.get_warp_plan(src, grid, method)
+                jobs.append((grid, out_path, kwargs, tags, method, plan, skip_empty, self.get_source_window(src, grid, plan)))
+            windows = [job[-1] for job in jobs if job[-1] is not None]
+            read_window = union(*windows) if windows else None
+            if read_window is not None and read_window.width * read_window.height > \
+                    MAX_UNION_READ_RATIO * sum(w.width * w.height for w in windows):
+                read_window = None
+            data = src.read(window=read_window) if read_window is not None else None
+            for grid, out_path, kwargs, tags, method, plan, skip_empty, window in jobs:
+                if window is None:
+                    if not skip_empty:
+                        self.writer.write(out_path, np.full((src.count, grid.height, grid.width), kwargs["nodata"],
+                                                            dtype=kwargs["dtype"]), kwargs, tags)
+                        written += 1
+                    continue
+                if read_window is None:
+                    sub = src.read(window=window)
+                else:
+                    row = int(window.row_off - read_window.row_off)
+                    col = int(window.col_off - read_window.col_off)
+                    sub = data[:, row:row + int(window.height), col:col + int(window.width)]
+                if skip_empty and is_empty(sub, nodata):
+                    continue
+                self.writer.write(out_path, self.warp_array(src, sub, window, grid, kwargs, method, plan), kwargs, tags)
+                written += 1
+        return f"Resampled {tif_path} into {written} of {len(targets)} reference grids"
+
+    def run_grouped(self, tasks):
+        # Tasks of all reference rasters, grouped by source file (links to the same file included)
+        groups = OrderedDict()
+        for tif_path, reference, out_path, resampling_method, crs_str, skip_empty in tasks:
+            key = get_source_key(tif_path)
+            if key not in groups:
+                groups[key] = (tif_path, [])
+            groups[key][1].append((reference, out_path, resampling_method, crs_str, skip_empty))
+        single = [(path, *targets[0]) for path, targets in groups.values() if len(targets) == 1]
+        shared = [group for group in groups.values() if len(group[1]) > 1]
+        print(f"Resampling {len(tasks)} outputs from {len(groups)} source files "
+              f"({len(shared)} shared by several reference rasters)")
+        self.executor.map(self.resample_task, single, label="resampling tasks")
+        self.executor.map(self.resample_group, shared, label="multi-target resampling tasks")
 
     def get_resampling_method(self, layer):
         categorical = {"CLD", "QCFLAGS", "QCOG", "QCTOC","QC","SSC","QCSSC","WSM","QCWSM","QC","QCFLAGS"}
@@ -56,52 +189,62 @@ class Resampler:
     def add_resampled_suffix(self, filename):
         if filename.lower().endswith('_reclass.tif'):
             return filename[:-4] + '_resampled.tif'
-        elif filename.lower().endswith('.tif'):
+        elif filename.lower().endswith(('.tif', '.vrt')):
             return filename[:-4] + '_resampled.tif'
         return filename + '_resampled'
 
-    def process_folder(self, product_type, in_dir, out_dir, reference_raster, crs_str=None):
-        print(in_dir)
-        for subfolder in os.listdir(in_dir):
-            subfolder_path = os.path.join(in_dir, subfolder)
-            print(subfolder_path)
-            if not os.path.isdir(subfolder_path) or subfolder == "mosaic":
+    def resample_task(self, task):
+        tif_path, reference, out_path, resampling_method, crs_str, skip_empty = task
+        if not self.resample_raster(tif_path, reference, out_path, resampling_method, crs_str=crs_str, skip_empty=skip_empty):
+            return f"Skipped {tif_path} (no valid pixels over the reference raster)"
+        return f"Resampled {tif_path} -> {out_path} (method: {resampling_method.name})"
+
+    def run_tasks(self, product_type, tasks, files, key, grid):
+        # tasks are (scene key, task) pairs
+        aoi = (grid.bounds, grid.crs) if grid is not None else None
+        tasks = flag_empty_scenes(self.config, self.executor, tasks, files, PRODUCT_MASK_LAYERS.get(product_type), key, aoi)
+        if self.pending is not None:
+            # Multi-target mode: run once the tasks of all reference rasters are collected
+            self.pending.extend(tasks)
+            return
+        self.executor.map(self.resample_task, tasks, label="resampling tasks")
+
+    def process_folder(self, product_type, in_dir, out_dir, reference_raster, crs_str=None, skip=None, grid=None,
+                       stage="original"):
+        logger.debug(in_dir)
+        tasks = []
+        files = get_inventory(self.config).list_files(in_dir, product_type, stage, mosaic=False)
+        for scene_file in files:
+            if skip and scene_file.scene in skip:
+                logger.debug(f"Skipping {scene_file.scene} (above cloud threshold)")
                 continue
-            out_subfolder = os.path.join(out_dir, subfolder)
+            out_subfolder = os.path.join(out_dir, scene_file.scene)
             os.makedirs(out_subfolder, exist_ok=True)
-            tif_files = glob.glob(os.path.join(subfolder_path, "*.tif"))
-            for tif_path in tif_files:
-                base = os.path.basename(tif_path).replace(".tif", "")
-                parts = base.split("_")
-                if hasattr(self.config, "reclassify") and self.config.reclassify and base.endswith("_reclass") and len(parts) > 1:
-                    layer = parts[-2].upper()
-                else:
-                    layer = parts[-1].upper()
-                base_name = os.path.basename(tif_path)
-                out_name = self.add_resampled_suffix(base_name)
-                out_path = os.path.join(out_subfolder, out_name)
-                resampling_method = self.get_resampling_method(layer)
-                print(f"Resampling {tif_path} -> {out_path} (method: {resampling_method.name})")
-                self.resample_raster(tif_path, reference_raster, out_path, resampling_method, crs_str=crs_str)
-
-    def process_mosaic(self, product_type, in_dir, out_dir, reference_raster, crs_str=None):
-        mosaic_in_dir = os.path.join(in_dir, "mosaic")
+            tif_path = scene_file.path
+            out_path = os.path.join(out_subfolder, self.add_resampled_suffix(os.path.basename(tif_path)))
+            if is_up_to_date(self.config, out_path, [tif_path, reference_raster]):
+                continue
+            resampling_method = self.get_resampling_method(scene_file.layer)
+            tasks.append((scene_file.scene, (tif_path, grid or reference_raster, out_path, resampling_method, crs_str)))
+        self.run_tasks(product_type, tasks, files, lambda f: f.scene, grid)
+
+    def process_mosaic(self, product_type, in_dir, out_dir, reference_raster, crs_str=None, skip=None, grid=None,
+                       stage="original"):
         mosaic_out_dir = os.path.join(out_dir, "mosaic")
         os.makedirs(mosaic_out_dir, exist_ok=True)
-        tif_files = glob.glob(os.path.join(mosaic_in_dir, "*.tif"))
-        for tif_path in tif_files:
-            base = os.path.basename(tif_path).replace(".tif", "")
-            parts = base.split("_")
-            if hasattr(self.config, "reclassify") and self.config.reclassify and base.endswith("_reclass") and len(parts) > 1:
-                layer = parts[-2].upper()
-            else:
-                layer = parts[-1].upper()
-            base_name = os.path.basename(tif_path)
-            out_name = self.add_resampled_suffix(base_name)
-            out_path = os.path.join(mosaic_out_dir, out_name)
-            resampling_method = self.get_resampling_method(layer)
-            print(f"Resampling mosaic {tif_path} -> {out_path} (method: {resampling_method.name})")
-            self.resample_raster(tif_path, reference_raster, out_path, resampling_method, crs_str=crs_str)
+        # Virtual mosaics are warped lazily, so only the pixels under the reference raster are decoded
+        tasks = []
+        files = get_inventory(self.config).list_files(in_dir, product_type, stage, mosaic=True)
+        for scene_file in files:
+            if skip and scene_file.date in skip:
+                continue
+            tif_path = scene_file.path
+            out_path = os.path.join(mosaic_out_dir, self.add_resampled_suffix(os.path.basename(tif_path)))
+            if is_up_to_date(self.config, out_path, [tif_path, reference_raster]):
+                continue
+            resampling_method = self.get_resampling_method(scene_file.layer)
+            tasks.append((scene_file.date, (tif_path, grid or reference_raster, out_path, resampling_method, crs_str)))
+        self.run_tasks(product_type, tasks, files, lambda f: f.date, grid)
 
     def resample(self):
         if not getattr(self.config, "crop_resample", False):
@@ -109,21 +252,32 @@ class Resampler:
             return
         print("Starting resampling process...")
         project_root = os.getcwd()
+        multi_target = getattr(self.config, "resample_multi_target", False)
+        self.pending = [] if multi_target else None
         for raster_entry in self.config.reference_rasters:
             raster_folder = os.path.splitext(raster_entry["name"])[0]
             reference_raster = os.path.join(self.config.reference_raster_dir, raster_entry["name"])
             crs_str = raster_entry["crs"]
+            grid = get_reference_grid(self.config, raster_entry)
             for product_type in self.config.clms_product:
                 # Output always goes to processed
-                out_base_dir = os.path.join(project_root, "data/clms_data/processed", raster_folder, product_type)
+                out_base_dir = os.path.join(project_root, self.config.output_path_processed, raster_folder, product_type)
                 out_dir = os.path.join(out_base_dir, "resampled")
                 os.makedirs(out_dir, exist_ok=True)
                 os.makedirs(os.path.join(out_dir, "mosaic"), exist_ok=True)
                 # Input depends on reclassify
                 if getattr(self.config, "reclassify", False):
-                    in_dir = os.path.join(project_root, "data/clms_data/processed", raster_folder, product_type, "reclassified")
+                    stage = "reclassified"
+                    in_dir = os.path.join(project_root, self.config.output_path_processed, raster_folder, product_type, "reclassified")
                 else:
-                    in_dir = os.path.join(project_root, "data/clms_data/original", raster_folder, product_type)
-                self.process_folder(product_type, in_dir, out_dir, reference_raster, crs_str=crs_str)
-                self.process_mosaic(product_type, in_dir, out_dir, reference_raster, crs_str=crs_str)
+                    stage = "original"
+                    in_dir = os.path.join(project_root, self.config.output_path_original, raster_folder, product_type)
+                skip = get_rejected_scenes(self.config, out_base_dir)
+                self.process_folder(product_type, in_dir, out_dir, reference_raster, crs_str=crs_str, skip=skip, grid=grid,
+                                    stage=stage)
+                self.process_mosaic(product_type, in_dir, out_dir, reference_raster, crs_str=crs_str, skip=skip, grid=grid,
+                                    stage=stage)
+        if multi_target:
+            tasks, self.pending = self.pending, None
+            self.run_grouped(tasks)
         print("Resampling process finished.")
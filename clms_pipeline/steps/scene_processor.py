@@ -0,0 +1,270 @@
+import os
+import re
+import logging
+from collections import defaultdict
+import numpy as np
+import rasterio
+from rasterio.warp import Resampling, reproject
+
+from clms_pipeline.executor import ParallelExecutor
+from clms_pipeline.incremental import is_reuse_enabled, is_up_to_date
+from clms_pipeline.product_store import get_scene_tile
+from clms_pipeline.reclass_lut import get_encoding_tags, has_cloud_code
+from clms_pipeline.scene_catalog import SceneCatalog, get_date_tiles, is_catalog_enabled
+from clms_pipeline.scene_inventory import get_inventory
+from clms_pipeline.reference_grid import get_reference_grid
+from clms_pipeline.windows import get_aoi_window, get_source_nodata, is_empty, is_windowed
+from clms_pipeline.steps.reclassify import PRODUCT_LAYERS_TO_RECLASSIFY, RECLASS_SUFFIX, Reclassifier
+from clms_pipeline.steps.resample import Resampler
+from clms_pipeline.steps.cloud_filter import PRODUCT_MASK_LAYERS, CloudFilter, get_rejected_scenes
+
+logger = logging.getLogger(__name__)
+
+MOSAIC_NAME_PATTERN = re.compile(r"^mosaic_[^_]+_([A-Z]+)_(\d{8})\.(?:tif|vrt)$", re.IGNORECASE)
+
+
+class FusedSceneProcessor:
+    # Reclassifies, reprojects and cloud-scores every layer of a scene in memory, so each
+    # source layer is read once and only the final output is written.
+    def __init__(self, config):
+        self.config = config
+        self.reclassifier = Reclassifier(config)
+        self.resampler = Resampler(config)
+        self.cloud_filter = CloudFilter(config)
+        self.executor = ParallelExecutor.from_config(config)
+
+    def get_output_name(self, base_name, reclassified):
+        if reclassified:
+            base_name = base_name[:-4] + f"{RECLASS_SUFFIX}.tif"
+        return self.resampler.add_resampled_suffix(base_name)
+
+    def warp_layer(self, tif_path, layer, unit, ref, skip_empty=False):
+        reclass_layers = PRODUCT_LAYERS_TO_RECLASSIFY.get(unit["product_type"], []) if unit["reclassify"] else []
+        reclassified = layer in reclass_layers
+        encoding = self.reclassifier.table.encoding
+        resampling = self.resampler.get_resampling_method(layer)
+        out_nodata, out_dtype = ref.nodata, ref.dtype
+        with rasterio.open(tif_path) as src:
+            meta = src.meta.copy()
+            src_nodata = src.nodata
+            src_transform = src.transform
+            window = None
+            if tif_path.lower().endswith(".vrt") or is_windowed(self.config):
+                # Only decode the part of the layer that covers the reference grid
+                window = get_aoi_window(src, ref.bounds, ref.crs, margin=getattr(self.config, "aoi_window_margin", 16))
+                if window is None:
+                    return None
+                src_transform = src.window_transform(window)
+                meta.update(driver="GTiff", width=window.width, height=window.height, transform=src_transform)
+            raw = src.read(1 if reclassified else None, window=window)
+            if skip_empty and is_empty(raw, get_source_nodata(src)):
+                return None
+            if reclassified:
+                data = self.reclassifier.reclassify_array(raw, unit["product_type"], layer)[np.newaxis]
+                src_nodata = encoding["nodata"]
+                # Same rules as Resampler for tagged reclassified inputs
+                out_nodata, out_dtype = encoding["nodata"], encoding["dtype"]
+                if has_cloud_code(encoding):
+                    resampling = Resampling.nearest
+                meta.update(dtype=encoding["dtype"], nodata=encoding["nodata"])
+                if unit["dump_dirs"]:
+                    dump_path = os.path.join(unit["dump_dirs"]["reclassified"], os.path.basename(tif_path)[:-4] + f"{RECLASS_SUFFIX}.tif")
+                    os.makedirs(os.path.dirname(dump_path), exist_ok=True)
+                    self.resampler.writer.write(dump_path, data, meta, tags=get_encoding_tags(encoding))
+            else:
+                data = raw
+            warped = np.full((data.shape[0], ref.height, ref.width), out_nodata, dtype=out_dtype)
+            for i in range(data.shape[0]):
+                reproject(
+                    source=data[i],
+                    destination=warped[i],
+                    src_transform=src_transform,
+                    src_crs=src.crs,
+                    src_nodata=src_nodata,
+                    dst_transform=ref.transform,
+                    dst_crs=ref.crs,
+                    dst_nodata=out_nodata,
+                    resampling=resampling
+                )
+        meta.update({
+            'crs': ref.crs,
+            'transform': ref.transform,
+            'width': ref.width,
+            'height': ref.height,
+            'nodata': out_nodata,
+            'dtype': out_dtype,
+            'count': warped.shape[0]
+        })
+        return warped, meta, self.get_output_name(os.path.basename(tif_path), reclassified)
+
+    def write_layer(self, out_dir, name, warped, meta):
+        os.makedirs(out_dir, exist_ok=True)
+        tags = get_encoding_tags(self.reclassifier.table.encoding) if f"{RECLASS_SUFFIX}_" in name else None
+        self.resampler.writer.write(os.path.join(out_dir, name), warped, meta, tags=tags)
+
+    def process_unit(self, unit):
+        # Returns a message and the statistics of the source mask, when they were computed
+        ref = unit["grid"]
+        layers = dict(unit["layers"])
+        mask_layer = PRODUCT_MASK_LAYERS.get(unit["product_type"])
+        filtered = unit["filter_cc"] and mask_layer in layers
+        out_dir = unit["filtered_dir"] if filtered else unit["resampled_dir"]
+        stats = None
+        if mask_layer in layers and (filtered or is_windowed(self.config)):
+            # Scored on the source mask over the reference raster, before anything is warped:
+            # the reclassified mask maps clouds to no data by default
+            stats = self.cloud_filter.get_scene_stats(layers[mask_layer], (ref.bounds, ref.crs), False, unit["product_type"])
+            if stats["valid_fraction"] == 0 and is_windowed(self.config):
+                self.remove_outputs(unit)
+                return f"Skipped {unit['name']} (no valid pixels over the reference raster)", stats
+            if filtered and stats["cloud_fraction"] > unit["cc_threshold"]:
+                self.remove_outputs(unit)
+                return f"Filtered out {unit['name']} (cloud fraction: {stats['cloud_fraction']:.2%})", stats
+        # The mask layer decided above whether the scene is empty; without one each layer is checked
+        skip_empty = is_windowed(self.config) and mask_layer not in layers
+        for layer, tif_path in unit["layers"]:
+            warped_layer = self.warp_layer(tif_path, layer, unit, ref, skip_empty=skip_empty)
+            if warped_layer is None:
+                continue
+            warped, meta, name = warped_layer
+            if filtered and unit["dump_dirs"]:
+                self.write_layer(unit["dump_dirs"]["resampled"], name, warped, meta)
+            self.write_layer(out_dir, name, warped, meta)
+        if not filtered:
+            return f"Processed {unit['name']} ({len(layers)} layers)", stats
+        return f"Kept {unit['name']} ({len(layers)} layers, cloud fraction: {stats['cloud_fraction']:.2%})", stats
+
+    def get_output_paths(self, unit):
+        out_dir = unit["filtered_dir"] if unit["filter_cc"] else unit["resampled_dir"]
+        reclass_layers = PRODUCT_LAYERS_TO_RECLASSIFY.get(unit["product_type"], []) if unit["reclassify"] else []
+        return [os.path.join(out_dir, self.get_output_name(os.path.basename(tif_path), layer in reclass_layers))
+                for layer, tif_path in unit["layers"]]
+
+    def remove_outputs(self, unit):
+        # Outputs of a unit that is now filtered out or empty, e.g. kept with a higher threshold
+        for out_path in self.get_output_paths(unit):
+            if os.path.exists(out_path):
+                os.remove(out_path)
+
+    def is_unit_current(self, unit):
+        for (layer, tif_path), out_path in zip(unit["layers"], self.get_output_paths(unit)):
+            if not is_up_to_date(self.config, out_path, [tif_path, unit["reference_raster"]]):
+                return False
+        return True
+
+    def get_recorded_skip(self, unit, catalog):
+        # "empty" or "rejected" when the catalog row of the unit, computed from its current mask,
+        # says nothing is to be written
+        mask_path = dict(unit["layers"]).get(PRODUCT_MASK_LAYERS.get(unit["product_type"]))
+        row = catalog.get(unit["key"], mask_path) if catalog is not None and mask_path else None
+        if row is None:
+            return None
+        if row["valid_fraction"] == 0 and is_windowed(self.config):
+            return "empty"
+        if unit["filter_cc"] and row["cloud_fraction"] > unit["cc_threshold"]:
+            return "rejected"
+        return None
+
+    def process_units(self, units, prune=False):
+        # Processes the units that are not current and records their scene statistics in the
+        # scene catalog, so rejected and empty scenes are not read again while their mask is
+        # unchanged. prune drops catalog rows of scenes not in units (units of all dates).
+        catalogs = {}
+        if is_catalog_enabled(self.config):
+            for unit in units:
+                if unit["base_dir"] not in catalogs:
+                    catalogs[unit["base_dir"]] = SceneCatalog.from_config(self.config, unit["base_dir"])
+        todo = []
+        for unit in units:
+            if unit["rejected"] or (is_reuse_enabled(self.config) and
+                                    self.get_recorded_skip(unit, catalogs.get(unit["base_dir"]))):
+                self.remove_outputs(unit)
+            elif not self.is_unit_current(unit):
+                todo.append(unit)
+        results = self.executor.map(self.process_unit, todo, label="scenes")
+        for unit, result in zip(todo, results):
+            if not result.ok:
+                continue
+            message, stats = result.value
+            logger.debug(message)
+            catalog = catalogs.get(unit["base_dir"])
+            if catalog is not None and stats is not None:
+                layers = dict(unit["layers"])
+                catalog.update(unit["key"], stats, layers[PRODUCT_MASK_LAYERS[unit["product_type"]]], layers.values(),
+                               tiles=unit["tiles"])
+        for base_dir, catalog in catalogs.items():
+            if prune:
+                catalog.prune(unit["key"] for unit in units if unit["base_dir"] == base_dir)
+            catalog.save()
+        return todo
+
+    def get_units(self, raster_entry, product_type, dates=None):
+        # dates (YYYYMMDD) limits the units to those acquisition dates
+        project_root = os.getcwd()
+        raster_folder = os.path.splitext(raster_entry["name"])[0]
+        in_dir = os.path.join(project_root, self.config.output_path_original, raster_folder, product_type)
+        out_base = os.path.join(project_root, self.config.output_path_processed, raster_folder, product_type)
+        if not os.path.isdir(in_dir):
+            print(f"Product directory not found: {in_dir}")
+            return []
+        filter_cc = getattr(self.config, "filter_cc", False)
+        dump = getattr(self.config, "fused_dump_intermediates", False)
+        # Streaming runs (dates given) have no source cloud scores yet
+        rejected = get_rejected_scenes(self.config, out_base) if dates is None else set()
+        grid = get_reference_grid(self.config, raster_entry)
+        mosaic_groups = defaultdict(list)
+        scene_groups = defaultdict(list)
+        scene_dates = {}
+        for scene_file in get_inventory(self.config).list_files(in_dir, product_type, "original"):
+            if scene_file.is_mosaic:
+                if MOSAIC_NAME_PATTERN.match(os.path.basename(scene_file.path)):
+                    mosaic_groups[scene_file.date].append((scene_file.layer, scene_file.path))
+            else:
+                scene_groups[scene_file.scene].append((scene_file.layer, scene_file.path))
+                scene_dates[scene_file.scene] = scene_file.date
+        groups = [(scene, layers, False) for scene, layers in sorted(scene_groups.items())]
+        date_tiles = get_date_tiles(scene_groups)
+        for date, layers in sorted(mosaic_groups.items()):
+            groups.append((date, layers, True))
+
+        units = []
+        for name, layers, is_mosaic in groups:
+            if dates is not None and (name if is_mosaic else scene_dates[name]) not in dates:
+                continue
+            sub = "mosaic" if is_mosaic else name
+            tile = get_scene_tile(name)
+            units.append({
+                "name": f"{raster_folder}/{product_type}/{sub}" + (f"/{name}" if is_mosaic else ""),
+                "key": name,
+                "tiles": date_tiles.get(name, []) if is_mosaic else [tile] if tile else [],
+                "base_dir": out_base,
+                "product_type": product_type,
+                "layers": layers,
+                "reference_raster": os.path.join(self.config.reference_raster_dir, raster_entry["name"]),
+                "grid": grid,
+                "reclassify": getattr(self.config, "reclassify", False),
+                # Same rule as CloudFilter: mosaics are filtered if there are any, single scenes otherwise
+                "filter_cc": filter_cc and (is_mosaic or not mosaic_groups),
+                "cc_threshold": getattr(self.config, "cc_threshold", 1.0),
+                # Above the threshold by its source cloud score (cc_pushdown)
+                "rejected": name in rejected,
+                "resampled_dir": os.path.join(out_base, "resampled", sub),
+                "filtered_dir": os.path.join(out_base, "cc_filtered", sub),
+                "dump_dirs": {
+                    "reclassified": os.path.join(out_base, "reclassified", sub),
+                    "resampled": os.path.join(out_base, "resampled", sub),
+                } if dump else None,
+            })
+        return units
+
+    def process(self):
+        if not getattr(self.config, "crop_resample", False):
+            print("Fused processing requires crop_resample to be enabled. Skipping fused step.")
+            return
+        print("Starting fused reclassify/resample/cloud filter processing...")
+        units = []
+        for raster_entry in self.config.reference_rasters:
+            for product_type in self.config.clms_product:
+                units.extend(self.get_units(raster_entry, product_type))
+        self.process_units(units, prune=True)
+        print("Fused processing finished.")
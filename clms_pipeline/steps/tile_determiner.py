@@ -2,9 +2,9 @@ import os
 import requests
 import zipfile
 import glob
-import geopandas as gpd
-import rasterio
-import shapely.geometry
+
+from clms_pipeline.reference_grid import get_reference_grid
+from clms_pipeline.tile_index import TILE_INDEX_NAME, get_aoi_footprint, load_tile_index
 
 class TileDeterminer:
     def __init__(self, config):
@@ -18,8 +18,11 @@ class TileDeterminer:
         unziped_path = os.path.join(base_dir, "data/tile_system/")
         os.makedirs(unziped_path, exist_ok=True)
 
-        # Download and unzip tile system shapefile if not already existing
-        if os.path.exists(unziped_path) and os.listdir(unziped_path):
+        kml_files = glob.glob(os.path.join(unziped_path, "*.kml"))
+        index_path = os.path.join(unziped_path, TILE_INDEX_NAME)
+
+        # Download and unzip tile system shapefile if neither the KML nor its index exist yet
+        if kml_files or os.path.exists(index_path):
             print("File already exists, skipping downloading and unzipping!")
         else:
             response = requests.get(url)
@@ -34,16 +37,17 @@ class TileDeterminer:
             else:
                 print("Download failed or zip file is empty!")
                 return
+            kml_files = glob.glob(os.path.join(unziped_path, "*.kml"))
 
-        kml_files = glob.glob(os.path.join(unziped_path, "*.kml"))
-        if not kml_files:
+        # The KML is parsed once into a binary index; later runs only load the index
+        tile_index = load_tile_index(kml_files[0] if kml_files else None, index_path,
+                                     getattr(self.config, "tile_index_tolerance", 0.001))
+        if tile_index is None:
             print("No KML file found in the directory!")
             return
-        else:
-            s2_tile_system = gpd.read_file(kml_files[0])
-            print("KML file loaded into Python!")
-            print("KML CRS:", s2_tile_system.crs)
+        print(f"Tile index loaded ({len(tile_index.names)} tiles, CRS: {tile_index.crs.to_string()})")
 
+        entries = []
         for raster_entry in self.config.reference_rasters:
             AOI_path = os.path.join(self.config.reference_raster_dir, raster_entry["name"])
             raster_name = os.path.splitext(os.path.basename(AOI_path))[0]
@@ -53,27 +57,20 @@ class TileDeterminer:
                 print(f"Reference raster file not found: {AOI_path}")
                 continue
 
-            with rasterio.open(AOI_path, "r") as src:
-                if src.crs is not None:
-                    bounds = src.bounds
-                    aoi_geom = shapely.geometry.box(bounds.left, bounds.bottom, bounds.right, bounds.top)
-                    aoi_gdf = gpd.GeoDataFrame({'geometry': [aoi_geom]}, crs=src.crs)
-                else:
-                    print("The reference raster does not have a CRS defined. Using config CRS:", raster_entry["crs"])
-                    bounds = src.bounds
-                    aoi_geom = shapely.geometry.box(bounds.left, bounds.bottom, bounds.right, bounds.top)
-                    aoi_gdf = gpd.GeoDataFrame({'geometry': [aoi_geom]}, crs=raster_entry["crs"])
-
-            aoi_gdf = aoi_gdf.to_crs(s2_tile_system.crs)
-            intersecting_tiles = s2_tile_system[s2_tile_system.intersects(aoi_gdf.geometry.iloc[0])]
+            # The grid falls back to the config CRS if the reference raster has none
+            grid = get_reference_grid(self.config, raster_entry)
+            entries.append((AOI_path, result_path, get_aoi_footprint(grid, tile_index.crs)))
 
-            if not intersecting_tiles.empty:
+        # All reference rasters are matched against the tile grid in one query
+        matches = tile_index.query([footprint for _, _, footprint in entries])
+        for (AOI_path, result_path, _), intersecting_tiles in zip(entries, matches):
+            if intersecting_tiles:
                 with open(result_path, 'w') as f:
-                    for tile in intersecting_tiles['Name']:
+                    for tile in intersecting_tiles:
                         f.write(f"{tile}\n")
                 print(f"Intersecting tiles written to {result_path}")
                 print("Determined tiles for raster:", AOI_path)
-                for tile in intersecting_tiles['Name']:
+                for tile in intersecting_tiles:
                     print(f"  {tile}")
             else:
                 print(f"No intersecting tiles found for raster: {AOI_path}")
@@ -1,30 +1,103 @@
 import os
+import logging
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from clms_pipeline.product_store import ProductStore, is_store_enabled
+from clms_pipeline.scenes import VSIZIP_INVENTORY, get_layer_from_filename, vsizip_path
+
+logger = logging.getLogger(__name__)
+
+UNZIP_MODES = ["extract", "layers", "vsizip"]
+
 
 class Unzipper:
     def __init__(self, config):
         self.config = config
 
+    def get_wanted_layers(self, product_type):
+        # None means every raster layer of the product is kept
+        wanted = getattr(self.config, "unzip_layers", None) or {}
+        layers = wanted.get(product_type)
+        return {layer.upper() for layer in layers} if layers else None
+
+    def is_wanted_member(self, member, wanted_layers):
+        layer = get_layer_from_filename(os.path.basename(member))
+        if layer is None:
+            return False
+        return wanted_layers is None or layer in wanted_layers
+
+    def process_zip(self, zip_path, product_dir, mode, wanted_layers):
+        # (success, message)
+        try:
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                if mode == "extract":
+                    zip_ref.extractall(product_dir)
+                    os.remove(zip_path)
+                    return True, f"Unzipped and deleted: {zip_path}"
+                members = [m for m in zip_ref.namelist() if self.is_wanted_member(m, wanted_layers)]
+                if mode == "layers":
+                    for member in members:
+                        zip_ref.extract(member, product_dir)
+                    os.remove(zip_path)
+                    return True, f"Extracted {len(members)} layers and deleted: {zip_path}"
+            # vsizip: keep the zip and list its layers in the scene folder instead of extracting them
+            scene_members = {}
+            for member in members:
+                scene = os.path.dirname(member) or os.path.splitext(os.path.basename(zip_path))[0]
+                scene_members.setdefault(scene, []).append(member)
+            for scene, scene_layers in scene_members.items():
+                scene_dir = os.path.join(product_dir, scene)
+                os.makedirs(scene_dir, exist_ok=True)
+                # Replaced in one step, as streaming may be listing the scene folder meanwhile
+                inventory_path = os.path.join(scene_dir, VSIZIP_INVENTORY)
+                with open(inventory_path + ".tmp", "w") as f:
+                    for member in scene_layers:
+                        f.write(vsizip_path(zip_path, member) + "\n")
+                os.replace(inventory_path + ".tmp", inventory_path)
+            return True, f"Indexed {len(members)} layers in place: {zip_path}"
+        except Exception as e:
+            return False, f"Error processing {zip_path}: {type(e).__name__}: {e}"
+
     def unzip_and_cleanup(self):
         print("Starting unzip and cleanup process...")
+        mode = getattr(self.config, "unzip_mode", "extract")
+        if mode not in UNZIP_MODES:
+            print(f"Invalid unzip mode: {mode}. Allowed modes are: {UNZIP_MODES}")
+            return
+        workers = max(1, getattr(self.config, "unzip_workers", 4))
         project_root = os.getcwd()
-        for raster_entry in self.config.reference_rasters:
-            raster_folder = os.path.splitext(raster_entry["name"])[0]
-            for product_type in self.config.clms_product:
-                product_dir = os.path.join(project_root, self.config.output_path_original, raster_folder, product_type)
-                if not os.path.isdir(product_dir):
-                    print(f"Directory not found: {product_dir}")
-                    continue
-                print(f"\n=== Unzipping for reference raster: {raster_folder}, product: {product_type} ===")
-                for fname in os.listdir(product_dir):
-                    if fname.endswith(".zip"):
-                        zip_path = os.path.join(product_dir, fname)
-                        try:
-                            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                                zip_ref.extractall(product_dir)
-                            print(f"Unzipped: {zip_path}")
-                            os.remove(zip_path)
-                            print(f"Deleted: {zip_path}")
-                        except Exception as e:
-                            print(f"Error processing {zip_path}: {e}")
-        print("Unzip and cleanup process finished.")
\ No newline at end of file
+        store = ProductStore.from_config(self.config) if is_store_enabled(self.config) else None
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            if store is not None:
+                # Every product is unzipped once in the store, the reference rasters link to it
+                for product_type in self.config.clms_product:
+                    product_dir = store.get_product_dir(product_type)
+                    if os.path.isdir(product_dir):
+                        print(f"\n=== Unzipping stored products: {product_type} (mode: {mode}) ===")
+                        self.unzip_folder(pool, product_dir, mode, product_type)
+                store.build_views(self.config)
+            else:
+                for raster_entry in self.config.reference_rasters:
+                    raster_folder = os.path.splitext(raster_entry["name"])[0]
+                    for product_type in self.config.clms_product:
+                        product_dir = os.path.join(project_root, self.config.output_path_original, raster_folder, product_type)
+                        if not os.path.isdir(product_dir):
+                            print(f"Directory not found: {product_dir}")
+                            continue
+                        print(f"\n=== Unzipping for reference raster: {raster_folder}, product: {product_type} (mode: {mode}) ===")
+                        self.unzip_folder(pool, product_dir, mode, product_type)
+        print("Unzip and cleanup process finished.")
+
+    def unzip_folder(self, pool, product_dir, mode, product_type, zip_names=None):
+        # zip_names limits the run to those zips of product_dir (e.g. of one download job)
+        wanted_layers = self.get_wanted_layers(product_type)
+        if zip_names is None:
+            zip_names = [f for f in os.listdir(product_dir) if f.endswith(".zip")]
+        zip_paths = [os.path.join(product_dir, f) for f in sorted(zip_names)]
+        for ok, message in pool.map(lambda z: self.process_zip(z, product_dir, mode, wanted_layers), zip_paths):
+            if ok:
+                logger.debug(message)
+            else:
+                # e.g. a corrupt or truncated download
+                logger.error(message)
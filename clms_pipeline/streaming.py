@@ -0,0 +1,192 @@
+import os
+import queue
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from clms_pipeline.download_scheduler import DownloadResult, DownloadScheduler
+from clms_pipeline.executor import ParallelExecutor
+from clms_pipeline.product_store import ProductStore, SharedOutputs, is_store_enabled, read_relevant_tiles
+from clms_pipeline.steps.downloader import Downloader, get_window_index
+from clms_pipeline.steps.mosaic import MosaicBuilder
+from clms_pipeline.steps.cloud_filter import is_pushdown_enabled
+from clms_pipeline.steps.scene_processor import FusedSceneProcessor
+from clms_pipeline.steps.unzipper import UNZIP_MODES, Unzipper
+
+logger = logging.getLogger(__name__)
+
+DONE = None  # end of the queue of ready groups
+
+
+def get_window_dates(start_date, end_date, index, days):
+    # YYYYMMDD dates of window index (days days each, counted from start_date) up to end_date
+    first = datetime.strptime(start_date[:10], "%Y-%m-%d") + timedelta(days=index * days)
+    last = datetime.strptime(end_date[:10], "%Y-%m-%d")
+    return [(first + timedelta(days=i)).strftime("%Y%m%d") for i in range(days) if first + timedelta(days=i) <= last]
+
+
+class StreamingRunner:
+    # Overlaps downloading with processing. Download jobs are cut into windows of
+    # stream_window_days days and run in window order; each finished job is collected and
+    # unzipped right away. Once every tile of a reference raster, product and window is in,
+    # that group is mosaicked and run through the fused reclassify/resample/cloud filter pass
+    # while later windows are still downloading. The queues between the stages hold at most
+    # stream_queue_size entries, so downloads wait when processing falls behind.
+    def __init__(self, config):
+        self.config = config
+        self.downloader = Downloader(config)
+        self.unzipper = Unzipper(config)
+        self.mosaic_builder = MosaicBuilder(config)
+        self.scene_processor = FusedSceneProcessor(config)
+        self.window_days = max(1, int(getattr(config, "stream_window_days", 7)))
+        self.queue_size = max(1, int(getattr(config, "stream_queue_size", 4)))
+        self.job_groups = {}
+        self.shared = None
+        self.errors = []
+
+    def get_groups(self, jobs):
+        # Pending job names per (raster folder, product, window); with the product store a job
+        # feeds every reference raster that has its tile
+        config = self.config
+        folders = [os.path.splitext(r["name"])[0] for r in config.reference_rasters]
+        windows = range(get_window_index(config.end_date, config.start_date, self.window_days) + 1)
+        groups = {(f, p, w): set() for f in folders for p in config.clms_product for w in windows}
+        tiles = {f: set(read_relevant_tiles(f)) for f in folders} if is_store_enabled(config) else None
+        self.job_groups = {}
+        for job in jobs:
+            window = get_window_index(job.start_date, config.start_date, self.window_days)
+            job_folders = [f for f in folders if job.tile in tiles[f]] if tiles is not None else [job.raster_folder]
+            self.job_groups[job.name] = [(f, job.product_type, window) for f in job_folders]
+            for key in self.job_groups[job.name]:
+                groups[key].add(job.name)
+        return groups
+
+    def download_job(self, scheduler, job, downloaded):
+        # Blocks while the queue is full: backpressure from processing to downloading
+        try:
+            result = scheduler.run_job(job)
+        except Exception as e:
+            result = DownloadResult(job, False, 1, error=f"{type(e).__name__}: {e}")
+        downloaded.put(result)
+
+    def finish_job(self, result, unzip_pool, mode):
+        # Only the zips of this job are unzipped; the product dir keeps the zips of all earlier
+        # jobs in vsizip mode, and indexing them again after every job would be quadratic
+        job = result.job
+        zip_names = []
+        if result.success and os.path.isdir(job.output_dir):
+            zip_names = [f for f in os.listdir(job.output_dir) if f.endswith(".zip")]
+        self.downloader.finish_job(result)
+        if not result.success:
+            return
+        product_dir = os.path.dirname(job.output_dir)
+        self.unzipper.unzip_folder(unzip_pool, product_dir, mode, job.product_type, zip_names=zip_names)
+        if is_store_enabled(self.config):
+            ProductStore.from_config(self.config).build_views(self.config)
+
+    def process_group(self, raster_folder, product_type, window):
+        config = self.config
+        raster_entry = next(r for r in config.reference_rasters if os.path.splitext(r["name"])[0] == raster_folder)
+        dates = get_window_dates(config.start_date, config.end_date, window, self.window_days)
+        product_dir = os.path.join(os.getcwd(), config.output_path_original, raster_folder, product_type)
+        if not dates or not os.path.isdir(product_dir):
+            return
+        if getattr(config, "mosaic_output", False):
+            clip_bounds = self.mosaic_builder.get_clip_bounds([raster_entry]) if getattr(config, "mosaic_clip_to_aoi", False) else None
+            extension = "vrt" if getattr(config, "mosaic_format", "tif") == "vrt" else "tif"
+            tasks = self.mosaic_builder.get_product_tasks(product_dir, product_type, clip_bounds, extension,
+                                                          self.shared, dates=set(dates))
+            self.mosaic_builder.run_tasks(tasks, self.shared)
+            if self.shared is not None:
+                del self.shared.links[:]
+        processor = self.scene_processor
+        units = processor.process_units(processor.get_units(raster_entry, product_type, dates=set(dates)))
+        print(f"Processed {raster_folder} / {product_type} {dates[0]}..{dates[-1]}: {len(units)} scenes")
+
+    def process_groups(self, ready):
+        while True:
+            key = ready.get()
+            if key is DONE:
+                return
+            if self.errors:
+                # Keep draining so the download side never blocks on a full queue
+                continue
+            try:
+                self.process_group(*key)
+            except Exception as e:
+                print(f"Processing {'/'.join(str(k) for k in key)} failed: {type(e).__name__}: {e}")
+                self.errors.append(e)
+
+    def run(self):
+        config = self.config
+        if not getattr(config, "crop_resample", False):
+            print("Streaming mode requires crop_resample to be enabled. Skipping stream step.")
+            return
+        mode = getattr(config, "unzip_mode", "extract")
+        if mode not in UNZIP_MODES:
+            print(f"Invalid unzip mode: {mode}. Allowed modes are: {UNZIP_MODES}")
+            return
+        print(f"Starting streaming download and processing ({self.window_days}-day windows)...")
+        if is_pushdown_enabled(config):
+            print("cc_pushdown is not used in streaming mode: each scene is scored on its source mask "
+                  "when it is processed.")
+        jobs = self.downloader.get_jobs(window_days=self.window_days)
+        if jobs is None:
+            return
+        if is_store_enabled(config):
+            ProductStore.from_config(config).build_views(config)
+        groups = self.get_groups(jobs)
+        jobs.sort(key=lambda job: self.job_groups[job.name][0][2] if self.job_groups[job.name] else 0)
+        self.shared = SharedOutputs(config, "mosaic") if is_store_enabled(config) else None
+        self.errors = []
+        downloaded = queue.Queue(maxsize=self.queue_size)
+        ready = queue.Queue(maxsize=self.queue_size)
+        # One process pool for all groups. The download and unzip threads are running while
+        # workers start, so they are not forked from this process.
+        executor = ParallelExecutor.from_config(config)
+        methods = multiprocessing.get_all_start_methods()
+        executor.start(multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn"))
+        self.mosaic_builder.executor = self.scene_processor.executor = executor
+        processor = threading.Thread(target=self.process_groups, args=(ready,), name="stream-processing", daemon=True)
+        processor.start()
+        results = []
+        try:
+            scheduler = DownloadScheduler.from_config(config)
+            if jobs:
+                print(f"Scheduling {len(jobs)} download jobs on {min(scheduler.max_workers, len(jobs))} workers...")
+            unzip_workers = max(1, getattr(config, "unzip_workers", 4))
+            with ThreadPoolExecutor(max_workers=max(1, min(scheduler.max_workers, len(jobs)))) as pool, \
+                    ThreadPoolExecutor(max_workers=unzip_workers) as unzip_pool:
+                for job in jobs:
+                    pool.submit(self.download_job, scheduler, job, downloaded)
+                # Groups with nothing left to download (e.g. from an earlier incremental run) go first
+                for key in sorted(k for k, pending in groups.items() if not pending):
+                    ready.put(key)
+                for _ in jobs:
+                    result = downloaded.get()
+                    results.append(result)
+                    try:
+                        self.finish_job(result, unzip_pool, mode)
+                    except Exception as e:
+                        # The group still gets processed with the scenes that are there
+                        print(f"Collecting {result.job.name} failed: {type(e).__name__}: {e}")
+                        result.success, result.error = False, f"{type(e).__name__}: {e}"
+                    for key in self.job_groups[result.job.name]:
+                        groups[key].discard(result.job.name)
+                        if not groups[key]:
+                            ready.put(key)
+        finally:
+            ready.put(DONE)
+            processor.join()
+            executor.shutdown()
+            self.downloader.save_manifests()
+        failed = [r for r in results if not r.success]
+        print(f"Download jobs finished: {len(results) - len(failed)} succeeded, {len(failed)} failed.")
+        for r in failed:
+            print(f"  FAILED {r.job.name} after {r.attempts} attempt(s): {r.error}")
+        if self.errors:
+            raise self.errors[0]
+        print("Streaming download and processing finished.")
+        return results
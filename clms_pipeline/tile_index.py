@@ -0,0 +1,114 @@
+import os
+import numpy as np
+import shapely
+import shapely.geometry
+from rasterio.crs import CRS
+from rasterio.warp import transform as transform_coords
+
+TILE_INDEX_NAME = "s2_tile_index.npz"
+
+
+def get_source_info(kml_path):
+    stat = os.stat(kml_path)
+    return np.array([os.path.basename(kml_path), str(stat.st_mtime), str(stat.st_size)])
+
+
+def to_wkb_arrays(geometries):
+    wkb = [shapely.to_wkb(g) for g in geometries]
+    offsets = np.cumsum([0] + [len(b) for b in wkb]).astype(np.int64)
+    return np.frombuffer(b"".join(wkb), dtype=np.uint8), offsets
+
+
+def from_wkb_arrays(data, offsets):
+    wkb = data.tobytes()
+    return shapely.from_wkb([wkb[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)])
+
+
+def build_tile_index(kml_path, index_path, tolerance=0.001):
+    # Parses the tiling KML once and stores names, bounding boxes and simplified 2D footprints
+    # as flat arrays. geopandas is only needed here, not when the index is loaded.
+    import geopandas as gpd
+    tiles = gpd.read_file(kml_path)
+    exact = shapely.force_2d(tiles.geometry.values)
+    # Simplify, then grow by the same tolerance, so a footprint never loses area and no
+    # intersecting tile is missed by the STRtree; the exact 2D footprints confirm each match
+    footprints = shapely.buffer(shapely.simplify(exact, tolerance, preserve_topology=True), tolerance, join_style="mitre")
+    wkb, offsets = to_wkb_arrays(footprints)
+    exact_wkb, exact_offsets = to_wkb_arrays(exact)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            names=np.array(tiles["Name"].astype(str).tolist()),
+            bounds=shapely.bounds(footprints),
+            wkb=wkb,
+            wkb_offsets=offsets,
+            exact_wkb=exact_wkb,
+            exact_wkb_offsets=exact_offsets,
+            crs=np.array(tiles.crs.to_wkt()),
+            source=get_source_info(kml_path),
+        )
+    os.replace(tmp_path, index_path)
+    return TileIndex.load(index_path)
+
+
+class TileIndex:
+    # Sentinel-2 tile footprints with an STRtree over them, so all AOIs are matched in one query
+    def __init__(self, names, bounds, footprints, crs, source=None, exact=None):
+        self.names = names
+        self.bounds = bounds
+        self.footprints = footprints
+        self.exact = exact
+        self.crs = crs
+        self.source = source
+        self.tree = shapely.STRtree(footprints)
+
+    @classmethod
+    def load(cls, index_path):
+        with np.load(index_path) as data:
+            footprints = from_wkb_arrays(data["wkb"], data["wkb_offsets"])
+            exact = from_wkb_arrays(data["exact_wkb"], data["exact_wkb_offsets"]) if "exact_wkb" in data else None
+            return cls(data["names"], data["bounds"], footprints, CRS.from_wkt(str(data["crs"])),
+                       source=data["source"].tolist(), exact=exact)
+
+    def is_current(self, kml_path):
+        # Indexes written without exact footprints are rebuilt
+        return self.exact is not None and self.source == get_source_info(kml_path).tolist()
+
+    def query(self, aoi_geometries):
+        # Returns the intersecting tile names for each AOI geometry (in the index CRS)
+        matches = [[] for _ in aoi_geometries]
+        if len(aoi_geometries) == 0:
+            return matches
+        aois = np.asarray(aoi_geometries, dtype=object)
+        aoi_idx, tile_idx = self.tree.query(aois, predicate="intersects")
+        if self.exact is not None:
+            # Drop tiles that only reach the AOI through the simplification tolerance
+            keep = shapely.intersects(self.exact[tile_idx], aois[aoi_idx])
+            aoi_idx, tile_idx = aoi_idx[keep], tile_idx[keep]
+        for a, t in zip(aoi_idx, tile_idx):
+            matches[a].append(str(self.names[t]))
+        return [sorted(set(m)) for m in matches]
+
+
+def load_tile_index(kml_path, index_path, tolerance=0.001):
+    # Reuses the cached index while the KML is unchanged; the KML may also be removed once indexed
+    if os.path.exists(index_path):
+        index = TileIndex.load(index_path)
+        if kml_path is None or not os.path.exists(kml_path) or index.is_current(kml_path):
+            return index
+    if kml_path is None or not os.path.exists(kml_path):
+        return None
+    print(f"Building tile index from {kml_path}...")
+    return build_tile_index(kml_path, index_path, tolerance)
+
+
+def get_aoi_footprint(grid, dst_crs, densify_pts=21):
+    # Outline of the reference grid in dst_crs, with densified edges so curved edges are kept
+    left, bottom, right, top = grid.bounds
+    t = np.linspace(0, 1, densify_pts, endpoint=False)
+    xs = np.concatenate([left + (right - left) * t, np.full(densify_pts, right), right - (right - left) * t, np.full(densify_pts, left)])
+    ys = np.concatenate([np.full(densify_pts, bottom), bottom + (top - bottom) * t, np.full(densify_pts, top), top - (top - bottom) * t])
+    if grid.crs is not None and grid.crs != dst_crs:
+        xs, ys = transform_coords(grid.crs, dst_crs, xs, ys)
+    return shapely.geometry.Polygon(list(zip(xs, ys)))
@@ -0,0 +1,198 @@
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from rasterio.enums import Resampling
+from rasterio.warp import transform as transform_coords
+from rasterio.windows import Window
+
+SUPPORTED_METHODS = (Resampling.nearest, Resampling.bilinear)
+
+# In-memory LRU of loaded plans, per process. WarpPlanCache objects are pickled into every
+# parallel task, so plans kept on them would be lost; a worker keeps these for all its tasks.
+_plans = OrderedDict()
+
+
+class WarpPlan:
+    # Precomputed source pixel indices (and bilinear weights) for every destination pixel of
+    # one source grid -> destination grid warp. Indices are relative to `window`, the part of
+    # the source that the destination grid touches.
+    def __init__(self, method, window, indices, weights, valid, dst_shape):
+        self.method = method
+        self.window = window
+        self.indices = indices
+        self.weights = weights
+        self.valid = valid
+        self.dst_shape = dst_shape
+
+    @classmethod
+    def build(cls, src_crs, src_transform, src_width, src_height, dst_crs, dst_transform, dst_width, dst_height, method):
+        rows, cols = np.mgrid[0:dst_height, 0:dst_width]
+        xs, ys = dst_transform * (cols.ravel() + 0.5, rows.ravel() + 0.5)
+        if src_crs != dst_crs:
+            xs, ys = transform_coords(dst_crs, src_crs, xs, ys)
+        src_cols, src_rows = ~src_transform * (np.asarray(xs), np.asarray(ys))
+        if method == Resampling.nearest:
+            col_idx = np.floor(src_cols).astype(np.int64)
+            row_idx = np.floor(src_rows).astype(np.int64)
+            valid = (col_idx >= 0) & (col_idx < src_width) & (row_idx >= 0) & (row_idx < src_height)
+            col_idx, row_idx = col_idx[np.newaxis], row_idx[np.newaxis]
+            weights = None
+        else:
+            # Bilinear on pixel centres, as GDAL does when not downsampling
+            u = src_cols - 0.5
+            v = src_rows - 0.5
+            c0 = np.floor(u).astype(np.int64)
+            r0 = np.floor(v).astype(np.int64)
+            # Weights in double precision, as GDAL computes them, so rounding matches exactly
+            fu = u - c0
+            fv = v - r0
+            valid = (u >= -0.5) & (u <= src_width - 0.5) & (v >= -0.5) & (v <= src_height - 0.5)
+            col_idx = np.clip(np.stack([c0, c0 + 1, c0, c0 + 1]), 0, src_width - 1)
+            row_idx = np.clip(np.stack([r0, r0, r0 + 1, r0 + 1]), 0, src_height - 1)
+            weights = np.stack([(1 - fu) * (1 - fv), fu * (1 - fv), (1 - fu) * fv, fu * fv])
+        if not valid.any():
+            window = Window(0, 0, 0, 0)
+            indices = np.zeros((col_idx.shape[0], 0), dtype=np.int32)
+        else:
+            col_min, col_max = int(col_idx[:, valid].min()), int(col_idx[:, valid].max())
+            row_min, row_max = int(row_idx[:, valid].min()), int(row_idx[:, valid].max())
+            window = Window(col_min, row_min, col_max - col_min + 1, row_max - row_min + 1)
+            indices = ((row_idx[:, valid] - row_min) * window.width + (col_idx[:, valid] - col_min))
+            indices = indices.astype(np.int32 if indices.size == 0 or indices.max() < 2 ** 31 else np.int64)
+            if weights is not None:
+                weights = weights[:, valid]
+        return cls(method, window, indices, weights, valid, (dst_height, dst_width))
+
+    @staticmethod
+    def get_scale(src_crs, src_transform, dst_crs, dst_transform):
+        # Source pixels per destination pixel, measured at the destination origin
+        xs, ys = dst_transform * (np.array([0.5, 1.5, 0.5]), np.array([0.5, 0.5, 1.5]))
+        if src_crs != dst_crs:
+            xs, ys = transform_coords(dst_crs, src_crs, xs, ys)
+        cols, rows = ~src_transform * (np.asarray(xs), np.asarray(ys))
+        return max(np.hypot(cols[1] - cols[0], rows[1] - rows[0]), np.hypot(cols[2] - cols[0], rows[2] - rows[0]))
+
+    def apply(self, src_window_arr, src_nodata, dst_nodata, dst_dtype):
+        out = np.full(self.dst_shape[0] * self.dst_shape[1], dst_nodata, dtype=dst_dtype)
+        if self.indices.shape[1] == 0:
+            return out.reshape(self.dst_shape)
+        flat = src_window_arr.ravel()
+        if self.method == Resampling.nearest:
+            values = flat[self.indices[0]]
+            keep = values != src_nodata if src_nodata is not None else np.ones(values.shape, dtype=bool)
+            target = np.flatnonzero(self.valid)[keep]
+            out[target] = values[keep]
+            return out.reshape(self.dst_shape)
+        values = flat[self.indices].astype(np.float64)
+        weights = self.weights.astype(np.float64)
+        if src_nodata is not None:
+            # Nodata neighbours drop out and the remaining weights are renormalised
+            weights = np.where(flat[self.indices] == src_nodata, 0.0, weights)
+        weight_sum = weights.sum(axis=0)
+        keep = weight_sum > 0
+        result = (values * weights).sum(axis=0)[keep] / weight_sum[keep]
+        if np.issubdtype(np.dtype(dst_dtype), np.integer):
+            result = np.rint(result)
+        out[np.flatnonzero(self.valid)[keep]] = result.astype(dst_dtype)
+        return out.reshape(self.dst_shape)
+
+    def save(self, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                method=np.array(int(self.method)),
+                window=np.array([self.window.col_off, self.window.row_off, self.window.width, self.window.height]),
+                indices=self.indices,
+                weights=self.weights if self.weights is not None else np.zeros((0, 0), dtype=np.float32),
+                valid=self.valid,
+                dst_shape=np.array(self.dst_shape),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            weights = data["weights"]
+            return cls(
+                Resampling(int(data["method"])),
+                Window(*[int(v) for v in data["window"]]),
+                data["indices"],
+                weights if weights.size else None,
+                data["valid"],
+                tuple(int(v) for v in data["dst_shape"]),
+            )
+
+
+class WarpPlanCache:
+    # Warp plans keyed by (source grid, destination grid, resampling method), kept in a small
+    # in-memory LRU and persisted as .npz files with an LRU size limit on disk
+    def __init__(self, cache_dir, max_entries=64, memory_entries=8):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+
+    @classmethod
+    def from_config(cls, config):
+        if not getattr(config, "warp_cache", False):
+            return None
+        return cls(
+            getattr(config, "warp_cache_dir", "data/cache/warp_plans"),
+            max_entries=getattr(config, "warp_cache_max_entries", 64),
+            memory_entries=getattr(config, "warp_cache_memory_entries", 8),
+        )
+
+    def get_key(self, src_crs, src_transform, src_width, src_height, dst_crs, dst_transform, dst_width, dst_height, method):
+        parts = [
+            src_crs.to_wkt(), tuple(src_transform)[:6], src_width, src_height,
+            dst_crs.to_wkt(), tuple(dst_transform)[:6], dst_width, dst_height, int(method),
+        ]
+        return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+    def get_plan(self, src_crs, src_transform, src_width, src_height, dst_crs, dst_transform, dst_width, dst_height, method):
+        if method not in SUPPORTED_METHODS:
+            return None
+        # GDAL widens the bilinear kernel when downsampling, which a 2x2 gather does not reproduce,
+        # so those warps are left to GDAL
+        if method == Resampling.bilinear and WarpPlan.get_scale(src_crs, src_transform, dst_crs, dst_transform) > 1.01:
+            return None
+        args = (src_crs, src_transform, src_width, src_height, dst_crs, dst_transform, dst_width, dst_height, method)
+        key = self.get_key(*args)
+        if key in _plans:
+            _plans.move_to_end(key)
+            return _plans[key]
+        path = os.path.join(self.cache_dir, f"{key}.npz")
+        try:
+            plan = WarpPlan.load(path)
+            os.utime(path)
+        except OSError:
+            # Not cached, or evicted by another worker
+            plan = WarpPlan.build(*args)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            plan.save(path)
+            self.evict()
+        _plans[key] = plan
+        while len(_plans) > self.memory_entries:
+            _plans.popitem(last=False)
+        return plan
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npz"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                # Evicted by another worker in the meantime
+                continue
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,71 @@
+import math
+import numpy as np
+import rasterio
+from rasterio.errors import WindowError
+from rasterio.transform import array_bounds
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, from_bounds
+
+from clms_pipeline.reclass_lut import RAW_NODATA, read_encoding
+
+
+def grid_bounds(transform, width, height):
+    west, south, east, north = array_bounds(height, width, transform)
+    return west, south, east, north
+
+
+def get_aoi_window(src, aoi_bounds, aoi_crs, margin=0):
+    # Pixel window of src covering aoi_bounds (given in aoi_crs), grown by margin pixels
+    # so resampling kernels at the AOI edge still see their neighbours. None if they don't overlap.
+    bounds = transform_bounds(aoi_crs, src.crs, *aoi_bounds, densify_pts=21)
+    window = from_bounds(*bounds, transform=src.transform)
+    col_off = math.floor(window.col_off) - margin
+    row_off = math.floor(window.row_off) - margin
+    col_end = math.ceil(window.col_off + window.width) + margin
+    row_end = math.ceil(window.row_off + window.height) + margin
+    try:
+        return Window(col_off, row_off, col_end - col_off, row_end - row_off).intersection(Window(0, 0, src.width, src.height))
+    except WindowError:
+        return None
+
+
+def is_windowed(config):
+    # Read only the window of each source layer that covers the reference raster, and skip
+    # layers that are all no data there
+    return getattr(config, "aoi_windowed_reads", False)
+
+
+def get_source_nodata(src):
+    # Reclassified layers carry their encoding, raw HRSI layers use 255
+    encoding = read_encoding(src)
+    if encoding is not None:
+        return encoding["nodata"]
+    return src.nodata if src.nodata is not None else RAW_NODATA
+
+
+def is_empty(arr, nodata):
+    return arr is None or arr.size == 0 or bool(np.all(arr == nodata))
+
+
+def has_valid_pixels(task):
+    path, aoi_bounds, aoi_crs, margin = task
+    with rasterio.open(path) as src:
+        window = get_aoi_window(src, aoi_bounds, aoi_crs, margin=margin)
+        return window is not None and not is_empty(src.read(1, window=window), get_source_nodata(src))
+
+
+def flag_empty_scenes(config, executor, tasks, files, mask_layer, key, aoi):
+    # tasks are (scene key, task) pairs, key gives the scene key (scene folder or mosaic date) of
+    # a SceneFile. With windowed reads, emptiness is decided once per scene on its mask layer over
+    # the AOI window, so a scene keeps all of its layers or none. Returns the tasks of the other
+    # scenes, each extended by whether its layer is still checked on its own (no mask layer).
+    if not is_windowed(config) or aoi is None:
+        return [task + (is_windowed(config),) for _, task in tasks]
+    masks = {key(f): f.path for f in files if f.layer == mask_layer}
+    keys = sorted({k for k, _ in tasks if k in masks})
+    margin = getattr(config, "aoi_window_margin", 16)
+    results = executor.map(has_valid_pixels, [(masks[k], aoi[0], aoi[1], margin) for k in keys], label="scene mask checks")
+    empty = {k for k, r in zip(keys, results) if r.ok and not r.value}
+    if empty:
+        print(f"Skipping {len(empty)} scenes without valid pixels over the reference raster")
+    return [task + (k not in masks,) for k, task in tasks if k not in empty]
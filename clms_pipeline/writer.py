@@ -0,0 +1,154 @@
+import os
+from contextlib import contextmanager
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+
+from clms_pipeline import run_report
+
+# Named output profiles; `output_profile` in the config is one of these names, or a dict of
+# overrides with an optional "base" profile
+OUTPUT_PROFILES = {
+    # Striped and uncompressed, as rasterio writes by default
+    "none": {"tiled": False, "compress": None},
+    "deflate": {"tiled": True, "blocksize": 256, "compress": "deflate", "predictor": "auto", "level": 6},
+    "zstd": {"tiled": True, "blocksize": 256, "compress": "zstd", "predictor": "auto", "level": 9},
+    # LERC with max_z_error 0 is lossless; larger values trade precision for size on float layers
+    "lerc": {"tiled": True, "blocksize": 256, "compress": "lerc_deflate", "max_z_error": 0},
+    "cog": {"cog": True, "blocksize": 512, "compress": "deflate", "predictor": "auto", "level": 6, "overviews": "auto"},
+}
+DEFAULT_PROFILE = "deflate"
+
+
+def get_output_profile(config):
+    profile = getattr(config, "output_profile", DEFAULT_PROFILE)
+    if isinstance(profile, dict):
+        merged = dict(OUTPUT_PROFILES[profile.get("base", DEFAULT_PROFILE)])
+        merged.update({k: v for k, v in profile.items() if k != "base"})
+        return merged
+    if profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output_profile '{profile}', expected one of {sorted(OUTPUT_PROFILES)}")
+    return dict(OUTPUT_PROFILES[profile])
+
+
+def get_predictor(profile, dtype):
+    predictor = profile.get("predictor")
+    if predictor != "auto":
+        return predictor
+    # Horizontal differencing for integer layers, the floating point predictor for float layers
+    return 3 if np.issubdtype(np.dtype(dtype), np.floating) else 2
+
+
+def get_overview_factors(profile, width, height):
+    overviews = profile.get("overviews")
+    if not overviews:
+        return []
+    if overviews != "auto":
+        return list(overviews)
+    # Halve until the overview fits in one block
+    blocksize = profile.get("blocksize", 256)
+    factors = []
+    factor = 2
+    while max(width, height) / (factor // 2) > blocksize:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+class RasterWriter:
+    # Shared GeoTIFF writer for all steps, applying the configured tiling, compression,
+    # overviews and COG layout
+    def __init__(self, profile):
+        self.profile = profile
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(get_output_profile(config))
+
+    def get_creation_options(self, meta):
+        profile = self.profile
+        out_meta = dict(meta)
+        out_meta["driver"] = "GTiff"
+        for key in ("tiled", "blockxsize", "blockysize", "compress", "predictor", "zlevel", "zstd_level",
+                    "max_z_error", "interleave", "bigtiff"):
+            out_meta.pop(key, None)
+        if profile.get("tiled") or profile.get("cog"):
+            blocksize = profile.get("blocksize", 256)
+            out_meta.update(tiled=True, blockxsize=blocksize, blockysize=blocksize)
+        compress = profile.get("compress")
+        if compress:
+            out_meta["compress"] = compress
+            if not compress.startswith("lerc"):
+                predictor = get_predictor(profile, meta["dtype"])
+                if predictor:
+                    out_meta["predictor"] = predictor
+            if "level" in profile:
+                if compress in ("deflate", "lerc_deflate"):
+                    out_meta["zlevel"] = profile["level"]
+                elif compress in ("zstd", "lerc_zstd"):
+                    out_meta["zstd_level"] = profile["level"]
+            if compress.startswith("lerc"):
+                out_meta["max_z_error"] = profile.get("max_z_error", 0)
+        if profile.get("bigtiff"):
+            out_meta["bigtiff"] = profile["bigtiff"]
+        return out_meta
+
+    def get_cog_options(self, meta):
+        profile = self.profile
+        options = {"blocksize": profile.get("blocksize", 512), "compress": profile.get("compress") or "none",
+                   "overviews": "auto" if profile.get("overviews") else "none",
+                   "resampling": profile.get("overview_resampling", "nearest")}
+        compress = profile.get("compress")
+        if compress and not compress.startswith("lerc"):
+            predictor = get_predictor(profile, meta["dtype"])
+            options["predictor"] = {None: "no", 1: "no", 2: "standard", 3: "floating_point"}.get(predictor, "yes")
+        if compress and "level" in profile:
+            options["level"] = profile["level"]
+        if compress and compress.startswith("lerc"):
+            options["max_z_error"] = profile.get("max_z_error", 0)
+        if profile.get("bigtiff"):
+            options["bigtiff"] = profile["bigtiff"]
+        return options
+
+    @contextmanager
+    def open(self, path, meta, tags=None):
+        # Yields a writable dataset; tags, overviews and the COG layout are applied when it is closed
+        if self.profile.get("cog"):
+            # The COG driver can only copy an existing dataset, so the data goes to a plain
+            # tiled GeoTIFF first
+            tmp_path = f"{path}.{os.getpid()}.tmp.tif"
+            tmp_meta = dict(meta, driver="GTiff", tiled=True, blockxsize=512, blockysize=512)
+            try:
+                with rasterio.open(tmp_path, "w", **tmp_meta) as dst:
+                    yield dst
+                    if tags:
+                        dst.update_tags(**tags)
+                rasterio.shutil.copy(tmp_path, path, driver="COG", **self.get_cog_options(meta))
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self.record(path, meta)
+            return
+        with rasterio.open(path, "w", **self.get_creation_options(meta)) as dst:
+            yield dst
+            if tags:
+                dst.update_tags(**tags)
+            factors = get_overview_factors(self.profile, dst.width, dst.height)
+            if factors:
+                resampling = self.profile.get("overview_resampling", "nearest")
+                dst.build_overviews(factors, Resampling[resampling])
+                dst.update_tags(ns="rio_overview", resampling=resampling)
+        self.record(path, meta)
+
+    def record(self, path, meta):
+        run_report.add("files_written", 1)
+        run_report.add("bytes_written", os.path.getsize(path))
+        run_report.add("pixels", meta["width"] * meta["height"] * meta.get("count", 1))
+
+    def write(self, path, data, meta, tags=None):
+        with self.open(path, meta, tags) as dst:
+            if data.ndim == 2:
+                dst.write(data, 1)
+            else:
+                dst.write(data)
@@ -28,4 +28,56 @@ config = CLMSConfig(
     crop_resample=True,
     filter_cc=False,
     cc_threshold=0.2,
+    download_workers=4,  # Number of concurrent tile x product download jobs
+    download_retries=2,  # Retries per failed job, with exponential backoff
+    download_retry_backoff=10.0,  # Seconds before the first retry
+    download_timeout=None,  # Seconds before a download job is killed (None = no limit)
+    download_client="script",  # "script" runs CLMS_downloader.py per job, "native" queries and downloads in-process
+    clms_api_url="https://cryo.land.copernicus.eu",  # Catalogue and download API of the native client
+    download_http_timeout=60,  # Seconds the native client waits for the server before a job fails
+    download_partial_dir="data/cache/partial_downloads",  # Interrupted downloads are resumed from here
+    unzip_mode="extract",  # "extract" (all files), "layers" (only raster layers) or "vsizip" (read layers from the zips)
+    unzip_workers=4,  # Number of zips processed in parallel
+    parallel_workers=None,  # Processes for per-file raster work (None = all cores)
+    parallel_chunksize=1,  # Files handed to a worker at once
+    parallel_serial=False,  # Run per-file work in the main process (useful for debugging)
+    mosaic_windowed=False,  # Write mosaics block by block to bound memory use
+    mosaic_clip_to_aoi=False,  # Only mosaic the area of the reference raster (implies mosaic_windowed)
+    mosaic_clip_margin=1000,  # Margin in metres around the reference raster when clipping mosaics
+    mosaic_block_size=1024,  # Block size in pixels for windowed mosaicking
+    mosaic_format="tif",  # "tif" writes mosaic GeoTIFFs, "vrt" writes lightweight GDAL VRTs referencing the tiles
+    aoi_window_margin=16,  # Extra source pixels read around the reference raster footprint
+    aoi_windowed_reads=False,  # Read only the reference raster footprint of each layer and skip scenes whose mask is all no data there
+    tile_index_tolerance=0.001,  # Simplification tolerance (degrees) of the cached Sentinel-2 tile footprints; matches are checked on the exact footprints
+    reference_grid_cache=True,  # Parse each reference raster once and keep a binary copy (.npy + JSON)
+    reference_grid_cache_dir="data/cache/reference_grids",
+    warp_cache=False,  # Reuse precomputed pixel index maps for repeated tile -> reference grid warps
+    warp_cache_dir="data/cache/warp_plans",
+    warp_cache_max_entries=64,  # Warp plans kept on disk (least recently used are removed first)
+    resample_multi_target=False,  # Read each source file once and reproject it into every reference grid it covers
+    output_profile="deflate",  # GeoTIFF layout of all outputs: "none", "deflate", "zstd", "lerc", "cog" or a dict of overrides
+    datacube_export=False,  # Stack the final daily layers into one time x y x cube per AOI, product and layer
+    datacube_format="memmap",  # "memmap" (raw array + JSON index), "zarr" or "netcdf"
+    reclass_dtype="float32",  # Output dtype of reclassified layers: "float32", "int16" or "uint8"
+    reclass_cloud_as_nodata=True,  # Map clouds to nodata (False keeps a separate cloud code)
+    reclass_rules=None,  # Optional per product/layer class rules, e.g. {"FSC": {"FSCOG": {"type": "threshold", "threshold": 50}}}
+    cc_pushdown=False,  # Score cloud coverage on the source layers and only resample scenes below cc_threshold
+    scene_catalog=True,  # Keep per-scene cloud/valid/snow statistics in scene_catalog.csv and select scenes from it
+    scene_catalog_format="csv",  # "csv" or "parquet" (needs pandas and pyarrow)
+    fused_processing=False,  # Reclassify, resample and cloud filter each scene in one in-memory pass
+    fused_dump_intermediates=False,  # In fused mode, also write reclassified/ and resampled/ copies
+    streaming=False,  # Overlap downloading with processing: each date window is unzipped, mosaicked and processed (fused) as soon as it is downloaded
+    stream_window_days=7,  # Days per download window in streaming mode
+    stream_queue_size=4,  # Finished downloads / ready windows buffered between the stages before downloads wait
+    scene_inventory=True,  # List each scene folder once per run and share the parsed layer files between steps
+    scene_inventory_persist=False,  # Keep the folder listings in scene_inventory_file so a restarted run does not list them again
+    scene_inventory_file="data/cache/scene_inventory.json",
+    step_cache=True,  # Skip steps whose inputs, outputs and config keys are unchanged since their last run
+    step_cache_hash=False,  # Fingerprint files by content hash instead of mtime + size
+    log_level="INFO",  # "DEBUG" also logs a line per processed file
+    run_report_dir="data/reports",  # Where the JSON run report with per-step timings is written
+    run_report_hooks=None,  # "module:function" strings called with ("step" | "run", metrics)
+    product_store=False,  # Download, unzip, mosaic and reclassify each product once and link it into every reference raster's folder
+    product_store_dir="data/clms_data/store",
+    incremental=False,  # Keep earlier data and only download/process missing dates
 )
@@ -1,5 +1,6 @@
-from config import config
-from clms_pipeline.pipeline import CLMSPipeline
+import sys
 
-pipeline = CLMSPipeline(config)
-pipeline.run()
+from clms_pipeline.cli import main
+
+# "python main.py [--force STEP ...]" runs the whole pipeline, as before the subcommands
+sys.exit(main())
@@ -0,0 +1,52 @@
+import pytest
+
+from clms_pipeline import cli
+from clms_pipeline.pipeline import CLMSPipeline
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    # (config options, run arguments) of each main() call
+    calls = []
+    load_config = cli.load_config
+
+    def record_config(path, options):
+        calls.append([list(options)])
+        return load_config(path, options)
+
+    monkeypatch.setattr(cli, "load_config", record_config)
+    monkeypatch.setattr(CLMSPipeline, "run", lambda self, force=(), only=None: calls[-1].append((list(force), only)))
+    return calls
+
+
+@pytest.mark.parametrize("argv", [
+    ["--force", "resample", "--set", "cc_threshold=0.3"],
+    ["--set", "cc_threshold=0.3", "--force", "resample"],
+    ["run", "--set", "cc_threshold=0.3", "--force", "resample"],
+])
+def test_options_in_any_order(calls, argv):
+    assert cli.main(argv) == 0
+    assert calls == [[["cc_threshold=0.3"], (["resample"], None)]]
+
+
+def test_options_before_and_after_command(calls):
+    assert cli.main(["--set", "cc_threshold=0.3", "cloud_filter", "--set", "filter_cc=true"]) == 0
+    assert calls == [[["cc_threshold=0.3", "filter_cc=true"], ([], ["cloud_filter"])]]
+
+
+def test_step_not_in_pipeline_fails(calls):
+    assert cli.main(["fused"]) == 1
+    assert calls == [[[]]]
+
+
+def test_unknown_forced_step_fails(calls):
+    assert cli.main(["--force", "resampel"]) == 1
+    assert calls == [[[]]]
+
+
+def test_pipeline_rejects_unknown_steps():
+    pipeline = CLMSPipeline(cli.load_config())
+    with pytest.raises(ValueError, match="resampel"):
+        pipeline.run(only=["resampel"])
+    with pytest.raises(ValueError, match="resampel"):
+        pipeline.run(force=["resampel"])
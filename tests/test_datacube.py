@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from config import CLMSConfig
+from clms_pipeline.datacube import Datacube, open_datacube
+from clms_pipeline.reference_grid import ReferenceGrid
+from clms_pipeline.steps.datacube import DatacubeExporter
+
+GRID = ReferenceGrid(None, CRS.from_epsg(32632), from_origin(600000, 5100000, 20, 20), 4, 3, 255, "uint8")
+
+
+def write_date(tmp_path, yyyymmdd, value, width=4):
+    path = tmp_path / "cc_filtered" / f"FSC_{yyyymmdd}T102559_S2A_T32TPS_V102_1" / f"FSC_{yyyymmdd}T102559_S2A_T32TPS_V102_1_FSCOG_resampled.tif"
+    os.makedirs(path.parent, exist_ok=True)
+    profile = dict(driver="GTiff", width=width, height=3, count=1, dtype="uint8", crs="EPSG:32632",
+                   transform=GRID.transform, nodata=255)
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(np.full((1, 3, width), value, dtype="uint8"))
+    return str(path)
+
+
+@pytest.fixture
+def export(tmp_path):
+    exporter = DatacubeExporter(CLMSConfig([], "user", "password"))
+    cube_path = str(tmp_path / "FSCOG.dat")
+
+    def run():
+        by_date = exporter.collect_layers(str(tmp_path / "cc_filtered"))["FSCOG"]
+        exporter.export_layer(cube_path, "FSCOG", by_date, GRID)
+        cube, dates = open_datacube(cube_path)
+        return dates, [int(cube[i, 0, 0]) for i in range(len(dates))]
+
+    return run
+
+
+def test_datacube_create_append_write(tmp_path):
+    cube = Datacube(str(tmp_path / "cube.dat"))
+    cube.create(GRID, "uint8", 255)
+    cube.append("20230701", np.full((3, 4), 1, dtype="uint8"), [["a.tif", 1.0]])
+    cube.append("20230702", np.full((3, 4), 2, dtype="uint8"), [["b.tif", 1.0]])
+    cube.write("20230701", np.full((3, 4), 3, dtype="uint8"), [["a.tif", 2.0]])
+    cube.save_index()
+    reopened = Datacube(str(tmp_path / "cube.dat"))
+    assert reopened.dates == ["20230701", "20230702"]
+    assert reopened.index["sources"]["20230701"] == [["a.tif", 2.0]]
+    arr, dates = open_datacube(str(tmp_path / "cube.dat"))
+    assert arr.shape == (2, 3, 4) and arr[0].max() == 3 and arr[1].min() == 2
+
+
+def test_export_appends_new_dates(tmp_path, export):
+    write_date(tmp_path, "20230701", 1)
+    assert export() == (["20230701"], [1])
+    write_date(tmp_path, "20230703", 3)
+    assert export() == (["20230701", "20230703"], [1, 3])
+
+
+def test_export_rebuilds_for_older_date(tmp_path, export):
+    write_date(tmp_path, "20230703", 3)
+    export()
+    write_date(tmp_path, "20230701", 1)
+    assert export() == (["20230701", "20230703"], [1, 3])
+
+
+def test_export_drops_removed_dates(tmp_path, export):
+    path = write_date(tmp_path, "20230701", 1)
+    write_date(tmp_path, "20230703", 3)
+    export()
+    # e.g. no longer below the cloud threshold
+    os.remove(path)
+    assert export() == (["20230703"], [3])
+
+
+def test_export_records_empty_dates(tmp_path, export, monkeypatch):
+    write_date(tmp_path, "20230701", 1)
+    write_date(tmp_path, "20230702", 2, width=5)  # not on the reference grid
+    assert export() == (["20230701"], [1])
+    assert list(Datacube(str(tmp_path / "FSCOG.dat")).empty) == ["20230702"]
+    read = []
+    monkeypatch.setattr(DatacubeExporter, "read_date", lambda self, paths, grid, nodata: read.append(paths))
+    assert export() == (["20230701"], [1])
+    assert read == []
@@ -0,0 +1,96 @@
+import json
+import os
+import sys
+
+import pytest
+
+from clms_pipeline import download_scheduler
+from clms_pipeline.benchmarks import fake_downloader
+from clms_pipeline.download_scheduler import DownloadJob, DownloadScheduler
+
+PRODUCT_ID = "FSC_20230701T102559_S2A_T32TPS_V102_1"
+
+
+def write_manifest(products_dir):
+    with open(os.path.join(products_dir, fake_downloader.MANIFEST_NAME), "w") as f:
+        json.dump({"products": [{"id": PRODUCT_ID, "tile": "32TPS", "product_type": "FSC", "date": "2023-07-01"}]}, f)
+
+
+@pytest.fixture
+def products_dir(tmp_path, monkeypatch):
+    products_dir = tmp_path / "products"
+    products_dir.mkdir()
+    (products_dir / f"{PRODUCT_ID}.zip").write_bytes(b"zip")
+    monkeypatch.setenv(fake_downloader.PRODUCTS_ENV, str(products_dir))
+    return products_dir
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(download_scheduler.time, "sleep", delays.append)
+    return delays
+
+
+def make_job(tmp_path, name):
+    output_dir = str(tmp_path / name)
+    cmd = [sys.executable, fake_downloader.__file__, "-download", "-productIdentifier", "32TPS", "-productType", "FSC",
+           "-obsDateMin", "2023-07-01T00:00:00Z", "-obsDateMax", "2023-07-01T23:59:59Z", output_dir]
+    return DownloadJob(name, cmd, output_dir)
+
+
+def test_success(tmp_path, products_dir, sleeps):
+    write_manifest(products_dir)
+    [result] = DownloadScheduler(retries=2).run([make_job(tmp_path, "job")])
+    assert result.success and result.attempts == 1 and result.returncode == 0
+    assert os.path.exists(tmp_path / "job" / f"{PRODUCT_ID}.zip")
+    assert sleeps == []
+
+
+def test_non_zero_exit_is_retried_with_backoff(tmp_path, products_dir, monkeypatch):
+    delays = []
+
+    def sleep(delay):
+        # The products show up after the second failed attempt
+        delays.append(delay)
+        if len(delays) == 2:
+            write_manifest(products_dir)
+
+    monkeypatch.setattr(download_scheduler.time, "sleep", sleep)
+    [result] = DownloadScheduler(retries=3, backoff=0.5).run([make_job(tmp_path, "job")])
+    assert result.success and result.attempts == 3
+    assert delays == [0.5, 1.0]
+
+
+def test_retries_exhausted(tmp_path, products_dir, sleeps):
+    [result] = DownloadScheduler(retries=1, backoff=0.5).run([make_job(tmp_path, "job")])
+    assert not result.success and result.attempts == 2
+    assert result.returncode == 1 and result.error == "exit code 1"
+    assert sleeps == [0.5]
+
+
+def test_timeout(tmp_path, products_dir, sleeps):
+    write_manifest(products_dir)
+    [result] = DownloadScheduler(retries=0, timeout=0.001).run([make_job(tmp_path, "job")])
+    assert not result.success and result.returncode is None
+    assert result.error == "timed out after 0.001s"
+
+
+def test_failing_jobs_do_not_affect_others(tmp_path, products_dir, sleeps):
+    write_manifest(products_dir)
+
+    def fail():
+        raise RuntimeError("bad response")
+
+    jobs = [
+        make_job(tmp_path, "first"),
+        DownloadJob("in-process", None, str(tmp_path / "in-process"), func=fail),
+        # Not a valid command line
+        DownloadJob("broken", [sys.executable, None], str(tmp_path / "broken")),
+        make_job(tmp_path, "last"),
+    ]
+    results = DownloadScheduler(max_workers=2, retries=0).run(jobs)
+    assert [r.job.name for r in results] == ["first", "in-process", "broken", "last"]
+    assert [r.success for r in results] == [True, False, False, True]
+    assert results[1].error == "RuntimeError: bad response"
+    assert results[2].error.startswith("TypeError: ")
@@ -0,0 +1,16 @@
+from clms_pipeline.steps.downloader import get_window_index, split_date_ranges
+
+
+def test_split_date_ranges_at_window_boundaries():
+    ranges = [("2023-07-03T00:00:00Z", "2023-07-16T12:00:00Z"), ("2023-08-01T00:00:00Z", "2023-08-02T23:59:59Z")]
+    assert split_date_ranges(ranges, 7, "2023-07-01T00:00:00Z") == [
+        ("2023-07-03T00:00:00Z", "2023-07-07T23:59:59Z"),
+        ("2023-07-08T00:00:00Z", "2023-07-14T23:59:59Z"),
+        ("2023-07-15T00:00:00Z", "2023-07-16T12:00:00Z"),
+        ("2023-08-01T00:00:00Z", "2023-08-02T23:59:59Z"),
+    ]
+
+
+def test_window_index():
+    assert get_window_index("2023-07-07T23:59:59Z", "2023-07-01T00:00:00Z", 7) == 0
+    assert get_window_index("20230708", "2023-07-01T00:00:00Z", 7) == 1
@@ -0,0 +1,54 @@
+import os
+
+from clms_pipeline.executor import ParallelExecutor
+
+
+def square(value):
+    return value * value
+
+
+def fail(value):
+    if value == 3:
+        raise ValueError("bad value")
+    return value
+
+
+def die(value):
+    if value == 5:
+        # A worker killed by the OS, e.g. for running out of memory
+        os._exit(1)
+    return value
+
+
+def test_results_in_input_order():
+    results = ParallelExecutor(workers=2, chunksize=2).map(square, range(7))
+    assert [r.value for r in results] == [v * v for v in range(7)]
+    assert all(r.ok for r in results)
+
+
+def test_error_is_collected():
+    results = ParallelExecutor(workers=2).map(fail, range(6))
+    assert "ValueError: bad value" in results[3].error
+    assert [r.value for r in results if r.ok] == [0, 1, 2, 4, 5]
+
+
+def test_dead_worker_fails_unfinished_items():
+    # Which other items were still running when the pool broke varies
+    results = ParallelExecutor(workers=2).map(die, range(8))
+    assert [r.item for r in results] == list(range(8))
+    assert "BrokenProcessPool" in results[5].error
+    assert all(r.value == r.item for r in results if r.ok)
+
+
+def test_started_pool_is_reused_and_replaced_when_broken():
+    executor = ParallelExecutor(workers=2)
+    executor.start()
+    try:
+        pool = executor.pool
+        assert [r.value for r in executor.map(square, range(3))] == [0, 1, 4]
+        assert executor.pool is pool
+        executor.map(die, range(8))
+        assert [r.value for r in executor.map(square, range(3))] == [0, 1, 4]
+    finally:
+        executor.shutdown()
+    assert executor.pool is None
@@ -0,0 +1,106 @@
+import os
+import json
+import hashlib
+
+import pytest
+
+pytest.importorskip("requests")
+
+from clms_pipeline.benchmarks.fake_downloader import MANIFEST_NAME
+from clms_pipeline.benchmarks.mock_server import start_server
+from clms_pipeline.hrsi_client import ChecksumError, HRSIClient, get_download_info, parse_checksum
+
+PRODUCT_ID = "FSC_20230701T102031_S2B_T32TPS_V102_1"
+
+
+@pytest.fixture
+def products_dir(tmp_path):
+    products = tmp_path / "products"
+    products.mkdir()
+    (products / f"{PRODUCT_ID}.zip").write_bytes(os.urandom(300000))
+    manifest = {"products": [{"id": PRODUCT_ID, "tile": "32TPS", "product_type": "FSC", "date": "2023-07-01"}]}
+    (products / MANIFEST_NAME).write_text(json.dumps(manifest))
+    return products
+
+
+def get_client(url, tmp_path):
+    return HRSIClient("user", "password", api_url=url, timeout=10, partial_dir=str(tmp_path / "partial"))
+
+
+def get_product(client):
+    name, url, size, checksum = get_download_info(client.search("32TPS", "FSC", "2023-07-01", "2023-07-01")[0])
+    assert name == PRODUCT_ID
+    return url, size, checksum
+
+
+def test_parse_checksum():
+    assert parse_checksum("md5:ABC") == ("md5", "abc")
+    assert parse_checksum("SHA-256=ab") == ("sha256", "ab")
+    assert parse_checksum("abc") == ("md5", "abc")
+    assert parse_checksum("crc99:abc") is None
+    assert parse_checksum("") is None
+
+
+def test_interrupted_download_is_resumed(products_dir, tmp_path):
+    server, url = start_server(str(products_dir), fail_after=100000)
+    try:
+        client = get_client(url, tmp_path)
+        product_url, size, checksum = get_product(client)
+        dst = str(tmp_path / f"{PRODUCT_ID}.zip")
+        with pytest.raises(IOError):
+            client.download(product_url, dst, size, checksum)
+        part = tmp_path / "partial" / f"{PRODUCT_ID}.zip.part"
+        assert 0 < part.stat().st_size < size
+        client.download(product_url, dst, size, checksum)
+    finally:
+        server.shutdown()
+    assert not part.exists()
+    assert open(dst, "rb").read() == (products_dir / f"{PRODUCT_ID}.zip").read_bytes()
+
+
+def test_oversized_partial_is_restarted(products_dir, tmp_path):
+    server, url = start_server(str(products_dir))
+    try:
+        client = get_client(url, tmp_path)
+        product_url, size, checksum = get_product(client)
+        part = tmp_path / "partial" / f"{PRODUCT_ID}.zip.part"
+        part.parent.mkdir()
+        part.write_bytes(b"x" * (size + 10))
+        dst = str(tmp_path / f"{PRODUCT_ID}.zip")
+        client.download(product_url, dst, size, checksum)
+    finally:
+        server.shutdown()
+    assert open(dst, "rb").read() == (products_dir / f"{PRODUCT_ID}.zip").read_bytes()
+
+
+def test_complete_partial_with_wrong_content_is_removed(products_dir, tmp_path):
+    server, url = start_server(str(products_dir))
+    try:
+        client = get_client(url, tmp_path)
+        product_url, size, checksum = get_product(client)
+        part = tmp_path / "partial" / f"{PRODUCT_ID}.zip.part"
+        part.parent.mkdir()
+        part.write_bytes(b"x" * size)
+        dst = str(tmp_path / f"{PRODUCT_ID}.zip")
+        # The server answers 416, the stale file fails the checksum and is dropped
+        with pytest.raises(ChecksumError):
+            client.download(product_url, dst, size, checksum)
+        assert not part.exists()
+        client.download(product_url, dst, size, checksum)
+    finally:
+        server.shutdown()
+    assert hashlib.md5(open(dst, "rb").read()).hexdigest() == checksum[1]
+
+
+def test_checksum_mismatch(products_dir, tmp_path):
+    server, url = start_server(str(products_dir))
+    try:
+        client = get_client(url, tmp_path)
+        product_url, size, _ = get_product(client)
+        dst = str(tmp_path / f"{PRODUCT_ID}.zip")
+        with pytest.raises(ChecksumError):
+            client.download(product_url, dst, size, ("md5", "0" * 32))
+    finally:
+        server.shutdown()
+    assert not os.path.exists(dst)
+    assert not (tmp_path / "partial" / f"{PRODUCT_ID}.zip.part").exists()
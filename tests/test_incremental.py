@@ -0,0 +1,58 @@
+import os
+from datetime import datetime, timezone
+
+from config import CLMSConfig
+from clms_pipeline.incremental import ProductManifest, is_up_to_date, parse_scene_ids
+
+
+def test_parse_scene_ids():
+    lines = [
+        "https://example.org/FSC_20230701T102559_S2A_T32TPS_V102_1.zip\n",
+        "GFSC_20230702-007_S2_T32TPS_V101_1\n",
+        "no scene here\n",
+    ]
+    assert parse_scene_ids(lines) == {
+        "20230701": ["FSC_20230701T102559_S2A_T32TPS_V102_1"],
+        "20230702": ["GFSC_20230702-007_S2_T32TPS_V101_1"],
+    }
+
+
+def test_is_up_to_date_stats_vsizip_inputs(tmp_path):
+    zip_path = tmp_path / "scene.zip"
+    zip_path.write_bytes(b"")
+    output = tmp_path / "out.tif"
+    output.write_bytes(b"")
+    os.utime(zip_path, (1000, 1000))
+    os.utime(output, (2000, 2000))
+    config = CLMSConfig([], "user", "password", incremental=True)
+    inputs = [f"/vsizip/{zip_path}/scene/FSC_FSCOG.tif"]
+    assert is_up_to_date(config, str(output), inputs)
+    os.utime(zip_path, (3000, 3000))
+    assert not is_up_to_date(config, str(output), inputs)
+
+
+def test_missing_ranges(tmp_path):
+    manifest = ProductManifest(str(tmp_path))
+    # A day without products counts as covered once it is settled
+    manifest.record_query("32TPS", "2023-07-03T00:00:00Z", "2023-07-04T23:59:59Z",
+                          ["FSC_20230703T102559_S2A_T32TPS_V102_1.zip"])
+    assert manifest.missing_ranges("32TPS", "2023-07-01T10:00:00Z", "2023-07-06T12:00:00Z") == [
+        ("2023-07-01T10:00:00Z", "2023-07-02T23:59:59Z"),
+        ("2023-07-05T00:00:00Z", "2023-07-06T12:00:00Z"),
+    ]
+    assert manifest.missing_ranges("32TQS", "2023-07-03T00:00:00Z", "2023-07-03T23:59:59Z") == [
+        ("2023-07-03T00:00:00Z", "2023-07-03T23:59:59Z"),
+    ]
+    manifest.save()
+    reloaded = ProductManifest(str(tmp_path))
+    assert reloaded.tiles == manifest.tiles
+    assert reloaded.missing_ranges("32TPS", "2023-07-03T00:00:00Z", "2023-07-04T23:59:59Z") == []
+
+
+def test_recent_days_stay_missing(tmp_path):
+    manifest = ProductManifest(str(tmp_path), settle_days=2)
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    manifest.record_query("32TPS", f"{today}T00:00:00Z", f"{today}T23:59:59Z", [])
+    assert manifest.missing_ranges("32TPS", f"{today}T00:00:00Z", f"{today}T23:59:59Z") == [
+        (f"{today}T00:00:00Z", f"{today}T23:59:59Z"),
+    ]
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from config import CLMSConfig
+from clms_pipeline.steps.mosaic import MosaicBuilder
+
+
+def write_tile(path, x, value):
+    # 20 x 20 tiles at 20 m, each with a no data corner
+    data = np.full((1, 20, 20), value, dtype="uint8")
+    data[:, :5, :5] = 255
+    profile = dict(driver="GTiff", width=20, height=20, count=1, dtype="uint8", crs="EPSG:32632",
+                   transform=from_origin(x, 5100000, 20, 20), nodata=255)
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data)
+    return str(path)
+
+
+@pytest.fixture
+def tiles(tmp_path):
+    # Overlapping by half a tile
+    return [write_tile(tmp_path / "a.tif", 600000, 10), write_tile(tmp_path / "b.tif", 600200, 20)]
+
+
+def read(path):
+    with rasterio.open(path) as src:
+        return src.read(), src.transform
+
+
+def test_windowed_mosaic_matches_merge(tmp_path, tiles):
+    builder = MosaicBuilder(CLMSConfig([], "user", "password", mosaic_block_size=7))
+    builder.mosaic_images(tiles, str(tmp_path / "merged.tif"))
+    assert builder.mosaic_images_windowed(tiles, str(tmp_path / "windowed.tif"))
+    merged, merged_transform = read(tmp_path / "merged.tif")
+    windowed, windowed_transform = read(tmp_path / "windowed.tif")
+    assert merged_transform == windowed_transform
+    assert np.array_equal(merged, windowed)
+    # The first tile wins where both have data, the second fills its no data corner
+    assert merged[0, 0, 10] == 10 and merged[0, 0, 2] == 255 and merged[0, 0, 12] == 10
+    assert merged[0, 0, 22] == 20
+
+
+def test_vrt_mosaic_matches_geotiff(tmp_path, tiles):
+    pytest.importorskip("osgeo.gdal")
+    builder = MosaicBuilder(CLMSConfig([], "user", "password"))
+    assert builder.mosaic_images_windowed(tiles, str(tmp_path / "mosaic.tif"))
+    assert builder.build_vrt(tiles, str(tmp_path / "mosaic.vrt"))
+    tif, tif_transform = read(tmp_path / "mosaic.tif")
+    vrt, vrt_transform = read(tmp_path / "mosaic.vrt")
+    assert tif_transform == vrt_transform
+    assert np.array_equal(tif, vrt)
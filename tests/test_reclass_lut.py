@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from config import CLMSConfig
+from clms_pipeline.reclass_lut import RAW_CLOUD, RAW_NODATA, RECLASS_ENCODINGS, ReclassTable, read_encoding
+from clms_pipeline.steps.cloud_filter import CloudFilter
+from clms_pipeline.steps.reclassify import Reclassifier
+
+CODES = np.arange(256, dtype=np.uint8)
+VALID = np.array([v for v in range(256) if v not in (RAW_CLOUD, RAW_NODATA)])
+
+
+def make_config(**kwargs):
+    return CLMSConfig([], "user", "password", **kwargs)
+
+
+def baseline_reclassify(arr):
+    # Reclassifier.reclassify_array before lookup tables
+    arr = arr.astype(np.float32)
+    arr[arr == 205] = -9999
+    arr[arr == 255] = -9999
+    return arr
+
+
+def test_default_table_matches_baseline():
+    out = ReclassTable.from_config(make_config()).apply(CODES, "FSC", "FSCOG")
+    expected = baseline_reclassify(CODES)
+    assert out.dtype == expected.dtype
+    assert np.array_equal(out, expected)
+
+
+@pytest.mark.parametrize("dtype", sorted(RECLASS_ENCODINGS))
+def test_encodings_keep_cloud_and_nodata_apart(dtype):
+    table = ReclassTable.from_config(make_config(reclass_dtype=dtype, reclass_cloud_as_nodata=False))
+    out = table.apply(CODES, "FSC", "FSCOG")
+    encoding = table.encoding
+    assert out.dtype == np.dtype(dtype)
+    assert encoding["cloud"] != encoding["nodata"]
+    assert out[RAW_CLOUD] == encoding["cloud"] and out[RAW_NODATA] == encoding["nodata"]
+    # No valid code collides with either
+    assert not np.isin(out[VALID], [encoding["cloud"], encoding["nodata"]]).any()
+    assert np.array_equal(out[VALID], VALID.astype(dtype))
+
+
+@pytest.mark.parametrize("dtype", ["int16", "uint8"])
+def test_cloud_filter_reads_compact_outputs(tmp_path, dtype):
+    # 2 no data, 2 cloud, 6 clear pixels
+    raw = np.array([[255, 255, 205, 205, 0, 10, 50, 80, 100, 100]], dtype=np.uint8)
+    src_path = str(tmp_path / "FSC_20230701T102559_S2A_T32TPS_V102_1_FSCOG.tif")
+    profile = dict(driver="GTiff", width=10, height=1, count=1, dtype="uint8", crs="EPSG:32632",
+                   transform=from_origin(600000, 5100000, 20, 20), nodata=255)
+    with rasterio.open(src_path, "w", **profile) as dst:
+        dst.write(raw[np.newaxis])
+    config = make_config(reclass_dtype=dtype, reclass_cloud_as_nodata=False)
+    out_path = str(tmp_path / "FSC_20230701T102559_S2A_T32TPS_V102_1_FSCOG_reclass.tif")
+    Reclassifier(config).reclassify_file((src_path, out_path, True, None, "FSC", "FSCOG", False))
+    with rasterio.open(out_path) as src:
+        assert src.dtypes[0] == dtype
+        encoding = read_encoding(src)
+        arr = src.read(1)
+    cloud_filter = CloudFilter(config)
+    assert cloud_filter.get_cloud_fraction(arr, encoding) == 2 / 8
+    stats = cloud_filter.get_scene_stats(out_path, None, True, "FSC")
+    assert stats["cloud_fraction"] == 2 / 8 and stats["valid_fraction"] == 8 / 10
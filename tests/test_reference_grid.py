@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from config import CLMSConfig
+from clms_pipeline import reference_grid
+from clms_pipeline.reference_grid import ReferenceGrid, get_reference_grid
+
+
+def write_reference(path, value):
+    profile = dict(driver="GTiff", width=4, height=3, count=1, dtype="float32", crs="EPSG:32632",
+                   transform=from_origin(600000, 5100000, 100, 100), nodata=-9999)
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(np.full((1, 3, 4), value, dtype="float32"))
+
+
+def test_grid_is_read_from_cache_until_the_raster_changes(tmp_path, monkeypatch):
+    write_reference(tmp_path / "dem.tif", 1)
+    os.utime(tmp_path / "dem.tif", (1_000_000_000, 1_000_000_000))
+    config = CLMSConfig([], "user", "password", reference_raster_dir=str(tmp_path),
+                        reference_grid_cache_dir=str(tmp_path / "cache"))
+    entry = {"name": "dem.tif"}
+    grid = get_reference_grid(config, entry)
+    assert grid.shape == (3, 4)
+    assert grid.data_path and os.path.exists(grid.data_path)
+
+    # A new process (empty in-memory cache) reads the binary copy, not the raster
+    parsed = []
+    from_raster = ReferenceGrid.from_raster.__func__
+    monkeypatch.setattr(ReferenceGrid, "from_raster",
+                        classmethod(lambda cls, *args: parsed.append(args) or from_raster(cls, *args)))
+    monkeypatch.setattr(reference_grid, "_loaded_grids", {})
+    cached = get_reference_grid(config, entry)
+    assert parsed == []
+    assert cached.transform == grid.transform and cached.crs == grid.crs and cached.nodata == -9999
+    assert np.all(cached.read() == 1)
+
+    # Same in-memory cache, but the raster was rewritten: parsed again
+    write_reference(tmp_path / "dem.tif", 2)
+    updated = get_reference_grid(config, entry)
+    assert len(parsed) == 1
+    assert np.all(updated.read() == 2)
+    monkeypatch.setattr(reference_grid, "_loaded_grids", {})
+    assert np.all(get_reference_grid(config, entry).read() == 2)
+    assert len(parsed) == 1
@@ -0,0 +1,41 @@
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from rasterio.warp import Resampling
+
+from config import CLMSConfig
+from clms_pipeline.reference_grid import ReferenceGrid
+from clms_pipeline.steps import resample
+from clms_pipeline.steps.resample import Resampler
+
+
+def make_grid(x, y):
+    return ReferenceGrid(None, CRS.from_epsg(32632), from_origin(x, y, 50, 50), 8, 8, -9999, "float32")
+
+
+def run_group(tmp_path, name):
+    src_path = tmp_path / "src.tif"
+    profile = dict(driver="GTiff", width=200, height=200, count=1, dtype="uint8", crs="EPSG:32632",
+                   transform=from_origin(600000, 5100000, 20, 20), nodata=255)
+    with rasterio.open(src_path, "w", **profile) as dst:
+        dst.write(np.arange(200 * 200, dtype=np.uint32).reshape(1, 200, 200).astype("uint8") % 200)
+    # Opposite corners of the tile
+    grids = [make_grid(600100, 5099900), make_grid(603500, 5096500)]
+    targets = [(grid, str(tmp_path / f"{name}_{i}.tif"), Resampling.bilinear, None, True) for i, grid in enumerate(grids)]
+    config = CLMSConfig([], "user", "password", aoi_windowed_reads=True)
+    Resampler(config).resample_group((str(src_path), targets))
+    outputs = []
+    for _, path, _, _, _ in targets:
+        with rasterio.open(path) as src:
+            outputs.append(src.read())
+    return outputs
+
+
+def test_far_apart_grids_are_read_one_by_one(tmp_path, monkeypatch):
+    separate = run_group(tmp_path, "separate")
+    # Forces the single read of the window covering both grids
+    monkeypatch.setattr(resample, "MAX_UNION_READ_RATIO", float("inf"))
+    shared = run_group(tmp_path, "shared")
+    for a, b in zip(separate, shared):
+        assert np.array_equal(a, b)
@@ -0,0 +1,25 @@
+import pickle
+
+import pytest
+
+from config import CLMSConfig
+from clms_pipeline.run_report import RunReport, load_hook
+from clms_pipeline.step_cache import StepSpec
+
+
+def test_hooks_in_config_must_be_names():
+    assert load_hook("os.path:join") is not None
+    with pytest.raises(ValueError):
+        load_hook(lambda event, payload: None)
+
+
+def test_callable_hooks_stay_off_the_config(tmp_path):
+    events = []
+    config = CLMSConfig([], "user", "password", run_report_dir=str(tmp_path), run_report_hooks=["os.path:exists"])
+    report = RunReport(config, hooks=[lambda event, payload: events.append(event)])
+    report.start_step(StepSpec("tiles", None, [], inputs=[str(tmp_path / "in")]))
+    report.end_step("ran")
+    report.save()
+    assert events == ["step", "run"]
+    # Parallel tasks pickle the config
+    pickle.dumps(config)
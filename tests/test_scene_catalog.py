@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+
+from clms_pipeline.reclass_lut import RAW_ENCODING
+from clms_pipeline.scene_catalog import SceneCatalog, compute_scene_stats, get_catalog_path
+
+
+def make_stats(cloud, valid=1.0, snow=None):
+    return {"cloud_fraction": cloud, "valid_fraction": valid, "snow_fraction": snow, "mean_fsc": None}
+
+
+def test_compute_scene_stats():
+    # 2 no data, 2 cloud, 4 clear of which 3 with snow
+    arr = np.array([255, 255, 205, 205, 0, 40, 60, 100], dtype=np.uint8)
+    stats = compute_scene_stats(arr, RAW_ENCODING, "FSC")
+    assert stats["valid_fraction"] == 6 / 8
+    assert stats["cloud_fraction"] == 2 / 6
+    assert stats["snow_fraction"] == 3 / 4
+    assert stats["mean_fsc"] == 50.0
+
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet"])
+def test_save_load_and_mask_validity(tmp_path, fmt):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+    mask = tmp_path / "FSC_20230701T102559_S2A_T32TPS_V102_1_FSCOG.tif"
+    mask.write_bytes(b"")
+    catalog = SceneCatalog(get_catalog_path(str(tmp_path), fmt), fmt)
+    catalog.update("FSC_20230701T102559_S2A_T32TPS_V102_1", make_stats(0.25, snow=0.5), str(mask), [str(mask)],
+                   tiles=["32TPS"])
+    catalog.save()
+    loaded = SceneCatalog(get_catalog_path(str(tmp_path), fmt), fmt).load()
+    row = loaded.get("FSC_20230701T102559_S2A_T32TPS_V102_1", str(mask))
+    assert row["date"] == "20230701" and row["tiles"] == ["32TPS"] and row["files"] == [str(mask)]
+    assert row["cloud_fraction"] == 0.25 and row["snow_fraction"] == 0.5 and row["mean_fsc"] is None
+    # A changed mask makes the row stale
+    stat = os.stat(mask)
+    os.utime(mask, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert loaded.get("FSC_20230701T102559_S2A_T32TPS_V102_1", str(mask)) is None
+
+
+def test_select_and_prune(tmp_path):
+    catalog = SceneCatalog(str(tmp_path / "scene_catalog.csv"))
+    catalog.update("20230703", make_stats(0.1, snow=0.8), None, [], tiles=["32TPS", "32TQS"])
+    catalog.update("20230701", make_stats(0.6, snow=0.9), None, [], tiles=["32TPS"])
+    catalog.update("20230702", make_stats(0.2, valid=0.1), None, [], tiles=["32TQS"])
+    assert [r["key"] for r in catalog.select(max_cloud=0.5)] == ["20230702", "20230703"]
+    assert [r["key"] for r in catalog.select(min_valid=0.5, min_snow=0.5)] == ["20230701", "20230703"]
+    assert [r["key"] for r in catalog.select(start="2023-07-02", end="20230702")] == ["20230702"]
+    assert [r["key"] for r in catalog.select(tiles=["32TPS"])] == ["20230701", "20230703"]
+    catalog.prune(["20230701"])
+    assert list(catalog.rows) == ["20230701"]
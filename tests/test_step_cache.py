@@ -0,0 +1,130 @@
+import os
+
+from config import CLMSConfig
+from clms_pipeline.step_cache import StepCache, StepSpec
+
+
+def make_config(**kwargs):
+    return CLMSConfig([], "user", "password", **kwargs)
+
+
+class Recorder:
+    # Step function that records the step_reuse_outputs value it ran with
+    def __init__(self, config):
+        self.config = config
+        self.calls = []
+
+    def __call__(self):
+        self.calls.append(getattr(self.config, "step_reuse_outputs", None))
+
+
+def make_step(tmp_path, run):
+    return StepSpec("resample", run, ["crop_resample"], inputs=[str(tmp_path / "in")], outputs=[str(tmp_path / "out")],
+                    reuse_keys=["cc_threshold"])
+
+
+def test_unchanged_step_is_skipped(tmp_path):
+    (tmp_path / "in").mkdir()
+    (tmp_path / "in" / "a.tif").write_bytes(b"a")
+    config = make_config(crop_resample=True, cc_threshold=0.2)
+    run = Recorder(config)
+    state = str(tmp_path / "state.json")
+    assert StepCache(config, state).run(make_step(tmp_path, run))
+    assert not StepCache(config, state).run(make_step(tmp_path, run))
+    assert run.calls == [None]
+
+
+def test_changed_input_or_forced_step_runs(tmp_path):
+    (tmp_path / "in").mkdir()
+    (tmp_path / "in" / "a.tif").write_bytes(b"a")
+    config = make_config(crop_resample=True, cc_threshold=0.2)
+    run = Recorder(config)
+    state = str(tmp_path / "state.json")
+    StepCache(config, state).run(make_step(tmp_path, run))
+    (tmp_path / "in" / "b.tif").write_bytes(b"b")
+    assert StepCache(config, state).run(make_step(tmp_path, run))
+    assert StepCache(config, state, force=["resample"]).run(make_step(tmp_path, run))
+    # Unchanged config: files are reused; forced: everything is redone
+    assert run.calls == [None, True, False]
+
+
+def test_config_change_invalidates_outputs(tmp_path):
+    config = make_config(crop_resample=True, cc_threshold=0.2)
+    run = Recorder(config)
+    state = str(tmp_path / "state.json")
+    StepCache(config, state).run(make_step(tmp_path, run))
+    config.crop_resample = False
+    assert StepCache(config, state).run(make_step(tmp_path, run))
+    assert run.calls == [None, False]
+
+
+def test_reuse_key_change_keeps_outputs(tmp_path):
+    config = make_config(crop_resample=True, cc_threshold=0.2)
+    run = Recorder(config)
+    state = str(tmp_path / "state.json")
+    StepCache(config, state).run(make_step(tmp_path, run))
+    config.cc_threshold = 0.5
+    assert StepCache(config, state).run(make_step(tmp_path, run))
+    assert not StepCache(config, state).run(make_step(tmp_path, run))
+    assert run.calls == [None, True]
+    assert config.step_reuse_outputs is None
+    assert os.path.exists(state)
+
+
+def test_counts_come_from_the_fingerprint_walk(tmp_path):
+    (tmp_path / "in").mkdir()
+    (tmp_path / "in" / "a.tif").write_bytes(b"abc")
+    config = make_config(crop_resample=True, cc_threshold=0.2)
+
+    def write_output():
+        (tmp_path / "out").mkdir(exist_ok=True)
+        (tmp_path / "out" / "a.tif").write_bytes(b"abcd")
+
+    cache = StepCache(config, str(tmp_path / "state.json"))
+    cache.run(make_step(tmp_path, write_output))
+    assert cache.counts == {"files_in": 1, "bytes_in": 3, "files_out": 1, "bytes_out": 4}
+    cache.run(make_step(tmp_path, write_output))
+    assert cache.counts["files_out"] == 0
+
+
+def age(*paths):
+    # Older than the inventory's settle time, so their listings are trusted
+    for path in paths:
+        os.utime(path, (1_000_000_000, 1_000_000_000))
+
+
+def test_fingerprint_follows_nested_and_changed_files(tmp_path):
+    scene = tmp_path / "in" / "FSC" / "scene"
+    scene.mkdir(parents=True)
+    (scene / "a.tif").write_bytes(b"a")
+    (tmp_path / "in" / "FSC" / "mosaic").mkdir()
+    cache = StepCache(make_config(), str(tmp_path / "state.json"))
+    patterns = [str(tmp_path / "in" / "*")]
+    first = cache.scan_files(patterns, exclude=["mosaic"])
+    assert first["files"] == 1
+    (tmp_path / "in" / "FSC" / "mosaic" / "m.tif").write_bytes(b"m")
+    assert cache.scan_files(patterns, exclude=["mosaic"])["fingerprint"] == first["fingerprint"]
+    (scene / "b.zip").write_bytes(b"b")
+    second = cache.scan_files(patterns, exclude=["mosaic"])
+    assert second["files"] == 2
+    (scene / "a.tif").write_bytes(b"aa")
+    assert cache.scan_files(patterns, exclude=["mosaic"])["fingerprint"] != second["fingerprint"]
+
+
+def test_unchanged_folders_are_not_listed_again(tmp_path, monkeypatch):
+    import clms_pipeline.scene_inventory as scene_inventory
+    scene = tmp_path / "in" / "FSC" / "scene"
+    scene.mkdir(parents=True)
+    (scene / "a.tif").write_bytes(b"a")
+    age(scene, scene.parent, scene.parent.parent)
+    cache = StepCache(make_config(), str(tmp_path / "state.json"))
+    patterns = [str(tmp_path / "in" / "*")]
+    first = cache.scan_files(patterns)
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(scene_inventory.os, "scandir", lambda path: listed.append(path) or scandir(path))
+    assert cache.scan_files(patterns) == first
+    assert listed == []
+    (scene / "b.tif").write_bytes(b"b")
+    assert cache.scan_files(patterns)["files"] == 2
+    assert listed == [str(scene)]
@@ -0,0 +1,57 @@
+import geopandas as gpd
+import shapely
+import shapely.geometry
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from clms_pipeline.reference_grid import ReferenceGrid
+from clms_pipeline.tile_index import build_tile_index, get_aoi_footprint
+
+
+def write_kml(path, tiles):
+    gdf = gpd.GeoDataFrame({"Name": list(tiles)}, geometry=list(tiles.values()), crs="EPSG:4326")
+    gdf.to_file(path, driver="KML")
+
+
+def make_grid(left, top, right, bottom):
+    size = 0.0001
+    return ReferenceGrid(None, CRS.from_epsg(4326), from_origin(left, top, size, size),
+                         round((right - left) / size), round((top - bottom) / size), -9999, "float32")
+
+
+def baseline_tiles(kml_path, grid):
+    # Intersection as TileDeterminer did it before the index
+    tiles = gpd.read_file(kml_path)
+    return sorted(tiles[tiles.intersects(shapely.geometry.box(*grid.bounds))]["Name"])
+
+
+def test_index_matches_the_shapefile_intersection_near_tile_edges(tmp_path):
+    kml_path = str(tmp_path / "tiles.kml")
+    write_kml(kml_path, {
+        "32TMR": shapely.geometry.box(9, 45, 10, 46),
+        "32TNR": shapely.geometry.box(10, 45, 11, 46),
+        "32TMS": shapely.geometry.box(9, 46, 10, 47),
+        "32TNS": shapely.geometry.box(10, 46, 11, 47),
+    })
+    index = build_tile_index(kml_path, str(tmp_path / "index.npz"), tolerance=0.001)
+    grids = [
+        make_grid(9.5, 45.9, 9.9996, 45.5),  # inside the tolerance of 32TNR and 32TMS
+        make_grid(9.5, 46.0004, 10.0004, 45.5),  # just across both edges
+        make_grid(10.2, 45.8, 10.6, 45.2),
+    ]
+    matches = index.query([get_aoi_footprint(grid, index.crs) for grid in grids])
+    assert matches == [baseline_tiles(kml_path, grid) for grid in grids]
+    assert matches == [["32TMR"], ["32TMR", "32TMS", "32TNR", "32TNS"], ["32TNR"]]
+
+
+def test_tolerance_does_not_add_tiles(tmp_path):
+    kml_path = str(tmp_path / "tiles.kml")
+    write_kml(kml_path, {
+        "32TMR": shapely.geometry.box(9, 45, 10, 46),
+        "32TNR": shapely.geometry.box(10.0005, 45, 11, 46),
+    })
+    index = build_tile_index(kml_path, str(tmp_path / "index.npz"), tolerance=0.001)
+    aoi = get_aoi_footprint(make_grid(9.5, 45.9, 10, 45.5), index.crs)
+    # The buffered footprint of 32TNR reaches the AOI, the tile itself does not
+    assert len(index.tree.query(aoi, predicate="intersects")) == 2
+    assert index.query([aoi]) == [["32TMR"]]
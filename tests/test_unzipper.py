@@ -0,0 +1,32 @@
+import logging
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from config import CLMSConfig
+from clms_pipeline.steps.unzipper import Unzipper
+
+
+def test_corrupt_zip_is_logged_as_error(tmp_path, caplog):
+    scene = "FSC_20230701T102559_S2A_T32TPS_V102_1"
+    with zipfile.ZipFile(tmp_path / f"{scene}.zip", "w") as zf:
+        zf.writestr(f"{scene}/{scene}_FSCOG.tif", b"data")
+    (tmp_path / "FSC_20230702T102559_S2A_T32TPS_V102_1.zip").write_bytes(b"PK\x03\x04 truncated")
+    with caplog.at_level(logging.DEBUG), ThreadPoolExecutor(2) as pool:
+        Unzipper(CLMSConfig([], "user", "password")).unzip_folder(pool, str(tmp_path), "extract", "FSC")
+    errors = [r for r in caplog.records if r.levelno == logging.ERROR]
+    assert len(errors) == 1 and "20230702" in errors[0].getMessage()
+    assert (tmp_path / scene / f"{scene}_FSCOG.tif").exists()
+
+
+def test_vsizip_only_given_zips(tmp_path):
+    scenes = ["FSC_20230701T102559_S2A_T32TPS_V102_1", "FSC_20230702T102559_S2A_T32TPS_V102_1"]
+    for scene in scenes:
+        with zipfile.ZipFile(tmp_path / f"{scene}.zip", "w") as zf:
+            zf.writestr(f"{scene}/{scene}_FSCOG.tif", b"data")
+    with ThreadPoolExecutor(2) as pool:
+        Unzipper(CLMSConfig([], "user", "password")).unzip_folder(pool, str(tmp_path), "vsizip", "FSC",
+                                                                   zip_names=[f"{scenes[1]}.zip"])
+    assert not (tmp_path / scenes[0]).exists()
+    with open(tmp_path / scenes[1] / "vsizip_inventory.txt") as f:
+        assert f.read() == f"/vsizip/{tmp_path / scenes[1]}.zip/{scenes[1]}/{scenes[1]}_FSCOG.tif\n"
+    assert not (tmp_path / scenes[1] / "vsizip_inventory.txt.tmp").exists()
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("rasterio")
+
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.warp import reproject
+
+from clms_pipeline import warp_cache
+from clms_pipeline.warp_cache import WarpPlan, WarpPlanCache
+
+SRC_CRS = CRS.from_epsg(32632)
+SRC_TRANSFORM = from_origin(600000, 5200000, 20, 20)
+NODATA = 255
+
+
+def make_source(shape=(120, 100), seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.integers(0, 101, size=shape).astype(np.uint8)
+    data[:10] = NODATA
+    data[50:55, 40:60] = 205
+    return data
+
+
+def warp_with_gdal(data, dst_crs, dst_transform, dst_shape, method):
+    out = np.full(dst_shape, NODATA, dtype=np.uint8)
+    reproject(source=data, destination=out, src_transform=SRC_TRANSFORM, src_crs=SRC_CRS, src_nodata=NODATA,
+              dst_transform=dst_transform, dst_crs=dst_crs, dst_nodata=NODATA, resampling=method)
+    return out
+
+
+def warp_with_plan(cache, data, dst_crs, dst_transform, dst_shape, method):
+    plan = cache.get_plan(SRC_CRS, SRC_TRANSFORM, data.shape[1], data.shape[0],
+                          dst_crs, dst_transform, dst_shape[1], dst_shape[0], method)
+    window = plan.window
+    src = data[window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width]
+    return plan.apply(src, NODATA, NODATA, np.uint8)
+
+
+@pytest.mark.parametrize("method", [Resampling.nearest, Resampling.bilinear])
+def test_cached_plan_matches_reproject(tmp_path, method):
+    warp_cache._plans.clear()
+    data = make_source()
+    # A 10 m grid inside the source, offset by a fraction of a source pixel
+    dst_transform = from_origin(600203, 5199797, 10, 10)
+    dst_shape = (150, 130)
+    expected = warp_with_gdal(data, SRC_CRS, dst_transform, dst_shape, method)
+    cache = WarpPlanCache(str(tmp_path))
+    assert np.array_equal(warp_with_plan(cache, data, SRC_CRS, dst_transform, dst_shape, method), expected)
+    # The same plan again, from memory and then from disk
+    assert np.array_equal(warp_with_plan(cache, data, SRC_CRS, dst_transform, dst_shape, method), expected)
+    warp_cache._plans.clear()
+    assert np.array_equal(warp_with_plan(cache, data, SRC_CRS, dst_transform, dst_shape, method), expected)
+
+
+def test_plan_survives_pickling(tmp_path):
+    # Parallel tasks get a pickled copy of the cache; loaded plans stay in the worker's memory
+    import pickle
+    warp_cache._plans.clear()
+    cache = pickle.loads(pickle.dumps(WarpPlanCache(str(tmp_path))))
+    data = make_source()
+    warp_with_plan(cache, data, SRC_CRS, from_origin(600200, 5199800, 10, 10), (20, 20), Resampling.nearest)
+    assert len(warp_cache._plans) == 1
+
+
+def test_evict_keeps_newest_entries(tmp_path):
+    cache = WarpPlanCache(str(tmp_path), max_entries=2)
+    plan = WarpPlan.build(SRC_CRS, SRC_TRANSFORM, 10, 10, SRC_CRS, SRC_TRANSFORM, 10, 10, Resampling.nearest)
+    for i in range(4):
+        plan.save(str(tmp_path / f"{i}.npz"))
+    cache.evict()
+    assert len(list(tmp_path.glob("*.npz"))) == 2
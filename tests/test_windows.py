@@ -0,0 +1,44 @@
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from config import CLMSConfig
+from clms_pipeline.executor import ParallelExecutor
+from clms_pipeline.scene_inventory import SceneFile
+from clms_pipeline.windows import flag_empty_scenes
+
+CRS = "EPSG:32632"
+TRANSFORM = from_origin(600000, 5100000, 20, 20)
+
+
+def write_layer(path, value):
+    profile = dict(driver="GTiff", width=20, height=20, count=1, dtype="uint8", crs=CRS, transform=TRANSFORM, nodata=255)
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(np.full((1, 20, 20), value, dtype="uint8"))
+    return str(path)
+
+
+def scene_file(path, scene, layer):
+    return SceneFile(path, "FSC", "original", scene, None, None, layer, False)
+
+
+def test_scene_emptiness_is_decided_on_its_mask(tmp_path):
+    files = [
+        # Mask without data, other layer with data: the whole scene goes
+        scene_file(write_layer(tmp_path / "a_FSCOG.tif", 255), "a", "FSCOG"),
+        scene_file(write_layer(tmp_path / "a_QCFLAGS.tif", 0), "a", "QCFLAGS"),
+        # Mask with data, other layer without: the whole scene stays
+        scene_file(write_layer(tmp_path / "b_FSCOG.tif", 50), "b", "FSCOG"),
+        scene_file(write_layer(tmp_path / "b_QCFLAGS.tif", 255), "b", "QCFLAGS"),
+        # No mask layer: checked layer by layer
+        scene_file(write_layer(tmp_path / "c_QCFLAGS.tif", 255), "c", "QCFLAGS"),
+    ]
+    tasks = [(f.scene, (f.path,)) for f in files]
+    aoi = ((600000, 5099800, 600200, 5100000), CRS)
+    config = CLMSConfig([], "user", "password", aoi_windowed_reads=True)
+    flagged = flag_empty_scenes(config, ParallelExecutor(serial=True), tasks, files, "FSCOG", lambda f: f.scene, aoi)
+    assert flagged == [(files[2].path, False), (files[3].path, False), (files[4].path, True)]
+
+    config = CLMSConfig([], "user", "password", aoi_windowed_reads=False)
+    flagged = flag_empty_scenes(config, ParallelExecutor(serial=True), tasks, files, "FSCOG", lambda f: f.scene, aoi)
+    assert flagged == [(f.path, False) for f in files]